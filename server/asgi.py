@@ -0,0 +1,297 @@
+import io
+import os
+import sys
+import asyncio
+import threading
+from functools import partial
+
+import anyio.to_thread
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+import server
+from server import (
+    app as flask_app, Info, CORS_HEADERS, EXTRACTION_SYSTEM_PROMPT, TTS_VOICE_ID, TTS_MODEL_ID,
+    TTS_REQUEST_OPTIONS, TRANSITION_MESSAGE, MAX_AUDIO_JOBS, MAX_PROS_CONS_JOBS, WARMUP_RETRY_SECONDS,
+    OPENAI_CLIENT, QUESTION_AGENT, PRO_CON_AGENT, scoring_session,
+    extracted_info, has_none, add_message, answer_prompt, question_prompt, weights_prompt, apply_info,
+    transition_payload, question_payload, create_weights_agent, parse_weights, weighted_profile,
+    results_payload, results_error_payload, parse_pros_cons, speech_fields, add_job,
+)
+from recommendation_system import a_embed_texts, format_recommendations
+from components import Component, register_component, warm_up
+from metrics import logger, span
+from resilience import upstream, error_status
+from encoding import compressible, choose_encoding, compress
+
+# ============== ASYNC SERVING MODE ==============
+# ASGI entry point (from server/): uvicorn asgi:app --host 0.0.0.0 --port 5002
+# The I/O-bound endpoints await OpenAI, Ollama and ElevenLabs on async clients with
+# shared connection pools, so a slow upstream call holds a coroutine instead of a thread.
+# Same routes and JSON as server.py: every other route is served by the Flask app in a thread pool.
+
+# ============== ASYNC CLIENTS ==============
+# The OpenAI one is the async client inside OPENAI_CLIENT (datapizza builds it on first use)
+def create_async_elevenlabs_client():
+    from elevenlabs import AsyncElevenLabs
+    return AsyncElevenLabs(
+        api_key=os.environ.get("ELEVENLABS_API_KEY", ""),
+        base_url=os.environ.get("PYDEIA_ELEVENLABS_BASE_URL"),
+        timeout=upstream("elevenlabs").policy.timeout,
+    )
+
+ASYNC_ELEVENLABS_CLIENT = register_component("async_elevenlabs_client", create_async_elevenlabs_client)
+
+async def ready_value(component: Component):
+    """Value of a component, built in a worker thread if the warm-up has not done it yet"""
+    if component.ready:
+        return component.value
+    return await anyio.to_thread.run_sync(component.get)
+
+def json_response(request: Request, payload, status_code: int = 200) -> Response:
+    """Same encoding and compression as Flask's jsonify (see encoding.py)"""
+    body = flask_app.json.encode(payload) + b"\n"
+    headers = dict(CORS_HEADERS)
+    if compressible("application/json", len(body)):
+        headers["Vary"] = "Accept-Encoding"
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
+
+def submit(coroutine, jobs, limit: int) -> str:
+    """Schedules a background job on the event loop; stored as a concurrent Future like the Flask ones"""
+    return add_job(jobs, asyncio.run_coroutine_threadsafe(coroutine, asyncio.get_running_loop()), limit)
+
+# ============== UPSTREAM CALLS ==============
+
+async def extract_info(text: str, memory_obj=None) -> Info:
+    client = await ready_value(OPENAI_CLIENT)
+    with span("extraction", chars=len(text)):
+        response = await upstream("openai").a_call(partial(
+            client.a_structured_response,
+            input=f"Student text: {text}",
+            output_cls=Info,
+            memory=memory_obj,
+            system_prompt=EXTRACTION_SYSTEM_PROMPT,
+        ))
+    return extracted_info(text, response, memory_obj)
+
+async def generate_pros_cons(list_dict: list):
+    agent = await ready_value(PRO_CON_AGENT)
+    with span("pros_cons", options=len(list_dict)):
+        pro_con_response = await upstream("openai").a_call(partial(agent.a_run, f"Degree options: {list_dict}"))
+
+    logger.debug("\nPROS/CONS ANALYSIS:")
+    logger.debug(pro_con_response.text)
+
+    return parse_pros_cons(pro_con_response.text)
+
+async def synthesize_speech(text: str) -> bytes:
+    client = await ready_value(ASYNC_ELEVENLABS_CLIENT)
+
+    async def download() -> bytes:
+        audio_stream = client.text_to_speech.convert(
+            text=text,
+            voice_id=TTS_VOICE_ID,
+            model_id=TTS_MODEL_ID,
+            request_options=TTS_REQUEST_OPTIONS
+        )
+        return b"".join([chunk async for chunk in audio_stream])
+
+    with span("tts", chars=len(text)) as s:
+        audio_bytes = await upstream("elevenlabs").a_call(download, idempotent=True)
+        s["bytes"] = len(audio_bytes)
+    return audio_bytes
+
+async def speech(audio_id, inline: bool) -> dict:
+    if audio_id is not None and inline:
+        try:
+            await asyncio.wrap_future(server.audio_jobs[audio_id])
+        except Exception:
+            pass  # speech_fields reports the failure as audio_error
+    return speech_fields(audio_id, inline)
+
+# ============== ENDPOINTS ==============
+
+async def initialize(request: Request):
+    try:
+        # Extract initial information from test data
+        new_info = await extract_info(server.text_, server.memory)
+        apply_info(new_info, "INITIALIZATION - INFO EXTRACTED:")
+
+        return json_response(request, {"status": "initialized"})
+    except Exception as e:
+        logger.error("Initialization error", exc_info=True)
+        return json_response(request, {"error": str(e)}, error_status(e))
+
+async def get_question(request: Request):
+    """Get the next question from the AI agent"""
+    try:
+        data = await request.json()
+        user_response = data.get('response', '')
+        tts = data.get('tts', False)
+
+        if user_response:
+            add_message(user_response, "user")
+            new_info = await extract_info(answer_prompt(user_response), memory_obj=server.memory)
+            apply_info(new_info)
+
+        if not has_none(server.current_info):
+            audio_id = submit(synthesize_speech(TRANSITION_MESSAGE), server.audio_jobs, MAX_AUDIO_JOBS) if tts else None
+            return json_response(request, transition_payload(await speech(audio_id, tts == 'inline')))
+
+        agent = await ready_value(QUESTION_AGENT)
+        with span("question_agent"):
+            q_resp = await upstream("openai").a_call(partial(agent.a_run, question_prompt()))
+        question = q_resp.text
+        audio_id = submit(synthesize_speech(question), server.audio_jobs, MAX_AUDIO_JOBS) if tts else None
+
+        return json_response(request, question_payload(question, await speech(audio_id, tts == 'inline')))
+
+    except Exception as e:
+        logger.error("ERROR IN GET_QUESTION", exc_info=True)
+        return json_response(request, {'error': str(e)}, error_status(e))
+
+async def generate_results(request: Request):
+    if has_none(server.current_info):
+        return json_response(request, {'error': 'Profile not complete'}, 400)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    progressive = bool((data or {}).get('progressive', False))
+    compact = bool((data or {}).get('compact', False))
+
+    try:
+        await ready_value(OPENAI_CLIENT)
+        with span("weights_agent"):
+            weights_response = await upstream("openai").a_call(partial(create_weights_agent().a_run, weights_prompt()))
+        weights_dict = parse_weights(weights_response.text)
+        student_profile = weighted_profile(weights_dict)
+
+        # Student embeddings awaited here, scoring (CPU) in a worker thread
+        texts = await anyio.to_thread.run_sync(scoring_session.semantic_texts, student_profile)
+        vectors = None
+        if texts:
+            with span("student_embedding", texts=len(texts)):
+                vectors = dict(zip(texts, await a_embed_texts(list(texts.values()))))
+        recommendations, _ = await anyio.to_thread.run_sync(scoring_session.recommend, student_profile, vectors)
+        list_dict = format_recommendations(recommendations)
+
+        logger.debug("\nRECOMMENDATIONS:")
+        logger.debug(list_dict)
+
+        result_id = submit(generate_pros_cons(list_dict), server.pros_cons_jobs, MAX_PROS_CONS_JOBS)
+        pros_cons = None if progressive else await asyncio.wrap_future(server.pros_cons_jobs[result_id])
+
+        return json_response(request, results_payload(list_dict, weights_dict, result_id, pros_cons, compact))
+
+    except Exception as e:
+        return json_response(request, results_error_payload(e))
+
+async def text_to_speech(request: Request):
+    """Convert text to speech using ElevenLabs"""
+    data = await request.json()
+    text = data.get('text', '')
+
+    if not text:
+        return json_response(request, {'error': 'No text provided'}, 400)
+
+    try:
+        audio_bytes = await synthesize_speech(text)
+        return Response(audio_bytes, media_type='audio/mpeg', headers=CORS_HEADERS)
+    except Exception as e:
+        logger.warning("TTS Error", exc_info=True)
+        return json_response(request, {'error': str(e)}, error_status(e))
+
+# ============== FLASK FALLBACK ==============
+# Every other route (and the CORS preflights) runs on the Flask app in a worker thread.
+# Request and response are buffered: the API only exchanges small JSON bodies and mp3 files.
+
+def wsgi_environ(scope, body: bytes) -> dict:
+    root_path = scope.get("root_path", "")
+    path = scope["path"][len(root_path):] if scope["path"].startswith(root_path) else scope["path"]
+    host, port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_NAME": host,
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1")
+        if name == "content-length":
+            continue
+        key = "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def call_wsgi(environ: dict):
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        return chunks.append
+
+    result = flask_app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], b"".join(chunks)
+
+async def flask_fallback(scope, receive, send):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    status, headers, content = await anyio.to_thread.run_sync(call_wsgi, wsgi_environ(scope, body))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+app = Starlette(routes=[
+    Route('/api/initialize', initialize, methods=['POST']),
+    Route('/api/get_question', get_question, methods=['POST']),
+    Route('/api/generate_results', generate_results, methods=['POST']),
+    Route('/api/text_to_speech', text_to_speech, methods=['POST']),
+    Mount('/', app=flask_fallback),
+])
+
+# ============== WARM-UP ==============
+if os.environ.get("PYDEIA_WARMUP", "1") != "0":
+    threading.Thread(
+        target=warm_up,
+        args=(["async_elevenlabs_client"], WARMUP_RETRY_SECONDS),
+        daemon=True
+    ).start()
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5002)
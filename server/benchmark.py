@@ -0,0 +1,387 @@
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+from typing import List, Dict, Any, Callable, Optional
+
+from catalog import (
+    EMBEDDING_DTYPES, EMBEDDINGS_CACHE_DIR, EMBEDDING_FIELDS, DEFAULT_CSV,
+    quantize, row_norms, matrix_dot, load_embeddings, load_catalog_csv,
+    resident_memory, Catalog
+)
+from embeddings import HashEmbedder, HASH_DIM
+
+
+# Benchmark offline del recommender (nessun servizio esterno richiesto).
+#   python server/benchmark.py quantization [--rows 30000] [--dim 384] [--json out.json]
+#   python server/benchmark.py pipeline [--sizes 100,10000,100000] [--json out.json]
+#   python server/benchmark.py compare base.json new.json
+
+
+# ============= UTILS =============
+def timeit(fn, repeat: int = 20) -> Dict[str, float]:
+    """Mediana e p95 (ms) di `repeat` esecuzioni dopo un warm-up"""
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": float(np.median(times)), "p95_ms": float(np.percentile(times, 95))}
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    """Correlazione di Spearman tra due vettori di score (senza scipy)"""
+    ra = np.argsort(np.argsort(a)).astype(np.float64)
+    rb = np.argsort(np.argsort(b)).astype(np.float64)
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+def peak_memory(fn) -> int:
+    """Picco di memoria allocata (byte, tracemalloc: include gli array numpy) durante fn()"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_results(results: Any, path: str):
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nRisultati salvati in {path}")
+
+
+# ============= QUANTIZZAZIONE =============
+def synthetic_embeddings(rows: int, dim: int, seed: int = 0) -> np.ndarray:
+    """
+    Embeddings sintetici con struttura a cluster (come testi simili nel catalogo),
+    così l'accordo sul ranking non è banale come con vettori del tutto casuali.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(rows // 50, 1), dim))
+    labels = rng.integers(0, len(centers), rows)
+    return (centers[labels] + 0.5 * rng.standard_normal((rows, dim))).astype(np.float32)
+
+def benchmark_quantization(matrix: np.ndarray, queries: np.ndarray, k: int = 10, repeat: int = 20) -> List[Dict[str, Any]]:
+    """Memoria, latenza dello scoring e accordo del ranking rispetto a float32"""
+    baseline = None
+    results = []
+    for dtype in EMBEDDING_DTYPES:
+        data, scales = quantize(matrix, dtype)
+        norms = row_norms(data)
+
+        def score(query):
+            return matrix_dot(data, query) / (norms * np.linalg.norm(query))
+
+        all_scores = [score(q) for q in queries]
+        if baseline is None:
+            baseline = all_scores
+        overlap = np.mean([
+            len(set(top_k(s, k)) & set(top_k(b, k))) / k for s, b in zip(all_scores, baseline)
+        ])
+        rho = np.mean([spearman(s, b) for s, b in zip(all_scores, baseline)])
+        max_error = max(float(np.max(np.abs(s - b))) for s, b in zip(all_scores, baseline))
+
+        results.append({
+            "dtype": dtype,
+            "rows": int(matrix.shape[0]),
+            "dim": int(matrix.shape[1]),
+            "bytes": int(data.nbytes + (scales.nbytes if scales is not None else 0)),
+            **timeit(lambda: score(queries[0]), repeat),
+            f"top{k}_overlap": float(overlap),
+            "spearman": float(rho),
+            "max_abs_score_error": max_error,
+        })
+    return results
+
+def run_quantization(args):
+    if args.cache:
+        if not os.path.exists(os.path.join(args.cache, "manifest.json")):
+            # Directory base della cache: la versione del catalogo usata più di recente
+            versions = sorted(
+                (entry for entry in os.scandir(args.cache)
+                 if os.path.exists(os.path.join(entry.path, "manifest.json"))),
+                key=lambda entry: entry.stat().st_mtime
+            ) if os.path.isdir(args.cache) else []
+            if versions:
+                args.cache = versions[-1].path
+        try:
+            with open(os.path.join(args.cache, "manifest.json"), encoding="utf-8") as f:
+                key = json.load(f)["key"]
+        except (FileNotFoundError, ValueError, KeyError):
+            sys.exit(f"Cache embeddings non trovata in {args.cache}")
+        cached = load_embeddings(args.cache, key=key)
+        if cached is None:
+            sys.exit(f"Cache embeddings non valida in {args.cache}")
+        embeddings, scales = cached
+        matrix = np.asarray(embeddings[args.field], dtype=np.float32)
+        if scales is not None:
+            matrix = matrix * scales[args.field][:, None]
+    else:
+        matrix = synthetic_embeddings(args.rows, args.dim, args.seed)
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = matrix[rng.integers(0, len(matrix), args.queries)] + 0.3 * rng.standard_normal((args.queries, matrix.shape[1])).astype(np.float32)
+
+    results = benchmark_quantization(matrix, queries, k=args.k, repeat=args.repeat)
+    print(f"\n{'dtype':<8} {'MB':>8} {'median ms':>10} {'p95 ms':>8} {f'top{args.k}':>7} {'spearman':>9} {'max err':>9}")
+    for r in results:
+        print(f"{r['dtype']:<8} {r['bytes'] / 1e6:>8.2f} {r['median_ms']:>10.3f} {r['p95_ms']:>8.3f} "
+              f"{r[f'top{args.k}_overlap']:>7.3f} {r['spearman']:>9.4f} {r['max_abs_score_error']:>9.5f}")
+    write_results(results, args.json)
+
+
+# ============= PIPELINE =============
+def text_phrases(values: List[str]) -> List[str]:
+    """Frasi (separate da virgole e '|') dei testi del catalogo vero"""
+    phrases = set()
+    for value in values:
+        for part in value.replace("|", ",").split(","):
+            if part.strip():
+                phrases.add(part.strip())
+    return sorted(phrases)
+
+def synthetic_catalog_csv(
+    path: str,
+    rows: int,
+    places: List[tuple],
+    source: str = DEFAULT_CSV,
+    duplicate_ratio: float = 0.3,
+    seed: int = 0
+):
+    """
+    CSV sintetico con lo schema di data/universities.csv. Una frazione duplicate_ratio
+    dei testi semantici è copiata da righe vere (testi ripetuti come nel catalogo),
+    gli altri ricombinano le loro frasi. Città e coordinate dal gazetteer (places).
+    """
+    with open(source, encoding="utf-8") as f:
+        base = list(csv.DictReader(f))
+    rng = np.random.default_rng(seed)
+    phrases = {column: text_phrases([r[column] for r in base]) for column in EMBEDDING_FIELDS.values()}
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(base[0].keys()))
+        writer.writeheader()
+        for i in range(rows):
+            template = base[rng.integers(len(base))]
+            name, lat, lon = places[rng.integers(len(places))]
+            row = dict(template)
+            row["id"] = i + 1
+            row["nome"] = f"{template['nome']} #{i // len(base)}"
+            for column, pool in phrases.items():
+                if rng.random() >= duplicate_ratio:
+                    row[column] = ", ".join(rng.choice(pool, size=int(rng.integers(3, 7)), replace=False))
+            row["annual_cost"] = int(rng.integers(0, 40)) * 500
+            row["city"] = name
+            row["coordinates"] = json.dumps({"lat": round(lat + rng.normal(0, 0.02), 4), "lon": round(lon + rng.normal(0, 0.02), 4)})
+            for column in ("english_courses", "dorms_available", "admission_test_required"):
+                row[column] = str(bool(rng.random() < 0.5))
+            writer.writerow(row)
+
+def synthetic_profiles(count: int, places: List[tuple], seed: int = 0) -> List[Dict[str, Any]]:
+    """Profili studente sintetici (stessi campi di Info più i pesi di default)"""
+    with open(DEFAULT_CSV, encoding="utf-8") as f:
+        base = list(csv.DictReader(f))
+    rng = np.random.default_rng(seed)
+    phrases = {column: text_phrases([r[column] for r in base]) for column in EMBEDDING_FIELDS.values()}
+    profiles = []
+    for _ in range(count):
+        profile = {column: ", ".join(rng.choice(pool, size=3, replace=False)) for column, pool in phrases.items()}
+        profile.update({
+            "budget": int(rng.integers(0, 30)) * 500,
+            "origin": places[rng.integers(len(places))][0],
+            "location": places[rng.integers(len(places))][0] if rng.random() < 0.3 else "",
+            "max_distance": float(rng.choice([100, 300, 500])) if rng.random() < 0.5 else None,
+            "far_from_home": bool(rng.random() < 0.5),
+            "english_language": bool(rng.random() < 0.5),
+            "dorms_nearby": bool(rng.random() < 0.5),
+            "admission_test": bool(rng.random() < 0.5),
+        })
+        profiles.append(profile)
+    return profiles
+
+def benchmark_pipeline(rs, catalog: Catalog, profiles: List[Dict[str, Any]], repeat: int, k: int = 3) -> List[Dict[str, Any]]:
+    """
+    Tempi (mediana, p95) e picco di memoria di ogni fase di recommend_universities sul
+    catalogo (multimodal_scoring ordina già tutto il ranking), delle fasi vettoriali del
+    batch (similarità, scoring, top-k) e i tempi end-to-end.
+    Memoria e tempi sono misurati in esecuzioni separate (tracemalloc rallenta).
+    """
+    from scoring import scoring_columns, semantic_scores, score_columns, select_top_k
+
+    rs.UNIVERSITY_DATASET = catalog
+    results = []
+
+    def record(stage: str, fn: Callable, runs: int = repeat, **extra):
+        timing = timeit(fn, runs)
+        results.append({"rows": len(catalog), "stage": stage, **timing, "peak_bytes": peak_memory(fn), **extra})
+        print(f"  {stage:<22} {timing['median_ms']:>10.3f} ms (p95 {timing['p95_ms']:.3f})  "
+              f"picco {results[-1]['peak_bytes'] / 1e6:.1f} MB")
+
+    # Embeddings del catalogo: calcolo a freddo (una volta) e caricamento dalla cache
+    start = time.perf_counter()
+    tracemalloc.start()
+    rs.get_universities_embeddings(catalog)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    cold_ms = (time.perf_counter() - start) * 1000
+    results.append({"rows": len(catalog), "stage": "catalog_embedding", "median_ms": cold_ms, "p95_ms": cold_ms,
+                    "peak_bytes": peak, "texts": int(sum(len(r) for r in catalog.text_rows.values()))})
+    print(f"  {'catalog_embedding':<22} {cold_ms:>10.3f} ms (a freddo)")
+
+    def reload_embeddings():
+        catalog.embeddings = None
+        rs.get_universities_embeddings(catalog)
+    record("catalog_embedding_load", reload_embeddings)
+
+    profile = profiles[0]
+    record("student_embedding", lambda: rs.create_student_embedding(profile))
+    student = rs.create_student_embedding(profile)["embeddings"]
+    record("similarity", lambda: rs.calculate_cosine_similarity(student, catalog))
+    ranking = rs.calculate_cosine_similarity(student, catalog)
+    record("multimodal_scoring", lambda: rs.multimodal_scoring(ranking, profile, rs.DEFAULT_WEIGHTS))
+    record("recommend_universities", lambda: rs.recommend_universities(profile))
+
+    # Percorso vettoriale: gli stessi passi per un blocco di studenti (N x B)
+    chunk = profiles[:rs.BATCH_CHUNK_STUDENTS]
+    students = rs.embed_student_profiles(chunk)
+    params = rs.batch_profile_params(catalog, chunk, [None] * len(chunk))
+    columns = scoring_columns(catalog)
+    semantic = semantic_scores(catalog.embeddings, catalog.embedding_norms(), catalog.text_ids, students)
+    scores = score_columns(columns, semantic, params)
+    record("batch_similarity", lambda: semantic_scores(catalog.embeddings, catalog.embedding_norms(), catalog.text_ids, students), students=len(chunk))
+    record("batch_scoring", lambda: score_columns(columns, semantic, params), students=len(chunk))
+    record("top_k", lambda: select_top_k(*scores, k), students=len(chunk))
+    record("recommend_batch", lambda: rs.recommend_universities_batch(profiles, top_k=k, catalog=catalog), students=len(profiles))
+    return results
+
+def run_pipeline(args):
+    # Cache degli embeddings usa e getta: il primo calcolo è sempre a freddo
+    os.environ["PYDEIA_EMBEDDINGS_CACHE"] = tempfile.mkdtemp(prefix="pydeia-bench-")
+    import recommendation_system as rs
+    from metrics import logger
+    logger.setLevel(logging.WARNING)
+
+    embedder = HashEmbedder(args.dim)
+    rs.EMBEDDINGS_CACHE_DIR = os.environ["PYDEIA_EMBEDDINGS_CACHE"]
+    rs.embed_texts = embedder
+    rs.create_student_embedding = lambda profile: {
+        "embeddings": {
+            field: vector.tolist()
+            for field, vector in zip(EMBEDDING_FIELDS, embedder([profile.get(c, "") or "" for c in EMBEDDING_FIELDS.values()]))
+        }
+    }
+
+    gazetteer = rs.GAZETTEER
+    places = [(gazetteer.names[i], float(gazetteer.lat[i]), float(gazetteer.lon[i])) for i in range(len(gazetteer))]
+    profiles = synthetic_profiles(args.students, places, args.seed)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="pydeia-catalog-") as tmp:
+        for rows in args.sizes:
+            path = os.path.join(tmp, f"universities_{rows}.csv")
+            synthetic_catalog_csv(path, rows, places, duplicate_ratio=args.duplicates, seed=args.seed)
+            start = time.perf_counter()
+            catalog = load_catalog_csv(path)
+            print(f"\nCatalogo sintetico: {rows} righe (caricato in {(time.perf_counter() - start) * 1000:.0f} ms), "
+                  f"testi distinti {catalog.dedup_stats()}")
+            results += benchmark_pipeline(rs, catalog, profiles, args.repeat)
+
+    report = {
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "embedding_dim": args.dim,
+        "embedding_dtype": rs.EMBEDDING_DTYPE,
+        "students": args.students,
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "rss_peak_bytes": resident_memory().get("rss_peak"),
+        "results": results,
+    }
+    write_results(report, args.json)
+
+def run_compare(args):
+    """Variazione dei tempi mediani tra due risultati di 'pipeline' (es. due commit)"""
+    with open(args.base, encoding="utf-8") as f:
+        base = {(r["rows"], r["stage"]): r for r in json.load(f)["results"]}
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)["results"]
+
+    regressions = 0
+    print(f"{'rows':>8} {'stage':<24} {'base ms':>10} {'new ms':>10} {'delta':>8}")
+    for r in new:
+        old = base.get((r["rows"], r["stage"]))
+        if old is None or not old["median_ms"]:
+            continue
+        delta = r["median_ms"] / old["median_ms"] - 1
+        flag = " <-" if delta > args.threshold else ""
+        regressions += bool(flag)
+        print(f"{r['rows']:>8} {r['stage']:<24} {old['median_ms']:>10.3f} {r['median_ms']:>10.3f} {delta:>+8.1%}{flag}")
+    if regressions:
+        sys.exit(f"\n{regressions} fasi più lente di oltre {args.threshold:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del recommender")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    quant = sub.add_parser("quantization", help="float32 vs float16 vs int8 per gli embeddings del catalogo")
+    quant.add_argument("--rows", type=int, default=30000)
+    quant.add_argument("--dim", type=int, default=384)
+    quant.add_argument("--queries", type=int, default=50)
+    quant.add_argument("--k", type=int, default=10)
+    quant.add_argument("--repeat", type=int, default=20)
+    quant.add_argument("--seed", type=int, default=0)
+    quant.add_argument("--cache", help=f"usa gli embeddings reali di una cache (es. {EMBEDDINGS_CACHE_DIR})")
+    quant.add_argument("--field", default="academic", choices=sorted(EMBEDDING_FIELDS))
+    quant.add_argument("--json", help="salva i risultati in JSON")
+
+    pipeline = sub.add_parser("pipeline", help="fasi di recommend_universities su cataloghi sintetici")
+    pipeline.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[100, 10000, 100000],
+                          help="righe dei cataloghi sintetici (separate da virgole)")
+    pipeline.add_argument("--students", type=int, default=64, help="profili per il batch")
+    pipeline.add_argument("--dim", type=int, default=HASH_DIM)
+    pipeline.add_argument("--duplicates", type=float, default=0.3, help="frazione di testi copiati dal catalogo vero")
+    pipeline.add_argument("--repeat", type=int, default=5)
+    pipeline.add_argument("--seed", type=int, default=0)
+    pipeline.add_argument("--json", help="salva i risultati in JSON")
+
+    compare = sub.add_parser("compare", help="confronta due risultati di 'pipeline'")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.2, help="rallentamento segnalato (0.2 = +20%%)")
+
+    args = parser.parse_args()
+    if args.command == "quantization":
+        run_quantization(args)
+    elif args.command == "pipeline":
+        run_pipeline(args)
+    elif args.command == "compare":
+        run_compare(args)
+
+
+if __name__ == "__main__":
+    main()
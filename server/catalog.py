@@ -0,0 +1,747 @@
+import os
+import csv
+import json
+import time
+import shutil
+import hashlib
+import unicodedata
+import argparse
+import numpy as np
+from collections.abc import Mapping
+from typing import List, Dict, Any, Optional, Tuple
+
+from spatial import SpatialIndex
+from metrics import logger
+
+
+# Catalogo università in formato colonnare.
+# Build dello snapshot:  python server/catalog.py build [--embed]
+# Il server carica lo snapshot (memory-mapped) e, se manca o non è aggiornato, il CSV.
+
+
+# ============= PERCORSI =============
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data")
+DEFAULT_CSV = os.environ.get("PYDEIA_CATALOG_CSV", os.path.join(DATA_DIR, "universities.csv"))
+DEFAULT_SNAPSHOT = os.environ.get("PYDEIA_CATALOG_SNAPSHOT", os.path.join(DATA_DIR, "universities_snapshot"))
+# Embeddings calcolati a runtime (se lo snapshot non li include), condivisi tra i worker via mmap:
+# una sottodirectory per versione del catalogo, tenute le EMBEDDINGS_CACHE_KEEP più recenti
+EMBEDDINGS_CACHE_DIR = os.environ.get("PYDEIA_EMBEDDINGS_CACHE", os.path.join(DATA_DIR, "universities_embeddings"))
+EMBEDDINGS_CACHE_KEEP = 4
+
+SNAPSHOT_VERSION = 3
+# Le versioni precedenti dello snapshot restano su disco per questi secondi dopo un nuovo
+# build, così un worker che le sta aprendo finisce di leggerle (quelle già in mmap restano valide)
+SNAPSHOT_KEEP_SECONDS = 60
+
+# Formato degli embeddings in memoria/su disco: float32, float16 o int8 (scala per vettore)
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+EMBEDDING_DTYPE = os.environ.get("PYDEIA_EMBEDDING_DTYPE", "float32")
+if EMBEDDING_DTYPE not in EMBEDDING_DTYPES:
+    raise ValueError(f"PYDEIA_EMBEDDING_DTYPE deve essere uno tra {EMBEDDING_DTYPES}, non '{EMBEDDING_DTYPE}'")
+# Righe elaborate per blocco quando i dati quantizzati vanno convertiti in float32
+SCORING_BLOCK_ROWS = 4096
+
+# ============= SCHEMA =============
+INT_COLUMNS = ["id", "annual_cost", "prestige_rank", "duration_years", "employment_rate"]
+FLOAT_COLUMNS = ["min_gpa", "lat", "lon"]          # lat/lon = campo 'coordinates' del CSV
+BOOL_COLUMNS = ["english_courses", "dorms_available", "admission_test_required"]
+TEXT_COLUMNS = [
+    "nome", "corso", "academic_profile", "aspiration_values",
+    "lifestyle_preferences", "city", "extracurricular_clubs"
+]
+EMBEDDING_FIELDS = {
+    "academic": "academic_profile",
+    "aspiration": "aspiration_values",
+    "lifestyle": "lifestyle_preferences",
+}
+# Ordine delle chiavi nei dict restituiti (come nel CSV)
+ROW_KEYS = [
+    "id", "nome", "corso", "academic_profile", "aspiration_values", "lifestyle_preferences",
+    "annual_cost", "city", "coordinates", "min_gpa", "prestige_rank", "duration_years",
+    "employment_rate", "english_courses", "dorms_available", "admission_test_required",
+    "extracurricular_clubs"
+]
+
+
+class TextColumn:
+    """Colonna di testo compatta: un unico blob UTF-8 + offsets (memory-mappable)"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data          # uint8, tutti i testi concatenati
+        self.offsets = offsets    # int64, len = N + 1
+
+    @classmethod
+    def from_strings(cls, values: List[str]) -> "TextColumn":
+        encoded = [v.encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def normalize_text(text: str) -> str:
+    """Forma normalizzata per il confronto dei testi (unicode, spazi, maiuscole)"""
+    return " ".join(unicodedata.normalize("NFC", text).split()).casefold()
+
+def intern_texts(texts) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Interning dei testi: ogni testo normalizzato distinto riceve un id.
+    Restituisce text_ids (riga -> id, N) e text_rows (id -> prima riga con quel testo, U).
+    """
+    ids = {}
+    text_ids = np.empty(len(texts), dtype=np.int32)
+    text_rows = []
+    for i, text in enumerate(texts):
+        key = normalize_text(text)
+        text_id = ids.get(key)
+        if text_id is None:
+            text_id = ids[key] = len(text_rows)
+            text_rows.append(i)
+        text_ids[i] = text_id
+    return text_ids, np.array(text_rows, dtype=np.int64)
+
+
+class CatalogRow(Mapping):
+    """
+    Vista immutabile di una riga del catalogo (catalogo + indice): si legge come il dict
+    del vecchio loader, ma i valori arrivano dalle colonne solo quando servono.
+    """
+    __slots__ = ("catalog", "index")
+
+    def __init__(self, catalog: "Catalog", index: int):
+        self.catalog = catalog
+        self.index = index
+
+    def __getitem__(self, key: str) -> Any:
+        return self.catalog.value(self.index, key)
+
+    def __iter__(self):
+        return iter(ROW_KEYS)
+
+    def __len__(self) -> int:
+        return len(ROW_KEYS)
+
+    def __repr__(self) -> str:
+        return f"CatalogRow({self.index}, id={self['id']})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.catalog.row(self.index)
+
+class Catalog:
+    """
+    Catalogo università colonnare.
+    Si itera come la vecchia lista di dict (una riga = un dict con le colonne del CSV),
+    ma i dati restano in array numpy (eventualmente memory-mapped dallo snapshot).
+    I testi semantici sono internati: gli embeddings hanno una riga per testo distinto
+    (U x d) e text_ids[field] collega ogni università al suo vettore.
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, Any],
+        embeddings: Optional[Dict[str, np.ndarray]] = None,
+        source: str = "",
+        content_hash: Optional[str] = None,
+        text_ids: Optional[Dict[str, np.ndarray]] = None,
+        text_rows: Optional[Dict[str, np.ndarray]] = None
+    ):
+        self.columns = columns
+        self.embeddings = embeddings    # {"academic": U x d, ...} oppure None
+        self.source = source
+        self.content_hash = content_hash    # sha256 del CSV di origine
+        if text_ids is None or text_rows is None:
+            text_ids, text_rows = {}, {}
+            for field, column in EMBEDDING_FIELDS.items():
+                text_ids[field], text_rows[field] = intern_texts(columns[column])
+        self.text_ids = text_ids      # riga -> id del testo
+        self.text_rows = text_rows    # id del testo -> prima riga che lo contiene
+        self._codes = {}
+        self._spatial = None
+
+    @property
+    def embeddings(self) -> Optional[Dict[str, np.ndarray]]:
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, value: Optional[Dict[str, np.ndarray]]):
+        self._embeddings = value
+        self.embedding_scales = None
+        self._norms = None
+
+    def set_embeddings(self, embeddings: Dict[str, np.ndarray], scales: Optional[Dict[str, np.ndarray]] = None):
+        """Imposta matrici ed eventuali scale (int8) insieme"""
+        self.embeddings = embeddings
+        self.embedding_scales = scales
+
+    def embedding_vector(self, field: str, text_id: int) -> np.ndarray:
+        """Vettore float32 (dequantizzato) di un testo distinto"""
+        vector = np.asarray(self.embeddings[field][text_id], dtype=np.float32)
+        if self.embedding_scales is not None:
+            vector = vector * self.embedding_scales[field][text_id]
+        return vector
+
+    def embedding_norms(self) -> Dict[str, np.ndarray]:
+        """Norme delle righe degli embeddings, calcolate una volta per processo (N float per campo)"""
+        if self._norms is None:
+            self._norms = {field: row_norms(matrix) for field, matrix in self.embeddings.items()}
+        return self._norms
+
+    def spatial_index(self) -> SpatialIndex:
+        """Indice spaziale sulle coordinate delle università (costruito una volta)"""
+        if self._spatial is None:
+            self._spatial = SpatialIndex(self.columns["lat"], self.columns["lon"])
+        return self._spatial
+
+    def __len__(self) -> int:
+        return len(self.columns["id"])
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def __getitem__(self, i: int) -> "CatalogRow":
+        return CatalogRow(self, int(i))
+
+    def value(self, i: int, key: str) -> Any:
+        """Valore di un campo della riga i (stessi tipi del vecchio loader CSV)"""
+        c = self.columns
+        if key == "coordinates":
+            return {"lat": float(c["lat"][i]), "lon": float(c["lon"][i])}
+        if key in INT_COLUMNS:
+            return int(c[key][i])
+        if key in FLOAT_COLUMNS:
+            return float(c[key][i])
+        if key in BOOL_COLUMNS:
+            return bool(c[key][i])
+        if key in TEXT_COLUMNS:
+            return c[key][i]
+        raise KeyError(key)
+
+    def row(self, i: int) -> Dict[str, Any]:
+        """Ricostruisce la riga i come dict (stessi tipi del vecchio loader CSV)"""
+        return {key: self.value(i, key) for key in ROW_KEYS}
+
+    def unique_texts(self, field: str) -> List[str]:
+        """Testi distinti di un campo embedding ('academic', 'aspiration', 'lifestyle'), in ordine di id"""
+        column = self.columns[EMBEDDING_FIELDS[field]]
+        return [column[int(i)] for i in self.text_rows[field]]
+
+    def column_codes(self, name: str) -> Tuple[List[str], np.ndarray]:
+        """Valori distinti di una colonna di testo e codice per riga (calcolati una volta)"""
+        if name not in self._codes:
+            values, index = [], {}
+            codes = np.empty(len(self), dtype=np.int32)
+            for i, value in enumerate(self.columns[name]):
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(values)
+                    values.append(value)
+                codes[i] = code
+            self._codes[name] = (values, codes)
+        return self._codes[name]
+
+    def dedup_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Quanti testi distinti ci sono per campo rispetto alle righe del catalogo"""
+        n = len(self)
+        return {
+            field: {
+                "rows": n,
+                "unique": len(rows),
+                "dedup_ratio": round(1 - len(rows) / n, 4) if n else 0.0,
+            }
+            for field, rows in self.text_rows.items()
+        }
+
+
+def row_norms(matrix: np.ndarray) -> np.ndarray:
+    """Norme delle righe senza materializzare matrix**2 (a blocchi in float32 se quantizzata)"""
+    if matrix.dtype in (np.float32, np.float64):
+        return np.sqrt(np.einsum("ij,ij->i", matrix, matrix))
+    norms = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), SCORING_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + SCORING_BLOCK_ROWS], dtype=np.float32)
+        norms[start:start + len(block)] = np.sqrt(np.einsum("ij,ij->i", block, block))
+    return norms
+
+def matrix_dot(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """
+    matrix @ vector direttamente sui dati memorizzati: zero copie per float32/float64,
+    conversione a blocchi in float32 per float16/int8 (mai l'intera matrice dequantizzata).
+    vector può essere anche una matrice d x B (più studenti insieme).
+    Per int8 il risultato non è moltiplicato per le scale: nel coseno si semplificano.
+    """
+    if matrix.dtype in (np.float32, np.float64):
+        return matrix @ np.asarray(vector, dtype=matrix.dtype)
+    vector = np.asarray(vector, dtype=np.float32)
+    result = np.empty((len(matrix),) + vector.shape[1:], dtype=np.float32)
+    for start in range(0, len(matrix), SCORING_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + SCORING_BLOCK_ROWS], dtype=np.float32)
+        result[start:start + len(block)] = block @ vector
+    return result
+
+def quantize(matrix: np.ndarray, dtype: str = EMBEDDING_DTYPE) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Converte una matrice float nel formato richiesto.
+    int8: quantizzazione scalare simmetrica con una scala per vettore (x ≈ q * scale).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dtype == "float32":
+        return np.ascontiguousarray(matrix), None
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        q = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return q, scales.astype(np.float32)
+    raise ValueError(f"dtype embeddings non supportato: {dtype}")
+
+def quantize_embeddings(embeddings: Dict[str, np.ndarray], dtype: str = EMBEDDING_DTYPE) -> Tuple[Dict[str, np.ndarray], Optional[Dict[str, np.ndarray]]]:
+    quantized, scales = {}, {}
+    for field, matrix in embeddings.items():
+        quantized[field], field_scales = quantize(matrix, dtype)
+        if field_scales is not None:
+            scales[field] = field_scales
+    return quantized, scales or None
+
+
+# ============= CSV =============
+def file_sha256(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_catalog_csv(filename: str = DEFAULT_CSV) -> Catalog:
+    """Legge il CSV una sola volta, direttamente in colonne"""
+    values = {name: [] for name in INT_COLUMNS + FLOAT_COLUMNS + BOOL_COLUMNS + TEXT_COLUMNS}
+    with open(filename, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            coords = json.loads(row['coordinates'])
+            values["id"].append(int(row['id']))
+            values["annual_cost"].append(int(row['annual_cost']))
+            values["prestige_rank"].append(int(row['prestige_rank']))
+            values["duration_years"].append(int(row.get('duration_years') or 3))
+            values["employment_rate"].append(int(row.get('employment_rate') or 0))
+            values["min_gpa"].append(float(row['min_gpa']))
+            values["lat"].append(float(coords["lat"]))
+            values["lon"].append(float(coords["lon"]))
+            for name in BOOL_COLUMNS:
+                values[name].append(row[name].lower() == 'true')
+            for name in TEXT_COLUMNS:
+                values[name].append(row.get(name) or '')
+
+    columns = {}
+    for name in INT_COLUMNS:
+        columns[name] = np.array(values[name], dtype=np.int64)
+    for name in FLOAT_COLUMNS:
+        columns[name] = np.array(values[name], dtype=np.float64)
+    for name in BOOL_COLUMNS:
+        columns[name] = np.array(values[name], dtype=np.bool_)
+    for name in TEXT_COLUMNS:
+        columns[name] = TextColumn.from_strings(values[name])
+    return Catalog(columns, source=filename, content_hash=file_sha256(filename))
+
+
+# ============= VALIDAZIONE =============
+def validate_catalog(catalog: Catalog) -> List[str]:
+    """Restituisce la lista dei problemi trovati (vuota se il catalogo è valido)"""
+    errors = []
+    c = catalog.columns
+    n = len(catalog)
+
+    if n == 0:
+        errors.append("catalogo vuoto")
+    ids = c["id"]
+    if len(np.unique(ids)) != n:
+        errors.append("id duplicati")
+    for name in INT_COLUMNS + FLOAT_COLUMNS + BOOL_COLUMNS + TEXT_COLUMNS:
+        if len(c[name]) != n:
+            errors.append(f"colonna '{name}' con {len(c[name])} righe invece di {n}")
+    if np.any(c["annual_cost"] < 0):
+        errors.append("annual_cost negativo")
+    if np.any((c["min_gpa"] < 0) | (c["min_gpa"] > 10)):
+        errors.append("min_gpa fuori dall'intervallo 0-10")
+    # Bounding box dell'Italia
+    if np.any((c["lat"] < 35) | (c["lat"] > 48) | (c["lon"] < 6) | (c["lon"] > 19)):
+        errors.append("coordinate fuori dall'Italia")
+    for i, (nome, corso) in enumerate(zip(c["nome"], c["corso"])):
+        if not nome or not corso:
+            errors.append(f"riga {i} (id {ids[i]}): nome o corso mancante")
+
+    if catalog.embeddings is not None:
+        dims = set()
+        for field in EMBEDDING_FIELDS:
+            matrix = catalog.embeddings.get(field)
+            if matrix is None:
+                errors.append(f"embedding '{field}' mancante")
+                continue
+            unique = len(catalog.text_rows[field])
+            if matrix.ndim != 2 or matrix.shape[0] != unique:
+                errors.append(f"embedding '{field}' con shape {matrix.shape}, attese {unique} righe (testi distinti)")
+                continue
+            dims.add(matrix.shape[1])
+            if not np.all(np.isfinite(matrix)):
+                errors.append(f"embedding '{field}' con valori non finiti")
+            # Testi vuoti o di sola punteggiatura: vettori nulli, con similarità 0 nello scoring
+            zero = int(np.count_nonzero(np.linalg.norm(matrix, axis=1) == 0))
+            if zero:
+                logger.warning(f"embedding '{field}': {zero} vettori nulli (similarità 0)")
+        if len(dims) > 1:
+            errors.append(f"dimensioni embedding diverse tra i campi: {sorted(dims)}")
+    return errors
+
+
+# ============= SNAPSHOT =============
+def build_snapshot(
+    catalog: Catalog,
+    snapshot_dir: str = DEFAULT_SNAPSHOT,
+    csv_sha256: Optional[str] = None,
+    embedding_model: Optional[str] = None
+) -> str:
+    """
+    Valida il catalogo e lo scrive come file .npy + manifest.json. I file di ogni build
+    vanno in una sottodirectory nuova e il manifest, sostituito per ultimo in modo atomico,
+    punta a quella: un worker non legge mai uno snapshot a metà e i file che altri worker
+    hanno in mmap non vengono mai riscritti.
+    """
+    errors = validate_catalog(catalog)
+    if errors:
+        raise ValueError("Catalogo non valido:\n - " + "\n - ".join(errors))
+
+    version = f"v{time.time_ns()}-{os.getpid()}"
+    files_dir = os.path.join(snapshot_dir, version)
+    os.makedirs(files_dir)
+    c = catalog.columns
+    for name in INT_COLUMNS + FLOAT_COLUMNS + BOOL_COLUMNS:
+        np.save(os.path.join(files_dir, f"{name}.npy"), np.ascontiguousarray(c[name]))
+    for name in TEXT_COLUMNS:
+        np.save(os.path.join(files_dir, f"{name}.text.npy"), np.asarray(c[name].data))
+        np.save(os.path.join(files_dir, f"{name}.offsets.npy"), np.asarray(c[name].offsets))
+    for field in EMBEDDING_FIELDS:
+        np.save(os.path.join(files_dir, f"text_ids_{field}.npy"), np.asarray(catalog.text_ids[field]))
+        np.save(os.path.join(files_dir, f"text_rows_{field}.npy"), np.asarray(catalog.text_rows[field]))
+
+    embedding_dim = embedding_dtype = None
+    if catalog.embeddings is not None:
+        for field, matrix in catalog.embeddings.items():
+            np.save(os.path.join(files_dir, f"emb_{field}.npy"), np.ascontiguousarray(matrix))
+            embedding_dim = int(matrix.shape[1])
+            embedding_dtype = str(matrix.dtype)
+        for field, scales in (catalog.embedding_scales or {}).items():
+            np.save(os.path.join(files_dir, f"scale_{field}.npy"), np.ascontiguousarray(scales))
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "path": version,
+        "rows": len(catalog),
+        "csv_sha256": csv_sha256,
+        "embedding_model": embedding_model if catalog.embeddings is not None else None,
+        "embedding_dim": embedding_dim,
+        "embedding_dtype": embedding_dtype,
+        "embedding_fields": sorted(catalog.embeddings) if catalog.embeddings is not None else [],
+        "dedup": catalog.dedup_stats(),
+    }
+    # Il manifest è scritto per ultimo: uno snapshot senza manifest è incompleto
+    tmp = os.path.join(snapshot_dir, f"manifest.{os.getpid()}.tmp.json")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(snapshot_dir, "manifest.json"))
+    prune_snapshots(snapshot_dir, version)
+    return snapshot_dir
+
+def prune_snapshots(snapshot_dir: str, current: str):
+    """Rimuove le versioni precedenti dello snapshot più vecchie di SNAPSHOT_KEEP_SECONDS"""
+    cutoff = time.time() - SNAPSHOT_KEEP_SECONDS
+    for entry in os.scandir(snapshot_dir):
+        if entry.is_dir() and entry.name.startswith("v") and entry.name != current:
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+def snapshot_signature(snapshot_dir: str = DEFAULT_SNAPSHOT) -> Optional[Tuple[int, int, int]]:
+    """Identità del manifest (inode, mtime, dimensione): cambia a ogni build; None se manca"""
+    try:
+        st = os.stat(os.path.join(snapshot_dir, "manifest.json"))
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+def read_manifest(snapshot_dir: str = DEFAULT_SNAPSHOT) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if manifest.get("version") == SNAPSHOT_VERSION else None
+
+def load_snapshot(snapshot_dir: str = DEFAULT_SNAPSHOT, embedding_model: Optional[str] = None) -> Catalog:
+    """
+    Carica lo snapshot in memory-mapping (nessuna copia, pagine condivise tra processi).
+    Con embedding_model, gli embeddings dello snapshot calcolati da un altro modello/backend
+    sono ignorati (verranno ricalcolati con quello attivo).
+    """
+    for attempt in range(3):
+        manifest = read_manifest(snapshot_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"Snapshot non valido o mancante in {snapshot_dir}")
+        try:
+            return open_snapshot(snapshot_dir, manifest, embedding_model)
+        except FileNotFoundError:
+            # Versione rimossa da un build concorrente mentre la si apriva: si rilegge il manifest
+            if attempt == 2 or read_manifest(snapshot_dir) == manifest:
+                raise
+
+def open_snapshot(snapshot_dir: str, manifest: Dict[str, Any], embedding_model: Optional[str] = None) -> Catalog:
+    # Snapshot precedenti alle sottodirectory per versione: file direttamente in snapshot_dir
+    files_dir = os.path.join(snapshot_dir, manifest.get("path", ""))
+
+    def load(name):
+        return np.load(os.path.join(files_dir, f"{name}.npy"), mmap_mode="r")
+
+    columns = {}
+    for name in INT_COLUMNS + FLOAT_COLUMNS + BOOL_COLUMNS:
+        columns[name] = load(name)
+    for name in TEXT_COLUMNS:
+        columns[name] = TextColumn(load(f"{name}.text"), load(f"{name}.offsets"))
+
+    text_ids = {field: load(f"text_ids_{field}") for field in EMBEDDING_FIELDS}
+    text_rows = {field: load(f"text_rows_{field}") for field in EMBEDDING_FIELDS}
+
+    catalog = Catalog(
+        columns, source=snapshot_dir, content_hash=manifest["csv_sha256"],
+        text_ids=text_ids, text_rows=text_rows
+    )
+    model_matches = embedding_model is None or manifest.get("embedding_model") == embedding_model
+    if manifest["embedding_fields"] and not model_matches:
+        print(f"Embeddings dello snapshot ({manifest.get('embedding_model')}) diversi dal modello attivo ({embedding_model}), ignorati.")
+    elif manifest["embedding_fields"]:
+        embeddings = {field: load(f"emb_{field}") for field in manifest["embedding_fields"]}
+        scales = None
+        if manifest["embedding_dtype"] == "int8":
+            scales = {field: load(f"scale_{field}") for field in manifest["embedding_fields"]}
+        catalog.set_embeddings(embeddings, scales)
+    return catalog
+
+def load_catalog(
+    filename: str = DEFAULT_CSV,
+    snapshot_dir: str = DEFAULT_SNAPSHOT,
+    embedding_model: Optional[str] = None
+) -> Catalog:
+    """
+    Usa lo snapshot se esiste ed è stato costruito dal CSV corrente,
+    altrimenti ricade sul parsing del CSV.
+    """
+    manifest = read_manifest(snapshot_dir)
+    if manifest is not None:
+        csv_exists = os.path.exists(filename)
+        if not csv_exists or manifest.get("csv_sha256") == file_sha256(filename):
+            catalog = load_snapshot(snapshot_dir, embedding_model)
+            print(f"Caricate {len(catalog)} università dallo snapshot {snapshot_dir}")
+            return catalog
+        print(f"Snapshot {snapshot_dir} non aggiornato rispetto a {filename}, uso il CSV.")
+
+    catalog = load_catalog_csv(filename)
+    print(f"Caricate {len(catalog)} università da {filename}")
+    return catalog
+
+
+# ============= DIFF / RELOAD INCREMENTALE =============
+def text_hash(text: str) -> bytes:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).digest()
+
+def row_hash(row: Dict[str, Any]) -> bytes:
+    return hashlib.sha1(json.dumps(row, sort_keys=True, ensure_ascii=False).encode("utf-8")).digest()
+
+def diff_catalogs(old: Catalog, new: Catalog) -> Dict[str, List[int]]:
+    """Differenze tra due cataloghi per id e hash del contenuto della riga"""
+    old_rows = {row["id"]: row_hash(row) for row in old}
+    new_rows = {row["id"]: row_hash(row) for row in new}
+    return {
+        "added": sorted(set(new_rows) - set(old_rows)),
+        "removed": sorted(set(old_rows) - set(new_rows)),
+        "changed": sorted(i for i in set(new_rows) & set(old_rows) if new_rows[i] != old_rows[i]),
+    }
+
+def reuse_embeddings(old: Catalog, new: Catalog) -> Tuple[Dict[str, np.ndarray], Dict[str, List[int]]]:
+    """
+    Matrici degli embeddings per il nuovo catalogo, riusando i vettori del vecchio
+    per ogni testo semantico già visto (stesso hash).
+    Restituisce le matrici e, per campo, gli id dei testi che vanno ancora embeddati.
+    """
+    embeddings, missing = {}, {}
+    for field in EMBEDDING_FIELDS:
+        dim = old.embeddings[field].shape[1]
+        known = {text_hash(text): j for j, text in enumerate(old.unique_texts(field))}
+        new_texts = new.unique_texts(field)
+        matrix = np.zeros((len(new_texts), dim), dtype=np.float32)
+        missing[field] = []
+        for i, text in enumerate(new_texts):
+            j = known.get(text_hash(text))
+            if j is None:
+                missing[field].append(i)
+            else:
+                matrix[i] = old.embedding_vector(field, j)
+        embeddings[field] = matrix
+    return embeddings, missing
+
+
+# ============= CACHE EMBEDDINGS =============
+def embeddings_cache_path(key: str, directory: str = EMBEDDINGS_CACHE_DIR) -> str:
+    """
+    Sottodirectory della cache per una chiave (hash del CSV, modello, dtype): ogni versione
+    del catalogo ha i suoi file, così un reload non sovrascrive quelli di un worker che
+    serve ancora la versione precedente e gli altri worker trovano pronti i nuovi.
+    """
+    return os.path.join(directory, hashlib.sha256(key.encode("utf-8")).hexdigest()[:16])
+
+def prune_embedding_caches(directory: str = EMBEDDINGS_CACHE_DIR, keep: int = EMBEDDINGS_CACHE_KEEP):
+    """Tiene solo le keep versioni della cache usate più di recente (le altre restano valide se già in mmap)"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_dir()]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+def save_embeddings(
+    embeddings: Dict[str, np.ndarray],
+    directory: str = EMBEDDINGS_CACHE_DIR,
+    key: str = "",
+    scales: Optional[Dict[str, np.ndarray]] = None
+):
+    """
+    Scrive le matrici (già nel dtype finale) e le eventuali scale come .npy.
+    Ogni file è scritto in un temporaneo e poi rinominato, il manifest per ultimo:
+    un worker non legge mai una cache a metà.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = {f"emb_{field}": matrix for field, matrix in embeddings.items()}
+    files.update({f"scale_{field}": field_scales for field, field_scales in (scales or {}).items()})
+    for name, array in files.items():
+        path = os.path.join(directory, f"{name}.npy")
+        tmp = os.path.join(directory, f"{name}.{os.getpid()}.tmp.npy")
+        np.save(tmp, np.ascontiguousarray(array))
+        os.replace(tmp, path)
+    manifest = {
+        "key": key,
+        "shapes": {field: list(matrix.shape) for field, matrix in embeddings.items()},
+        "scales": sorted(scales or {}),
+    }
+    tmp = os.path.join(directory, f"manifest.{os.getpid()}.tmp.json")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(directory, "manifest.json"))
+
+def load_embeddings(
+    directory: str = EMBEDDINGS_CACHE_DIR,
+    key: str = "",
+    rows: Optional[Dict[str, int]] = None
+) -> Optional[Tuple[Dict[str, np.ndarray], Optional[Dict[str, np.ndarray]]]]:
+    """
+    Apre la cache in memory-mapping read-only e restituisce (matrici, scale);
+    None se manca o non corrisponde a key (rows: numero atteso di righe per campo).
+    """
+    try:
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    shapes = manifest.get("shapes", {})
+    if manifest.get("key") != key:
+        return None
+    if rows is not None and any(shapes.get(field, [None])[0] != n for field, n in rows.items()):
+        return None
+    try:
+        embeddings = {
+            field: np.load(os.path.join(directory, f"emb_{field}.npy"), mmap_mode="r")
+            for field in shapes
+        }
+        scales = {
+            field: np.load(os.path.join(directory, f"scale_{field}.npy"), mmap_mode="r")
+            for field in manifest.get("scales", [])
+        }
+    except (FileNotFoundError, ValueError):
+        return None
+    return embeddings, scales or None
+
+
+# ============= MEMORIA =============
+def resident_memory() -> Dict[str, int]:
+    """
+    Memoria residente del processo corrente (byte).
+    rss_file comprende le pagine memory-mapped condivise con gli altri worker,
+    rss_anon la memoria privata del processo.
+    """
+    memory = {"pid": os.getpid()}
+    fields = {"VmRSS": "rss", "RssAnon": "rss_anon", "RssFile": "rss_file", "RssShmem": "rss_shmem", "VmHWM": "rss_peak"}
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    memory[fields[name]] = int(value.split()[0]) * 1024
+    except FileNotFoundError:
+        # Non Linux: solo il picco disponibile (kB su Linux, byte su macOS)
+        import resource, sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory["rss_peak"] = peak if sys.platform == "darwin" else peak * 1024
+    return memory
+
+def catalog_memory(catalog: Catalog) -> Dict[str, Any]:
+    """Dimensione e tipo (memory-mapped o in RAM) degli embeddings del catalogo"""
+    if catalog.embeddings is None:
+        return {"rows": len(catalog), "dedup": catalog.dedup_stats(), "embeddings": None}
+    return {
+        "rows": len(catalog),
+        "dedup": catalog.dedup_stats(),
+        "embeddings": {
+            field: {
+                "shape": list(matrix.shape),
+                "dtype": str(matrix.dtype),
+                "bytes": int(matrix.nbytes) + (
+                    int(catalog.embedding_scales[field].nbytes) if catalog.embedding_scales else 0
+                ),
+                "memory_mapped": isinstance(matrix, np.memmap),
+            }
+            for field, matrix in catalog.embeddings.items()
+        },
+    }
+
+
+# ============= BUILD =============
+def main():
+    parser = argparse.ArgumentParser(description="Compila il CSV delle università in uno snapshot colonnare")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="crea lo snapshot")
+    build.add_argument("--csv", default=DEFAULT_CSV)
+    build.add_argument("--out", default=DEFAULT_SNAPSHOT)
+    build.add_argument("--embed", action="store_true", help="include gli embeddings (backend di PYDEIA_EMBEDDING_BACKEND)")
+    build.add_argument("--dtype", default=EMBEDDING_DTYPE, choices=EMBEDDING_DTYPES, help="formato degli embeddings")
+    args = parser.parse_args()
+
+    catalog = load_catalog_csv(args.csv)
+    embedding_model = None
+    if args.embed:
+        from recommendation_system import embed_texts, EMBEDDER
+        embeddings = {field: embed_texts(catalog.unique_texts(field)) for field in EMBEDDING_FIELDS}
+        catalog.set_embeddings(*quantize_embeddings(embeddings, args.dtype))
+        embedding_model = EMBEDDER.model_id
+
+    build_snapshot(catalog, args.out, csv_sha256=file_sha256(args.csv), embedding_model=embedding_model)
+    print(f"Snapshot con {len(catalog)} università scritto in {args.out}")
+    print(f"Testi distinti per campo: {catalog.dedup_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import logger
+
+
+# Componenti pesanti (client degli SDK, agenti, catalogo, embeddings) costruiti al
+# primo utilizzo o dal riscaldamento in background, non all'import: il server parte
+# subito e /api/ready dice quando è pronto a ricevere traffico.
+
+
+class Component:
+    """Dipendenza costruita una sola volta (thread-safe) con il suo stato per /api/ready"""
+
+    def __init__(self, name: str, factory: Callable[[], Any], required: bool = True):
+        self.name = name
+        self.factory = factory
+        self.required = required      # necessario per essere "ready"
+        self.lock = threading.Lock()
+        self.value = None
+        self.state = "pending"        # pending | loading | ready | error
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def get(self) -> Any:
+        if self.state == "ready":
+            return self.value
+        with self.lock:
+            if self.state != "ready":
+                self.state = "loading"
+                start = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.state, self.error = "error", repr(e)
+                    raise
+                self.seconds = time.perf_counter() - start
+                self.state, self.error = "ready", None
+        return self.value
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "required": self.required,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "error": self.error,
+        }
+
+COMPONENTS: Dict[str, Component] = {}
+
+def register_component(name: str, factory: Callable[[], Any], required: bool = True) -> Component:
+    component = COMPONENTS[name] = Component(name, factory, required)
+    return component
+
+def readiness() -> Dict[str, Any]:
+    """Pronto quando tutti i componenti richiesti sono costruiti; stato di ognuno"""
+    return {
+        "ready": all(c.ready for c in COMPONENTS.values() if c.required),
+        "components": {name: c.status() for name, c in COMPONENTS.items()},
+    }
+
+def warm_up(names: Optional[List[str]] = None, retry_seconds: float = 5.0):
+    """
+    Costruisce i componenti (nell'ordine di registrazione), riprovando quelli falliti
+    ogni retry_seconds (es. Ollama non ancora avviato) finché non sono tutti pronti.
+    """
+    pending = list(names or COMPONENTS)
+    while pending:
+        for name in list(pending):
+            try:
+                COMPONENTS[name].get()
+                pending.remove(name)
+                logger.info(f"Warm-up: {name} pronto in {COMPONENTS[name].seconds:.2f} s")
+            except Exception as e:
+                logger.warning(f"Warm-up: {name} non disponibile ({e!r}), nuovo tentativo tra {retry_seconds:.0f} s")
+        if pending:
+            time.sleep(retry_seconds)
@@ -0,0 +1,172 @@
+import os
+import re
+import asyncio
+import hashlib
+import threading
+from functools import lru_cache, partial
+from typing import Dict, List, Tuple, Type
+
+import numpy as np
+
+from catalog import normalize_text
+from resilience import upstream
+
+
+# Backend degli embeddings, lo stesso per studenti e catalogo:
+# - "ollama" (default): granite-embedding:30m servito da Ollama, via HTTP (API compatibile OpenAI);
+# - "hashing": in-process su CPU, feature hashing di parole e trigrammi di caratteri.
+#   Nessun servizio esterno né rete; meno semantico del modello (conta le parole in comune).
+# Il model_id del backend entra nella chiave della cache degli embeddings e nel manifest
+# dello snapshot: vettori di backend diversi non vengono mai confrontati tra loro.
+EMBEDDING_BACKEND = os.environ.get("PYDEIA_EMBEDDING_BACKEND", "ollama")
+
+OLLAMA_BASE_URL = os.environ.get("PYDEIA_OLLAMA_BASE_URL", "http://localhost:11434/v1")
+OLLAMA_MODEL = "granite-embedding:30m"
+OLLAMA_BATCH_SIZE = 64
+
+# Dimensione dei vettori hashing (la stessa di granite-embedding:30m)
+HASH_DIM = 384
+HASHING_DIM = int(os.environ.get("PYDEIA_HASHING_DIM", str(HASH_DIM)))
+HASHING_CHAR_NGRAMS = 3
+
+WORD_RE = re.compile(r"\w+")
+
+
+class EmbeddingBackend:
+    """Interfaccia dei backend: matrice N x d float32 per N testi, sincrona e asincrona"""
+
+    name = ""
+    model_id = ""   # identifica lo spazio dei vettori (cache, snapshot)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    async def a_embed(self, texts: List[str]) -> np.ndarray:
+        """Modalità ASGI: di default il calcolo gira in un thread, fuori dall'event loop"""
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class OllamaBackend(EmbeddingBackend):
+    """Embeddings da Ollama con richieste batch; i client sono creati al primo uso"""
+
+    name = "ollama"
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL, model: str = OLLAMA_MODEL, batch_size: int = OLLAMA_BATCH_SIZE):
+        self.base_url = base_url
+        self.model_id = model
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+
+    def client(self):
+        """Client OpenAI verso Ollama (l'SDK openai è importato qui: è lento da importare)"""
+        with self.lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(
+                    base_url=self.base_url,
+                    api_key="ollama",  # qualsiasi stringa
+                    timeout=upstream("ollama").policy.timeout,
+                    max_retries=0,     # i retry li fa resilience.py
+                )
+            return self._client
+
+    def async_client(self):
+        """Client asincrono (modalità ASGI): un pool di connessioni condiviso"""
+        with self.lock:
+            if self._async_client is None:
+                from openai import AsyncOpenAI
+                self._async_client = AsyncOpenAI(
+                    base_url=self.base_url,
+                    api_key="ollama",
+                    timeout=upstream("ollama").policy.timeout,
+                    max_retries=0,
+                )
+            return self._async_client
+
+    def batches(self, texts: List[str]):
+        for start in range(0, len(texts), self.batch_size):
+            yield texts[start:start + self.batch_size]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        client = self.client()
+        vectors = []
+        for batch in self.batches(texts):
+            # idempotente: una richiesta lenta può essere duplicata (hedging)
+            response = upstream("ollama").call(partial(client.embeddings.create, input=batch, model=self.model_id), idempotent=True)
+            vectors.extend(item.embedding for item in response.data)
+        return np.array(vectors, dtype=np.float32)
+
+    async def a_embed(self, texts: List[str]) -> np.ndarray:
+        client = await asyncio.to_thread(self.async_client)
+        vectors = []
+        for batch in self.batches(texts):
+            response = await upstream("ollama").a_call(partial(client.embeddings.create, input=batch, model=self.model_id), idempotent=True)
+            vectors.extend(item.embedding for item in response.data)
+        return np.array(vectors, dtype=np.float32)
+
+
+@lru_cache(maxsize=1 << 18)
+def hash_feature(feature: str, dim: int) -> Tuple[int, float]:
+    """Bucket e segno di una feature (blake2b: stabile tra processi ed esecuzioni)"""
+    h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dim, 1.0 if h >> 63 else -1.0
+
+class HashEmbedder:
+    """
+    Feature hashing delle parole (segno e bucket da blake2b), normalizzato. Testi con
+    parole in comune hanno coseno positivo; nessuna rete, risultati riproducibili.
+    Con char_ngrams > 0 aggiunge gli n-grammi di caratteri di ogni parola (peso ridotto):
+    parole con la stessa radice ("engineer", "engineering") si avvicinano.
+    """
+
+    def __init__(self, dim: int = HASH_DIM, char_ngrams: int = 0, ngram_weight: float = 0.5):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self.ngram_weight = ngram_weight
+
+    def features(self, word: str) -> List[Tuple[str, float]]:
+        features = [(word, 1.0)]
+        n = self.char_ngrams
+        if n:
+            padded = f"<{word}>"
+            features.extend((f"#{padded[i:i + n]}", self.ngram_weight) for i in range(len(padded) - n + 1))
+        return features
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts: Dict[str, float] = {}
+            for word in WORD_RE.findall(normalize_text(text)):
+                for feature, weight in self.features(word):
+                    counts[feature] = counts.get(feature, 0.0) + weight
+            for feature, weight in counts.items():
+                bucket, sign = hash_feature(feature, self.dim)
+                vectors[i, bucket] += sign * weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+
+class HashingBackend(EmbeddingBackend):
+    """Embeddings in-process su CPU (HashEmbedder con trigrammi di caratteri)"""
+
+    name = "hashing"
+
+    def __init__(self, dim: int = HASHING_DIM, char_ngrams: int = HASHING_CHAR_NGRAMS):
+        self.embedder = HashEmbedder(dim, char_ngrams)
+        self.model_id = f"hashing-v1:{dim}:{char_ngrams}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.embedder(texts)
+
+
+BACKENDS: Dict[str, Type[EmbeddingBackend]] = {
+    OllamaBackend.name: OllamaBackend,
+    HashingBackend.name: HashingBackend,
+}
+
+def create_backend(name: str = EMBEDDING_BACKEND) -> EmbeddingBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"PYDEIA_EMBEDDING_BACKEND deve essere uno tra {tuple(BACKENDS)}, non '{name}'")
+    return BACKENDS[name]()
@@ -0,0 +1,98 @@
+import os
+import gzip
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import brotli      # opzionale: senza, le risposte sono compresse solo con gzip
+except ImportError:
+    brotli = None
+
+
+# Codifica delle risposte dell'API, condivisa da server.py e asgi.py:
+# - JSON con orjson: tipi NumPy (scalari e array) serializzati nativamente, output già in bytes;
+# - compressione gzip/brotli negoziata con Accept-Encoding, solo per risposte testuali
+#   più grandi di COMPRESS_MIN_BYTES (sotto, l'overhead supera il guadagno).
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+COMPRESS_MIN_BYTES = int(os.environ.get("PYDEIA_COMPRESS_MIN_BYTES", "1024"))
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5     # le qualità più alte (fino a 11) costano troppa CPU per risposte dinamiche
+
+# In ordine di preferenza a parità di q
+ENCODINGS: List[str] = (["br"] if brotli is not None else []) + ["gzip"]
+
+
+# ============= JSON =============
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider di Flask su orjson: jsonify e request.get_json restano invariati"""
+
+    @staticmethod
+    def default(obj: Any) -> Any:
+        # array NumPy non contigui o con dtype non supportati da orjson
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return DefaultJSONProvider.default(obj)
+
+    def encode(self, obj: Any, indent: bool = False) -> bytes:
+        options = JSON_OPTIONS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=options)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self.encode(obj, indent=bool(kwargs.get("indent"))).decode("utf-8")
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.encode(obj, indent) + b"\n", mimetype=self.mimetype)
+
+
+# ============= COMPRESSIONE =============
+def compressible(content_type: str, size: int) -> bool:
+    return size >= COMPRESS_MIN_BYTES and (content_type or "").startswith(COMPRESSIBLE_TYPES)
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """q-value di ogni codifica in Accept-Encoding (es. "gzip;q=0.8, br")"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Codifica preferita dal client tra quelle disponibili; None = risposta non compressa"""
+    accepted = accepted_encodings(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
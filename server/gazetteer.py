@@ -0,0 +1,379 @@
+import os
+import io
+import csv
+import time
+import zipfile
+import argparse
+import urllib.request
+import unicodedata
+import numpy as np
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import List, Dict, Optional, NamedTuple, Tuple
+
+from catalog import DATA_DIR
+
+
+# Gazetteer offline dei comuni italiani: coordinate per origine e località dello
+# studente senza servizi di geocoding. Nomi normalizzati (accenti, maiuscole,
+# apostrofi) in un dict per la ricerca esatta O(1), indice di trigrammi per la
+# ricerca fuzzy (errori di trascrizione vocale: "Bolonia", "Milamo").
+#
+# data/gazetteer_it.csv si genera con `python gazetteer.py build`: elenco dei comuni
+# ISTAT (nome, altra lingua, sigla, regione) unito per codice ISTAT alle coordinate e
+# alla popolazione di GeoNames (IT.txt, dove admin3 è il codice ISTAT del comune).
+# Gli alias già presenti nel file (esonimi: Rome, Milan, Bozen...) sono conservati.
+# In alternativa PYDEIA_GAZETTEER indica un altro CSV con le stesse colonne; sono
+# accettate anche le intestazioni in italiano (nome/denominazione, sigla/provincia,
+# regione, latitudine, longitudine, popolazione).
+
+
+DEFAULT_GAZETTEER = os.environ.get("PYDEIA_GAZETTEER", os.path.join(DATA_DIR, "gazetteer_it.csv"))
+
+# Soglia di similarità (difflib ratio) per accettare una corrispondenza fuzzy: alta, perché
+# un comune sbagliato è peggio di nessun comune (distanza di fallback). "Bolonia" -> Bologna
+# è 0.857; "Ostia" -> Aosta (0.8) non deve passare.
+FUZZY_CUTOFF = 0.85
+# Candidati (per trigrammi in comune) confrontati per intero nella ricerca fuzzy
+FUZZY_CANDIDATES = 20
+# Risultati delle ricerche memorizzati (svuotato quando pieno)
+RESOLVE_CACHE_SIZE = 4096
+
+# Intestazioni accettate per ogni colonna
+HEADER_ALIASES = {
+    "name": ("name", "nome", "denominazione", "comune", "denominazione_ita"),
+    "province": ("province", "sigla", "provincia", "sigla_provincia"),
+    "region": ("region", "regione", "denominazione_regione"),
+    "lat": ("lat", "latitude", "latitudine"),
+    "lon": ("lon", "lng", "longitude", "longitudine"),
+    "population": ("population", "popolazione", "residenti"),
+    "aliases": ("aliases", "altri_nomi", "alias"),
+}
+
+# Nomi alternativi delle regioni (inglese, varianti d'uso)
+REGION_ALIASES = {
+    "Piemonte": ["Piedmont"],
+    "Valle d'Aosta": ["Valle d'Aoste", "Aosta Valley"],
+    "Lombardia": ["Lombardy"],
+    "Trentino-Alto Adige": ["Trentino", "Alto Adige", "Südtirol", "South Tyrol"],
+    "Friuli-Venezia Giulia": ["Friuli"],
+    "Toscana": ["Tuscany"],
+    "Puglia": ["Apulia"],
+    "Sicilia": ["Sicily"],
+    "Sardegna": ["Sardinia"],
+}
+
+# Sorgenti del build (scaricate se non si indicano file locali)
+ISTAT_COMUNI_URL = "https://www.istat.it/storage/codici-unita-amministrative/Elenco-comuni-italiani.csv"
+GEONAMES_IT_URL = "https://download.geonames.org/export/dump/IT.zip"
+# Colonne dell'elenco ISTAT (prefisso dell'intestazione normalizzata)
+ISTAT_COLUMNS = {
+    "code": "codice_comune_formato_alfanumerico",
+    "name": "denominazione_in_italiano",
+    "other": "denominazione_altra_lingua",
+    "region": "denominazione_regione",
+    "province": "sigla_automobilistica",
+}
+# Luoghi GeoNames che rappresentano la sede del comune, dal più al meno affidabile
+GEONAMES_SEATS = ("PPLC", "PPLA", "PPLA2", "PPLA3", "ADM3")
+GAZETTEER_COLUMNS = ["name", "province", "region", "lat", "lon", "population", "aliases"]
+
+# Località che non esprimono una preferenza ("anywhere")
+ANY_LOCATION = {"all", "any", "anywhere", "everywhere", "ovunque", "tutte", "tutta italia", "italia", "italy"}
+
+
+def normalize_place(text: str) -> str:
+    """Forma canonica di un toponimo: senza accenti, minuscola, punteggiatura come spazi"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = "".join(ch if ch.isalnum() else " " for ch in text.casefold())
+    return " ".join(text.split())
+
+def trigrams(key: str) -> List[str]:
+    padded = f"  {key} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+class Place(NamedTuple):
+    name: str
+    province: str
+    region: str
+    lat: float
+    lon: float
+
+class Gazetteer:
+    """
+    Comuni in array paralleli (nomi, provincia, regione, coordinate float64) più:
+    - index: nome normalizzato (o alias) -> comune
+    - regions: nome normalizzato della regione (o alias) -> regione
+    - trigram_index: trigramma -> chiavi di index che lo contengono (per la ricerca fuzzy)
+    """
+
+    def __init__(
+        self,
+        names: List[str],
+        provinces: List[str],
+        regions: List[str],
+        lat: np.ndarray,
+        lon: np.ndarray,
+        aliases: Optional[List[List[str]]] = None
+    ):
+        self.names = names
+        self.provinces = provinces
+        self.region_names = regions
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+
+        # A parità di nome vince il primo (il loader ordina per popolazione)
+        self.index: Dict[str, int] = {}
+        for i, name in enumerate(names):
+            for alias in [name] + (aliases[i] if aliases else []):
+                self.index.setdefault(normalize_place(alias), i)
+
+        self.regions: Dict[str, str] = {}
+        for region in set(regions):
+            for alias in [region] + REGION_ALIASES.get(region, []):
+                self.regions.setdefault(normalize_place(alias), region)
+
+        self.keys = list(self.index)
+        grams: Dict[str, List[int]] = {}
+        for key_id, key in enumerate(self.keys):
+            for gram in set(trigrams(key)):
+                grams.setdefault(gram, []).append(key_id)
+        self.trigram_index = {gram: np.array(ids, dtype=np.int32) for gram, ids in grams.items()}
+        self._cache: Dict[str, Optional[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def place(self, i: int) -> Place:
+        return Place(self.names[i], self.provinces[i], self.region_names[i], float(self.lat[i]), float(self.lon[i]))
+
+    def lookup(self, text: str) -> Optional[int]:
+        """Ricerca esatta (sul nome normalizzato)"""
+        return self.index.get(normalize_place(text))
+
+    def match(self, text: str, cutoff: float = FUZZY_CUTOFF) -> Optional[int]:
+        """
+        Ricerca fuzzy: il nome più simile tra quelli con più trigrammi in comune.
+        Solo corrispondenze sicure: stessa iniziale, ratio >= cutoff e nessun altro nome
+        altrettanto simile; altrimenti None (si usa il fallback invece di indovinare).
+        """
+        key = normalize_place(text)
+        if key in self.index:
+            return self.index[key]
+        if len(key) < 3:
+            return None
+        counts = Counter()
+        for gram in trigrams(key):
+            ids = self.trigram_index.get(gram)
+            if ids is not None:
+                counts.update(ids.tolist())
+        best_ratio, best_key, tied = cutoff, None, False
+        for key_id, _ in counts.most_common(FUZZY_CANDIDATES):
+            candidate = self.keys[key_id]
+            if candidate[0] != key[0]:
+                continue
+            ratio = SequenceMatcher(None, key, candidate).ratio()
+            if ratio > best_ratio or (best_key is None and ratio >= best_ratio):
+                best_ratio, best_key, tied = ratio, candidate, False
+            elif ratio == best_ratio and self.index[candidate] != self.index[best_key]:
+                tied = True   # due comuni diversi ugualmente simili
+        if best_key is None or tied:
+            return None
+        return self.index[best_key]
+
+    def resolve(self, text: str) -> Optional[int]:
+        """
+        Comune indicato dal testo: prima esatto, poi fuzzy; con "Città, Provincia" o
+        "Città (XX)" si prova anche solo la prima parte. Risultati in cache.
+        """
+        if not text:
+            return None
+        if text in self._cache:
+            return self._cache[text]
+        found = self.match(text)
+        if found is None:
+            head = text.split(",")[0].split("(")[0]
+            if head.strip() and head != text:
+                found = self.match(head)
+        if len(self._cache) >= RESOLVE_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[text] = found
+        return found
+
+    def coords(self, text: str) -> Optional[Dict[str, float]]:
+        """Coordinate {"lat", "lon"} del comune, o None se sconosciuto"""
+        i = self.resolve(text)
+        if i is None:
+            return None
+        return {"lat": float(self.lat[i]), "lon": float(self.lon[i])}
+
+    def region(self, text: str) -> Optional[str]:
+        """Regione se il testo nomina una regione (non un comune), altrimenti None"""
+        return self.regions.get(normalize_place(text))
+
+
+def load_gazetteer(filename: str = DEFAULT_GAZETTEER) -> Gazetteer:
+    """Carica il gazetteer da CSV (separatore ',' o ';'); i comuni più popolosi hanno precedenza"""
+    start = time.perf_counter()
+    with open(filename, encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        reader = csv.reader(f, delimiter=";" if sample.count(";") > sample.count(",") else ",")
+        header = [normalize_place(h).replace(" ", "_") for h in next(reader)]
+        columns = {}
+        for column, names in HEADER_ALIASES.items():
+            columns[column] = next((header.index(n) for n in names if n in header), None)
+        if columns["name"] is None or columns["lat"] is None or columns["lon"] is None:
+            raise ValueError(f"{filename}: servono almeno le colonne nome, lat e lon")
+
+        def cell(row, column):
+            i = columns[column]
+            return row[i].strip() if i is not None and i < len(row) else ""
+
+        records = []
+        for row in reader:
+            if not row:
+                continue
+            name = cell(row, "name")
+            lat, lon = cell(row, "lat").replace(",", "."), cell(row, "lon").replace(",", ".")
+            if not name or not lat or not lon:
+                continue
+            # Nomi bilingui ISTAT ("Bolzano/Bozen"): ogni forma è un alias
+            forms = [form.strip() for form in name.split("/") if form.strip()]
+            aliases = forms[1:] + [a.strip() for a in cell(row, "aliases").split("|") if a.strip()]
+            population = cell(row, "population")
+            records.append((
+                -float(population) if population else 0.0,
+                forms[0], cell(row, "province"), cell(row, "region"), float(lat), float(lon), aliases
+            ))
+
+    records.sort(key=lambda r: r[0])   # stabile: a pari popolazione resta l'ordine del file
+    gazetteer = Gazetteer(
+        names=[r[1] for r in records],
+        provinces=[r[2] for r in records],
+        regions=[r[3] for r in records],
+        lat=np.array([r[4] for r in records]),
+        lon=np.array([r[5] for r in records]),
+        aliases=[r[6] for r in records],
+    )
+    print(f"Gazetteer: {len(gazetteer)} comuni da {filename} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return gazetteer
+
+
+def read_source(source: str) -> bytes:
+    """Contenuto di un file locale o di un URL"""
+    if "://" in source:
+        with urllib.request.urlopen(source, timeout=60) as response:
+            return response.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+def read_istat_comuni(data: bytes) -> List[Dict[str, str]]:
+    """Comuni dell'elenco ISTAT (CSV ';', storicamente in cp1252)"""
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = data.decode("cp1252")
+    reader = csv.reader(io.StringIO(text), delimiter=";")
+    header = [normalize_place(h).replace(" ", "_") for h in next(reader)]
+    columns = {}
+    for column, prefix in ISTAT_COLUMNS.items():
+        columns[column] = next((i for i, h in enumerate(header) if h.startswith(prefix)), None)
+        if columns[column] is None:
+            raise ValueError(f"elenco ISTAT: colonna '{prefix}' non trovata")
+    comuni = []
+    for row in reader:
+        if len(row) <= max(columns.values()) or not row[columns["code"]].strip():
+            continue
+        comune = {column: row[i].strip() for column, i in columns.items()}
+        # "Trentino-Alto Adige/Südtirol" -> "Trentino-Alto Adige" (gli alias sono in REGION_ALIASES)
+        comune["region"] = comune["region"].split("/")[0].strip()
+        comuni.append(comune)
+    return comuni
+
+def read_geonames_seats(data: bytes) -> Dict[str, Tuple[float, float, int]]:
+    """Codice ISTAT -> (lat, lon, popolazione) della sede del comune in GeoNames IT.txt (o IT.zip)"""
+    if data[:2] == b"PK":
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            data = archive.read("IT.txt")
+    best: Dict[str, Tuple[Tuple[int, int], float, float, int]] = {}
+    population: Dict[str, int] = {}
+    for line in data.decode("utf-8").splitlines():
+        fields = line.split("\t")
+        if len(fields) < 15 or fields[8] != "IT":
+            continue
+        code, feature = fields[12].strip(), fields[7]
+        if not code or feature not in GEONAMES_SEATS:
+            continue
+        people = int(fields[14] or 0)
+        if feature == "ADM3":
+            # la popolazione del comune è quella dell'unità amministrativa
+            population[code] = people
+        # a pari tipo di luogo vince il più popoloso (frazioni classificate come sede)
+        rank = (GEONAMES_SEATS.index(feature), -people)
+        if code not in best or rank < best[code][0]:
+            best[code] = (rank, float(fields[4]), float(fields[5]), people)
+    return {
+        code: (lat, lon, population.get(code, people))
+        for code, (_, lat, lon, people) in best.items()
+    }
+
+def build_gazetteer(istat: str, geonames: str, out: str, previous: Optional[str] = None) -> int:
+    """
+    Scrive il gazetteer dei comuni in out; gli alias dei comuni già presenti in previous
+    (stesso nome e provincia) sono conservati. Restituisce il numero di comuni scritti.
+    """
+    comuni = read_istat_comuni(read_source(istat))
+    seats = read_geonames_seats(read_source(geonames))
+    kept_aliases: Dict[Tuple[str, str], List[str]] = {}
+    if previous and os.path.exists(previous):
+        with open(previous, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                aliases = [a for a in (row.get("aliases") or "").split("|") if a]
+                if aliases:
+                    kept_aliases[(normalize_place(row["name"]), row.get("province", ""))] = aliases
+
+    rows, missing = [], []
+    for comune in comuni:
+        seat = seats.get(comune["code"])
+        if seat is None:
+            missing.append(comune["name"])
+            continue
+        lat, lon, population = seat
+        aliases = [comune["other"]] if comune["other"] else []
+        for alias in kept_aliases.get((normalize_place(comune["name"]), comune["province"]), []):
+            if alias not in aliases:
+                aliases.append(alias)
+        rows.append([
+            comune["name"], comune["province"], comune["region"],
+            f"{lat:.4f}", f"{lon:.4f}", population or "", "|".join(aliases)
+        ])
+    if missing:
+        print(f"Comuni senza coordinate in GeoNames ({len(missing)}): {', '.join(missing[:20])}")
+
+    rows.sort(key=lambda r: -(r[5] or 0))
+    tmp = f"{out}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(GAZETTEER_COLUMNS)
+        writer.writerows(rows)
+    os.replace(tmp, out)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera il gazetteer dei comuni italiani (ISTAT + GeoNames)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="scrive il CSV del gazetteer")
+    build.add_argument("--istat", default=ISTAT_COMUNI_URL, help="Elenco-comuni-italiani.csv (file o URL)")
+    build.add_argument("--geonames", default=GEONAMES_IT_URL, help="IT.txt o IT.zip di GeoNames (file o URL)")
+    build.add_argument("--out", default=DEFAULT_GAZETTEER)
+    args = parser.parse_args()
+
+    count = build_gazetteer(args.istat, args.geonames, args.out, previous=args.out)
+    print(f"Gazetteer con {count} comuni scritto in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import base64
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional, Tuple
+
+from benchmark import git_commit, write_results
+from embeddings import HashEmbedder, HASH_DIM
+
+
+# Load test di server.py con conversazioni concorrenti, senza servizi esterni.
+# Tre server locali sostituiscono OpenAI (Responses API: estrazione strutturata e
+# agenti), Ollama (embeddings) ed ElevenLabs (TTS), ognuno con la sua distribuzione
+# di latenza e il suo tasso di errore. Studenti virtuali percorrono il flusso completo
+#   /api/reset → /api/initialize → /api/get_question* → /api/generate_results → /api/text_to_speech
+# e il report riporta throughput, p50/p95/p99 ed errori per endpoint.
+#
+#   python server/loadtest.py --concurrency 1,4,16 --duration 60 --llm-latency lognormal:0.8,0.4
+#
+# Nota: server.py ha una sola conversazione per processo, quindi gli studenti
+# concorrenti la condividono; il test misura la capacità degli endpoint, non
+# l'isolamento tra sessioni.
+
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Distribuzioni di latenza di default (secondi)
+DEFAULT_LATENCY = {
+    "llm": "lognormal:0.8,0.4",
+    "embeddings": "lognormal:0.02,0.3",
+    "tts": "lognormal:0.4,0.3",
+}
+# Campi di Info compilati da ogni risposta simulata dell'estrazione
+FIELDS_PER_TURN = 3
+# Attesa massima dell'avvio di server.py (secondi)
+SERVER_START_TIMEOUT = 120
+# Byte di audio simulato per carattere di testo (~mp3 a 128 kbps)
+AUDIO_BYTES_PER_CHAR = 800
+
+
+# ============= LATENZA =============
+class LatencyModel:
+    """
+    Distribuzione di latenza da una specifica testuale (secondi):
+      "0.2" o "fixed:0.2", "uniform:0.1,0.5", "lognormal:<mediana>,<sigma>"
+    """
+
+    KINDS = ("fixed", "uniform", "lognormal")
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        if not params:
+            kind, params = "fixed", spec
+        if kind not in self.KINDS:
+            raise ValueError(f"Distribuzione sconosciuta '{kind}' (ammesse: {', '.join(self.KINDS)})")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(v) for v in params.split(",")]
+        if len(self.params) != (1 if kind == "fixed" else 2):
+            raise ValueError(f"Parametri non validi per {kind}: '{params}'")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+    def __str__(self) -> str:
+        return self.spec
+
+
+# ============= SERVIZI SIMULATI =============
+STUDENT_VALUES = {
+    "academic_profile": [
+        "Computer Science, Mathematics", "Medicine, Biology", "Law, History, Philosophy",
+        "Design, Architecture", "Economics, Management", "NO: Medicine, Law",
+    ],
+    "aspiration_values": ["very motivated, disciplined", "curious, wants to do research", "not very motivated"],
+    "lifestyle_preferences": ["party-oriented, sporty", "calm, studious", "lively city, lots of energy"],
+    "origin": ["Perugia", "Roma", "Milano", "Napoli", "Bari", "Torino", "Bologna", "Palermo"],
+    "location": ["all", "Milano", "Bologna", "Roma", "Toscana"],
+}
+
+QUESTIONS = [
+    "Which school subjects do you enjoy the most, and how much should they weigh in your choice?",
+    "How much could your family spend each year on tuition and living costs?",
+    "Would you like to live far from home, or stay close to your family?",
+    "What kind of student life are you looking for?",
+]
+
+WEIGHTS_TEXT = "[0.25, 0.15, 0.1, 0.15, 0.15, 0.2]"
+
+def schema_type(spec: Dict[str, Any]) -> str:
+    """Tipo (non null) di una proprietà dello schema JSON"""
+    for option in spec.get("anyOf", [spec]):
+        if option.get("type") not in (None, "null"):
+            return option["type"]
+    return "string"
+
+def fake_value(name: str, kind: str, rng: random.Random):
+    if name in STUDENT_VALUES:
+        return rng.choice(STUDENT_VALUES[name])
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "integer":
+        return rng.randrange(0, 15000, 500)
+    if kind == "number":
+        return round(rng.uniform(6, 10), 1) if name == "gpa" else float(rng.randrange(100, 900, 50))
+    return "not sure"
+
+def fake_structured(schema: Dict[str, Any], body: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    """
+    Oggetto conforme allo schema (strict) con FIELDS_PER_TURN campi compilati, gli altri
+    null. Si compilano di preferenza i campi ancora None nello stato che server.py
+    passa all'estrazione ("Current state: {...}"), così la conversazione avanza.
+    """
+    properties = schema.get("properties", {})
+    # La memoria contiene anche gli stati precedenti: conta solo l'ultimo
+    state = json.dumps(body.get("input", "")).rsplit("Current state", 1)[-1]
+    missing = [name for name in properties if f"'{name}': None" in state]
+    candidates = missing or sorted(properties)
+    filled = set(rng.sample(candidates, min(FIELDS_PER_TURN, len(candidates))))
+    return {
+        name: fake_value(name, schema_type(spec), rng) if name in filled else None
+        for name, spec in properties.items()
+    }
+
+def fake_agent_text(body: Dict[str, Any], rng: random.Random) -> str:
+    """Risposta di uno degli agenti di server.py, riconosciuto dal suo input"""
+    prompt = json.dumps(body.get("input", ""))
+    if "Final student profile" in prompt:
+        return WEIGHTS_TEXT
+    if "Degree options" in prompt:
+        return json.dumps([
+            {"university": f"Option {i}", "pros": ["Good fit for your interests"], "cons": ["Far from home"]}
+            for i in range(1, 4)
+        ])
+    return rng.choice(QUESTIONS)
+
+def responses_payload(body: Dict[str, Any], text: str) -> Dict[str, Any]:
+    """Risposta nel formato della Responses API di OpenAI"""
+    return {
+        "id": f"resp_{random.getrandbits(64):016x}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", ""),
+        "status": "completed",
+        "output": [{
+            "type": "message", "id": f"msg_{random.getrandbits(64):016x}", "role": "assistant",
+            "status": "completed", "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": body.get("tool_choice", "auto"),
+        "tools": [],
+        "usage": {
+            "input_tokens": len(json.dumps(body.get("input", ""))) // 4, "output_tokens": len(text) // 4,
+            "total_tokens": (len(json.dumps(body.get("input", ""))) + len(text)) // 4,
+            "input_tokens_details": {"cached_tokens": 0}, "output_tokens_details": {"reasoning_tokens": 0},
+        },
+    }
+
+class StandInServer(ThreadingHTTPServer):
+    """Un servizio simulato ("llm", "embeddings" o "tts") con latenza ed errori configurabili"""
+
+    daemon_threads = True
+
+    def __init__(self, kind: str, latency: LatencyModel, error_rate: float, seed: int = 0, dim: int = HASH_DIM):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.kind = kind
+        self.latency = latency
+        self.error_rate = error_rate
+        self.embedder = HashEmbedder(dim)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.injected_errors = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def draw(self) -> Tuple[float, bool, random.Random]:
+        """Latenza, errore sì/no e un generatore per la risposta (estratti sotto lock)"""
+        with self.lock:
+            self.calls += 1
+            fail = self.rng.random() < self.error_rate
+            self.injected_errors += fail
+            return self.latency.sample(self.rng), fail, random.Random(self.rng.getrandbits(64))
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"calls": self.calls, "injected_errors": self.injected_errors,
+                    "latency": str(self.latency), "error_rate": self.error_rate}
+
+    def start(self) -> "StandInServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"    # keep-alive, come le API vere
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status: int, payload: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        server: StandInServer = self.server
+        delay, fail, rng = server.draw()
+        time.sleep(delay)
+        if fail:
+            error = {"error": {"message": "Injected stand-in error", "type": "server_error", "code": None}}
+            return self.send(500, json.dumps(error).encode())
+
+        if server.kind == "tts":
+            # ElevenLabs: POST /v1/text-to-speech/<voice_id>, risposta audio
+            text = json.loads(raw or b"{}").get("text", "")
+            return self.send(200, b"ID3" + bytes(len(text) * AUDIO_BYTES_PER_CHAR), "audio/mpeg")
+
+        body = json.loads(raw or b"{}")
+        if server.kind == "embeddings" and self.path.endswith("/embeddings"):
+            texts = body.get("input", "")
+            texts = [texts] if isinstance(texts, str) else texts
+            vectors = server.embedder(texts)
+            base64_output = body.get("encoding_format") == "base64"
+            data = [
+                {"object": "embedding", "index": i,
+                 "embedding": base64.b64encode(v.astype("<f4").tobytes()).decode() if base64_output else v.tolist()}
+                for i, v in enumerate(vectors)
+            ]
+            tokens = sum(len(t.split()) for t in texts)
+            payload = {"object": "list", "data": data, "model": body.get("model", ""),
+                       "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+            return self.send(200, json.dumps(payload).encode())
+
+        if server.kind == "llm" and self.path.endswith("/responses"):
+            text_format = (body.get("text") or {}).get("format") or {}
+            if text_format.get("type") == "json_schema":
+                text = json.dumps(fake_structured(text_format.get("schema", {}), body, rng))
+            else:
+                text = fake_agent_text(body, rng)
+            return self.send(200, json.dumps(responses_payload(body, text)).encode())
+
+        self.send(404, json.dumps({"error": {"message": f"Unknown path {self.path}"}}).encode())
+
+
+# ============= SERVER SOTTO TEST =============
+def start_server(
+    port: int, upstreams: Dict[str, StandInServer], workdir: str, asgi: bool = False
+) -> Tuple[subprocess.Popen, str]:
+    """
+    Avvia server.py (Flask, multithread) o asgi.py (uvicorn, asincrono) puntato sui
+    servizi simulati; restituisce processo e log
+    """
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "loadtest",
+        "ELEVENLABS_API_KEY": "loadtest",
+        "PYDEIA_OPENAI_BASE_URL": upstreams["llm"].url + "/v1",
+        "PYDEIA_OLLAMA_BASE_URL": upstreams["embeddings"].url + "/v1",
+        "PYDEIA_ELEVENLABS_BASE_URL": upstreams["tts"].url,
+        # Embeddings del simulatore: cache e snapshot separati da quelli veri
+        "PYDEIA_EMBEDDINGS_CACHE": os.path.join(workdir, "embeddings"),
+        "PYDEIA_CATALOG_SNAPSHOT": os.path.join(workdir, "no_snapshot"),
+        "PYDEIA_LOG_LEVEL": os.environ.get("PYDEIA_LOG_LEVEL", "WARNING"),
+    }
+    log_path = os.path.join(workdir, "server.log")
+    log = open(log_path, "w", encoding="utf-8")
+    if asgi:
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+                   "--no-access-log"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "server", "run", "--host", "127.0.0.1", "--port", str(port),
+                   "--no-reload", "--no-debugger", "--with-threads"]
+    process = subprocess.Popen(
+        command,
+        cwd=SERVER_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    return process, log_path
+
+def wait_ready(base_url: str, process: Optional[subprocess.Popen], timeout: float = SERVER_START_TIMEOUT):
+    """Attende /api/ready (200 a riscaldamento finito: client, catalogo, embeddings)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server.py terminato all'avvio (exit code {process.returncode})")
+        try:
+            with urllib.request.urlopen(base_url + "/api/ready", timeout=2):
+                return
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            time.sleep(0.2)
+    raise RuntimeError(f"server.py non pronto su {base_url} dopo {timeout:.0f} s")
+
+
+# ============= STUDENTI VIRTUALI =============
+ANSWERS = [
+    "I love programming and maths, I'd like to become an engineer.",
+    "My family could spend around 4000 euros per year.",
+    "I'm from Perugia and I would move up to 400 km away, I'd like a dorm.",
+    "I prefer a calm city where I can study, English courses are fine.",
+    "I don't mind an admission test.",
+]
+
+class Recorder:
+    """Latenze ed esiti per endpoint, condivisi tra gli studenti"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[Tuple[float, bool]]] = {}
+        self.flows = 0
+        self.failed_flows = 0
+
+    def add(self, endpoint: str, seconds: float, ok: bool):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append((seconds, ok))
+
+    def flow(self, ok: bool):
+        with self.lock:
+            self.flows += 1
+            self.failed_flows += not ok
+
+def call(base_url: str, endpoint: str, payload: Optional[Dict], recorder: Recorder, timeout: float) -> Optional[Any]:
+    """POST JSON; registra latenza ed esito (errore: HTTP >= 400, eccezione o campo 'error')"""
+    request = urllib.request.Request(
+        base_url + endpoint, data=json.dumps(payload or {}).encode(),
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            content = response.read()
+            is_json = response.headers.get_content_type() == "application/json"
+        result = json.loads(content) if is_json else content
+        ok = not (isinstance(result, dict) and result.get("error"))
+    except (urllib.error.URLError, ConnectionError, TimeoutError, ValueError):
+        result, ok = None, False
+    recorder.add(endpoint, time.perf_counter() - start, ok)
+    return result if ok else None
+
+def run_student(base_url: str, recorder: Recorder, deadline: float, args, seed: int):
+    """Un utente: ripete il flusso completo finché non scade il tempo"""
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        ok = run_flow(base_url, recorder, args, rng)
+        recorder.flow(ok)
+
+def run_flow(base_url: str, recorder: Recorder, args, rng: random.Random) -> bool:
+    def think():
+        if args.think:
+            time.sleep(rng.uniform(0, 2 * args.think))
+
+    if call(base_url, "/api/reset", None, recorder, args.timeout) is None:
+        return False
+    if call(base_url, "/api/initialize", None, recorder, args.timeout) is None:
+        return False
+    answer = ""
+    for _ in range(args.max_turns):
+        reply = call(base_url, "/api/get_question", {"response": answer}, recorder, args.timeout)
+        if reply is None:
+            return False
+        if reply.get("generating_results") or reply.get("complete"):
+            break
+        think()
+        answer = rng.choice(ANSWERS)
+    else:
+        return False    # profilo non completato entro max_turns
+    results = call(base_url, "/api/generate_results", {"progressive": args.progressive}, recorder, args.timeout)
+    if results is None:
+        return False
+    speech = call(base_url, "/api/text_to_speech", {"text": results.get("question", "")}, recorder, args.timeout)
+    return speech is not None
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    ms = np.array(values) * 1000
+    return {f"p{q}_ms": float(np.percentile(ms, q)) for q in (50, 95, 99)}
+
+def run_level(base_url: str, concurrency: int, args, upstreams: Dict[str, StandInServer]) -> Dict[str, Any]:
+    """Un livello di concorrenza per args.duration secondi"""
+    recorder = Recorder()
+    before = {kind: server.stats() for kind, server in upstreams.items()}
+    start = time.monotonic()
+    threads = [
+        threading.Thread(target=run_student, args=(base_url, recorder, start + args.duration, args, args.seed + i))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    endpoints = {}
+    for endpoint, samples in recorder.samples.items():
+        errors = sum(not ok for _, ok in samples)
+        endpoints[endpoint] = {
+            "requests": len(samples), "errors": errors, "error_rate": errors / len(samples),
+            **percentiles([seconds for seconds, _ in samples]),
+        }
+    requests = sum(e["requests"] for e in endpoints.values())
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "flows": recorder.flows,
+        "failed_flows": recorder.failed_flows,
+        "flows_per_second": recorder.flows / elapsed,
+        "requests_per_second": requests / elapsed,
+        "endpoints": endpoints,
+        "upstreams": {
+            kind: {
+                "calls": server.stats()["calls"] - before[kind]["calls"],
+                "injected_errors": server.stats()["injected_errors"] - before[kind]["injected_errors"],
+            }
+            for kind, server in upstreams.items()
+        },
+    }
+
+def print_level(level: Dict[str, Any]):
+    print(f"\nConcorrenza {level['concurrency']}: {level['flows']} conversazioni "
+          f"({level['failed_flows']} fallite) in {level['seconds']:.1f} s — "
+          f"{level['flows_per_second']:.2f} conv/s, {level['requests_per_second']:.1f} req/s")
+    print(f"  {'endpoint':<24} {'req':>6} {'err %':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, e in level["endpoints"].items():
+        print(f"  {endpoint:<24} {e['requests']:>6} {e['error_rate']:>6.1%} "
+              f"{e['p50_ms']:>9.1f} {e['p95_ms']:>9.1f} {e['p99_ms']:>9.1f}")
+    upstreams = ", ".join(f"{kind} {u['calls']} ({u['injected_errors']} errori)" for kind, u in level["upstreams"].items())
+    print(f"  chiamate ai servizi simulati: {upstreams}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test di server.py con servizi esterni simulati")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 4, 16],
+                        help="studenti virtuali contemporanei (più livelli separati da virgole)")
+    parser.add_argument("--duration", type=float, default=30, help="secondi per livello")
+    parser.add_argument("--max-turns", type=int, default=12, help="domande massime per conversazione")
+    parser.add_argument("--think", type=float, default=0, help="pausa media (s) dello studente tra le risposte")
+    parser.add_argument("--progressive", action="store_true", help="generate_results senza attendere i pros/cons")
+    parser.add_argument("--timeout", type=float, default=120, help="timeout (s) di ogni richiesta")
+    for kind in DEFAULT_LATENCY:
+        parser.add_argument(f"--{kind}-latency", default=DEFAULT_LATENCY[kind],
+                            help="fixed:<s>, uniform:<min>,<max> o lognormal:<mediana>,<sigma>")
+        parser.add_argument(f"--{kind}-errors", type=float, default=0.0, help="frazione di risposte 500")
+    parser.add_argument("--port", type=int, default=5099, help="porta di server.py avviato dal test")
+    parser.add_argument("--asgi", action="store_true", help="avvia la modalità asincrona (uvicorn asgi:app)")
+    parser.add_argument("--server-url", help="usa un server già avviato (configurato con le variabili stampate)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="salva i risultati in JSON")
+    args = parser.parse_args()
+
+    upstreams = {
+        kind: StandInServer(
+            kind, LatencyModel(getattr(args, f"{kind}_latency")), getattr(args, f"{kind}_errors"), args.seed + i
+        ).start()
+        for i, kind in enumerate(DEFAULT_LATENCY)
+    }
+    for kind, server in upstreams.items():
+        print(f"Servizio simulato {kind}: {server.url} (latenza {server.latency}, errori {server.error_rate:.1%})")
+
+    with tempfile.TemporaryDirectory(prefix="pydeia-loadtest-") as workdir:
+        process = None
+        if args.server_url:
+            base_url = args.server_url.rstrip("/")
+            print("Server esterno: avviarlo con PYDEIA_OPENAI_BASE_URL="
+                  f"{upstreams['llm'].url}/v1 PYDEIA_OLLAMA_BASE_URL={upstreams['embeddings'].url}/v1 "
+                  f"PYDEIA_ELEVENLABS_BASE_URL={upstreams['tts'].url}")
+        else:
+            base_url = f"http://127.0.0.1:{args.port}"
+            process, log_path = start_server(args.port, upstreams, workdir, args.asgi)
+            print(f"server.py su {base_url} (log: {log_path})")
+        try:
+            wait_ready(base_url, process)
+            # Riscaldamento (embeddings del catalogo, connessioni): escluso dai risultati
+            run_flow(base_url, Recorder(), args, random.Random(args.seed))
+
+            levels = []
+            for concurrency in args.concurrency:
+                levels.append(run_level(base_url, concurrency, args, upstreams))
+                print_level(levels[-1])
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+
+    write_results({
+        "benchmark": "loadtest",
+        "commit": git_commit(),
+        "duration": args.duration,
+        "max_turns": args.max_turns,
+        "think": args.think,
+        "progressive": args.progressive,
+        "upstreams": {kind: server.stats() for kind, server in upstreams.items()},
+        "levels": levels,
+    }, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Optional, Iterator
+
+
+# Strumentazione del server: span di timing per fase (LLM, embeddings, similarità,
+# scoring, pros/cons, TTS) aggregati in istogrammi ed esportati in formato
+# Prometheus da /api/metrics. Il dettaglio verboso va sul logger "pydeia" (DEBUG).
+
+
+# ============= LOG =============
+# PYDEIA_LOG_LEVEL=DEBUG riattiva le stampe dettagliate (profili, ranking, top/flop)
+LOG_LEVEL = os.environ.get("PYDEIA_LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("pydeia")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.propagate = False
+logger.setLevel(LOG_LEVEL)
+
+
+# ============= ISTOGRAMMI =============
+# Limiti superiori dei bucket di latenza (secondi)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Istogramma cumulativo stile Prometheus (bucket, somma, conteggio)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """
+    Metriche del processo: durate per fase (istogrammi), quantità portate dagli span
+    (contatori: righe, testi, byte...) ed errori per fase.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations: Dict[str, Histogram] = {}
+        self.totals: Dict[Tuple[str, str], float] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, stage: str, seconds: float, attrs: Dict[str, float], failed: bool):
+        with self._lock:
+            self.durations.setdefault(stage, Histogram()).observe(seconds)
+            for name, value in attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.totals[(stage, name)] = self.totals.get((stage, name), 0) + value
+            if failed:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Copia coerente delle metriche (per l'export)"""
+        with self._lock:
+            return {
+                "durations": {
+                    stage: (h.buckets, list(h.counts), h.sum, h.count) for stage, h in self.durations.items()
+                },
+                "totals": dict(self.totals),
+                "errors": dict(self.errors),
+            }
+
+REGISTRY = Registry()
+
+# Span del thread corrente, raccolti solo mentre una richiesta è profilata
+_trace = threading.local()
+
+def start_trace():
+    """Inizia a raccogliere gli span del thread corrente"""
+    _trace.stages = []
+
+def stop_trace() -> List[Dict]:
+    """Smette di raccogliere e restituisce gli span (fase, ms, attributi) in ordine di chiusura"""
+    stages = getattr(_trace, "stages", None) or []
+    _trace.stages = None
+    return stages
+
+class Span(dict):
+    """Attributi di uno span (conteggi e dimensioni), aggiornabili durante la fase"""
+
+@contextmanager
+def span(stage: str, **attrs) -> Iterator[Span]:
+    """
+    Misura una fase: durata nell'istogramma della fase, attributi numerici nei
+    contatori, eccezioni contate come errori (e rilanciate).
+
+        with span("tts", chars=len(text)) as s:
+            audio = ...
+            s["bytes"] = len(audio)
+    """
+    current = Span(attrs)
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield current
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        REGISTRY.record(stage, elapsed, current, failed)
+        stages = getattr(_trace, "stages", None)
+        if stages is not None:
+            stages.append({"stage": stage, "ms": round(elapsed * 1000, 3), "failed": failed, **current})
+        if logger.isEnabledFor(logging.DEBUG):
+            details = " ".join(f"{k}={v}" for k, v in current.items())
+            logger.debug(f"[span] {stage} {elapsed * 1000:.1f} ms {details}".rstrip())
+
+
+# ============= EXPORT PROMETHEUS =============
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+def _number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def render_prometheus(
+    gauges: Optional[List[Tuple[str, str, Dict[str, str], float]]] = None,
+    registry: Registry = REGISTRY,
+    counters: Optional[List[Tuple[str, str, Dict[str, str], float]]] = None
+) -> str:
+    """
+    Testo in formato di esposizione Prometheus 0.0.4. gauges: valori istantanei
+    aggiuntivi (nome, descrizione, label, valore), es. memoria e code dei job;
+    counters: contatori tenuti altrove, nello stesso formato (es. eventi dei servizi esterni).
+    """
+    data = registry.snapshot()
+    lines = [
+        "# HELP pydeia_stage_duration_seconds Duration of each request stage",
+        "# TYPE pydeia_stage_duration_seconds histogram",
+    ]
+    for stage, (buckets, counts, total, count) in sorted(data["durations"].items()):
+        for bound, cumulative in zip(buckets, counts):
+            lines.append(f"pydeia_stage_duration_seconds_bucket{_labels(stage=stage, le=_number(bound))} {cumulative}")
+        lines.append(f"pydeia_stage_duration_seconds_bucket{_labels(stage=stage, le='+Inf')} {count}")
+        lines.append(f"pydeia_stage_duration_seconds_sum{_labels(stage=stage)} {_number(total)}")
+        lines.append(f"pydeia_stage_duration_seconds_count{_labels(stage=stage)} {count}")
+
+    lines += [
+        "# HELP pydeia_stage_items_total Items processed by each stage (rows, texts, bytes, ...)",
+        "# TYPE pydeia_stage_items_total counter",
+    ]
+    for (stage, item), value in sorted(data["totals"].items()):
+        lines.append(f"pydeia_stage_items_total{_labels(stage=stage, item=item)} {_number(value)}")
+
+    lines += [
+        "# HELP pydeia_stage_errors_total Stages that raised an exception",
+        "# TYPE pydeia_stage_errors_total counter",
+    ]
+    for stage, value in sorted(data["errors"].items()):
+        lines.append(f"pydeia_stage_errors_total{_labels(stage=stage)} {value}")
+
+    described = set()
+    for kind, samples in (("gauge", gauges), ("counter", counters)):
+        for name, help_text, labels, value in samples or []:
+            if name not in described:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                described.add(name)
+            lines.append(f"{name}{_labels(**labels) if labels else ''} {_number(value)}")
+    return "\n".join(lines) + "\n"
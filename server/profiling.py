@@ -0,0 +1,136 @@
+import os
+import io
+import re
+import json
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import threading
+from typing import List, Dict, Any, Optional
+
+from catalog import DATA_DIR
+from metrics import logger, start_trace, stop_trace
+
+
+# Profilazione su richiesta: per le richieste con l'header X-Profile (o per una
+# frazione campionata con PYDEIA_PROFILE_SAMPLE) il handler gira sotto cProfile.
+# Il profilo (.prof, leggibile con pstats/snakeviz) e i metadati con i tempi per fase
+# (.json) finiscono in una cartella che tiene solo i più recenti.
+# Senza header e con campionamento a 0 il costo è una lettura di header.
+
+
+PROFILE_DIR = os.environ.get("PYDEIA_PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+# Frazione delle richieste profilate comunque (0 = solo su richiesta)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PYDEIA_PROFILE_SAMPLE", "0"))
+# Profili conservati (i più vecchi vengono cancellati)
+MAX_PROFILES = int(os.environ.get("PYDEIA_PROFILE_MAX", "50"))
+PROFILE_HEADER = "X-Profile"
+# Funzioni nel riepilogo testuale (ordinate per tempo cumulativo)
+SUMMARY_FUNCTIONS = 40
+
+_PROFILE_ID = re.compile(r"^[0-9]{13}-[0-9a-f]{32}$")
+
+# cProfile non ammette due profiler attivi insieme (da Python 3.12 neanche su
+# thread diversi): una richiesta alla volta, le altre proseguono senza profilo
+_active = threading.Lock()
+
+
+class RequestProfile:
+    """Profilo in corso di una richiesta"""
+
+    def __init__(self, reason: str):
+        self.profile_id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex}"
+        self.reason = reason
+        self.profiler = cProfile.Profile()
+        self.start = time.perf_counter()
+        start_trace()
+        self.profiler.enable()
+
+    def stop(self) -> float:
+        self.profiler.disable()
+        return time.perf_counter() - self.start
+
+
+def profile_reason(header: Optional[str]) -> Optional[str]:
+    """Perché profilare la richiesta ("header" o "sample"), None se non va profilata"""
+    if header and header.lower() not in ("0", "false", "no"):
+        return "header"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+def start_profile(reason: str) -> Optional[RequestProfile]:
+    """Avvia il profiler, o None se un'altra richiesta è già profilata"""
+    if not _active.acquire(blocking=False):
+        return None
+    try:
+        return RequestProfile(reason)
+    except Exception:
+        _active.release()
+        raise
+
+def finish_profile(profile: RequestProfile, method: str, path: str, status: int) -> Dict[str, Any]:
+    """Ferma il profiler e salva profilo e metadati; restituisce i metadati"""
+    try:
+        elapsed = profile.stop()
+    finally:
+        stages = stop_trace()
+        _active.release()
+
+    meta = {
+        "id": profile.profile_id,
+        "method": method,
+        "path": path,
+        "status": status,
+        "reason": profile.reason,
+        "created": time.time(),
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "stages": stages,
+    }
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile.profile_id)
+    profile.profiler.dump_stats(base + ".prof")
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    prune_profiles()
+    logger.debug(f"Profilo {profile.profile_id}: {method} {path} in {meta['elapsed_ms']:.1f} ms")
+    return meta
+
+def prune_profiles(keep: int = MAX_PROFILES):
+    """Cancella i profili più vecchi oltre i keep più recenti"""
+    ids = sorted(name[:-5] for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for profile_id in ids[:max(len(ids) - keep, 0)]:
+        for ext in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + ext))
+            except FileNotFoundError:
+                pass
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Metadati dei profili salvati, dal più recente"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue   # cancellato o scritto a metà
+    return profiles
+
+def profile_path(profile_id: str) -> Optional[str]:
+    """Percorso del .prof, None se l'id non è valido o il profilo non esiste più"""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + ".prof")
+    return path if os.path.exists(path) else None
+
+def profile_summary(path: str, limit: int = SUMMARY_FUNCTIONS) -> str:
+    """Le funzioni più costose (tempo cumulativo) in formato testo pstats"""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -1,10 +1,28 @@
-from openai import OpenAI
 from datapizza.tools import tool
 import numpy as np
-from typing import List, Dict, Any, Optional
-import json
-import csv
+from typing import List, Dict, Any, Optional, Tuple
+import os
 import math
+import threading
+from catalog import (
+    Catalog, CatalogRow, load_catalog, load_embeddings, save_embeddings, validate_catalog,
+    diff_catalogs, reuse_embeddings, build_snapshot, snapshot_signature, embeddings_cache_path,
+    prune_embedding_caches, DEFAULT_CSV, DEFAULT_SNAPSHOT,
+    EMBEDDINGS_CACHE_DIR, EMBEDDING_FIELDS, EMBEDDING_DTYPE, intern_texts, row_norms,
+    matrix_dot, quantize_embeddings
+)
+from scoring import (
+    GEOGRAPHY_DMAX, FALLBACK_DISTANCE_KM, scoring_columns, semantic_scores,
+    score_columns, select_top_k, scoring_pool, ScoringPool, budget_scores, geography_scores,
+    english_scores, dorms_scores, test_scores, combine_scores
+)
+from gazetteer import load_gazetteer, normalize_place, ANY_LOCATION
+from spatial import haversine_km
+from metrics import logger, span
+from components import register_component
+from embeddings import create_backend
+import time
+import logging
 
 
 #IMPORT ONLY RECOMMEND_UNIVERSITIES and run
@@ -13,36 +31,168 @@ import math
 
 
 # ============= DATASET UNIVERSITÀ =============
-def load_universities_from_csv(filename=r"data\universities.csv"):
-    universities = []
+# Snapshot colonnare (python server/catalog.py build --embed) con fallback sul CSV.
+# Caricato al primo get_catalog() (o dal warm-up del server), non all'import.
+UNIVERSITY_DATASET: Optional[Catalog] = None
+
+def load_university_dataset() -> Catalog:
+    global UNIVERSITY_DATASET, _snapshot_signature
+    # Letta prima del caricamento: uno snapshot pubblicato nel frattempo verrà seguito
+    _snapshot_signature = snapshot_signature(DEFAULT_SNAPSHOT)
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # Convert types
-                row['id'] = int(row['id'])
-                row['annual_cost'] = int(row['annual_cost'])
-                row['coordinates'] = json.loads(row['coordinates'])
-                row['min_gpa'] = float(row['min_gpa'])
-                row['prestige_rank'] = int(row['prestige_rank'])
-                row['duration_years'] = int(row.get('duration_years', 3))
-                row['employment_rate'] = int(row.get('employment_rate', 0))
-                
-                # Convert booleans
-                row['english_courses'] = row['english_courses'].lower() == 'true'
-                row['dorms_available'] = row['dorms_available'].lower() == 'true'
-                row['admission_test_required'] = row['admission_test_required'].lower() == 'true'
-                
-                universities.append(row)
-        print(f"Caricate {len(universities)} università da {filename}")
-        return universities
+        catalog = load_catalog(DEFAULT_CSV, DEFAULT_SNAPSHOT, embedding_model=EMBEDDER.model_id)
     except FileNotFoundError:
-        print(f"File {filename} non trovato. Uso dataset mock.")
-        return []
+        catalog = None
+    if not catalog:
+        raise RuntimeError(f"Nessuna università caricata. Assicurarsi che '{DEFAULT_CSV}' esista.")
+    UNIVERSITY_DATASET = catalog
+    return catalog
+
+CATALOG = register_component("catalog", load_university_dataset)
+
+# ============= EMBEDDINGS =============
+# Backend scelto con PYDEIA_EMBEDDING_BACKEND (ollama | hashing, vedi embeddings.py):
+# tutti gli embeddings (studenti, catalogo, batch, reload) passano da embed_texts.
+EMBEDDER = create_backend()
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embeddings di più testi con il backend configurato (matrice N x d float32)"""
+    return EMBEDDER.embed(texts)
+
+async def a_embed_texts(texts: List[str]) -> np.ndarray:
+    """Come embed_texts, senza bloccare l'event loop (modalità ASGI)"""
+    return await EMBEDDER.a_embed(texts)
+
+# La prima richiesta crea il client e fa caricare il modello a Ollama: il warm-up la anticipa
+EMBEDDING_MODEL_WARM = register_component("embedding_model", lambda: embed_texts(["warm-up"]).shape[1])
+
+def get_universities_embeddings(catalog: Catalog) -> Dict[str, np.ndarray]:
+    """
+    Matrici degli embeddings del catalogo (una riga per testo distinto), sempre
+    memory-mapped in sola lettura: dallo snapshot se presenti, altrimenti dalla cache
+    su disco (calcolata una volta sola dal primo worker). Tutti i worker condividono
+    così un'unica copia nella page cache.
+    """
+    if catalog.embeddings is None:
+        key = embeddings_cache_key(catalog)
+        cache_dir = embeddings_cache_path(key, EMBEDDINGS_CACHE_DIR)
+        rows = {field: len(text_rows) for field, text_rows in catalog.text_rows.items()}
+        cached = load_embeddings(cache_dir, key, rows)
+        if cached is None:
+            print(f"Calcolo embeddings per {len(catalog)} università (testi distinti: {rows})...")
+            with span("catalog_embedding", texts=sum(rows.values())):
+                computed = {field: embed_texts(catalog.unique_texts(field)) for field in EMBEDDING_FIELDS}
+                embeddings, scales = quantize_embeddings(computed, EMBEDDING_DTYPE)
+                save_embeddings(embeddings, cache_dir, key, scales)
+                prune_embedding_caches(EMBEDDINGS_CACHE_DIR)
+            cached = load_embeddings(cache_dir, key, rows)
+        catalog.set_embeddings(*cached)
+    return catalog.embeddings
+
+def embeddings_cache_key(catalog: Catalog) -> str:
+    """Versione del catalogo (sha256 del CSV), modello e formato: una cache per ciascuna"""
+    return f"{catalog.content_hash}:{EMBEDDER.model_id}:{EMBEDDING_DTYPE}"
+
+CATALOG_EMBEDDINGS = register_component("catalog_embeddings", lambda: get_universities_embeddings(get_catalog()))
+
+# ============= RELOAD CATALOGO =============
+# Il reload avviene in un solo processo (endpoint admin o watcher), che pubblica il nuovo
+# catalogo come snapshot. Ogni worker controlla il manifest dello snapshot al più ogni
+# CATALOG_CHECK_SECONDS e, se è cambiato, lo carica da solo in background (follow_snapshot).
+CATALOG_CHECK_SECONDS = float(os.environ.get("PYDEIA_CATALOG_CHECK", "2"))
+_reload_lock = threading.Lock()
+_snapshot_signature = None      # manifest dello snapshot all'ultimo caricamento (snapshot_signature)
+_next_snapshot_check = 0.0
+
+def get_catalog() -> Catalog:
+    """Catalogo corrente (leggerlo una volta per richiesta: il reload lo sostituisce)"""
+    catalog = UNIVERSITY_DATASET or CATALOG.get()
+    check_snapshot()
+    return catalog
+
+def check_snapshot():
+    """Avvia follow_snapshot se un altro processo ha pubblicato uno snapshot nuovo"""
+    global _next_snapshot_check
+    now = time.monotonic()
+    if CATALOG_CHECK_SECONDS <= 0 or now < _next_snapshot_check:
+        return
+    _next_snapshot_check = now + CATALOG_CHECK_SECONDS
+    signature = snapshot_signature(DEFAULT_SNAPSHOT)
+    if signature is not None and signature != _snapshot_signature and not _reload_lock.locked():
+        threading.Thread(target=follow_snapshot, args=(signature,), name="catalog-follow", daemon=True).start()
+
+def follow_snapshot(signature: Tuple[int, int, int]):
+    """Carica lo snapshot pubblicato e lo sostituisce al catalogo di questo processo"""
+    global UNIVERSITY_DATASET, _snapshot_signature
+    if not _reload_lock.acquire(blocking=False):
+        return
+    try:
+        if signature == _snapshot_signature:
+            return
+        new = load_catalog(DEFAULT_CSV, DEFAULT_SNAPSHOT, embedding_model=EMBEDDER.model_id)
+        errors = validate_catalog(new)
+        if errors:
+            raise ValueError("Catalogo non valido: " + "; ".join(errors))
+        get_universities_embeddings(new)
+        UNIVERSITY_DATASET = new
+        logger.info(f"Catalogo aggiornato dallo snapshot {DEFAULT_SNAPSHOT}: {len(new)} università")
+    except Exception:
+        logger.warning("Snapshot del catalogo non caricato, resta il catalogo corrente", exc_info=True)
+    finally:
+        # Anche dopo un errore: si riprova al prossimo snapshot pubblicato
+        _snapshot_signature = signature
+        _reload_lock.release()
+
+def reload_catalog(filename: Optional[str] = None, snapshot_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Ricarica il catalogo senza riavviare il server.
+    Re-embedda solo i testi semantici nuovi o modificati (o li trova nella cache se un altro
+    worker li ha già calcolati), poi sostituisce il catalogo con un'unica assegnazione: le
+    richieste in corso continuano sul catalogo precedente. Il nuovo catalogo è pubblicato
+    come snapshot con gli embeddings, da cui lo caricano gli altri worker.
+    """
+    global UNIVERSITY_DATASET, _snapshot_signature
+    filename = filename or DEFAULT_CSV
+    snapshot_dir = snapshot_dir or DEFAULT_SNAPSHOT
+    with _reload_lock:
+        current = get_catalog()
+        new = load_catalog(filename, snapshot_dir, embedding_model=EMBEDDER.model_id)
+        errors = validate_catalog(new)
+        if errors:
+            raise ValueError("Catalogo non valido: " + "; ".join(errors))
+
+        report = {"rows": len(new), **diff_catalogs(current, new), "reembedded": 0, "published": False}
+        if new.embeddings is None and current.embeddings is not None:
+            key = embeddings_cache_key(new)
+            cache_dir = embeddings_cache_path(key, EMBEDDINGS_CACHE_DIR)
+            rows = {field: len(text_rows) for field, text_rows in new.text_rows.items()}
+            if load_embeddings(cache_dir, key, rows) is None:
+                embeddings, missing = reuse_embeddings(current, new)
+                for field, text_ids in missing.items():
+                    if text_ids:
+                        unique_texts = new.unique_texts(field)
+                        embeddings[field][text_ids] = embed_texts([unique_texts[i] for i in text_ids])
+                        report["reembedded"] += len(text_ids)
+                embeddings, scales = quantize_embeddings(embeddings, EMBEDDING_DTYPE)
+                save_embeddings(embeddings, cache_dir, key, scales)
+                prune_embedding_caches(EMBEDDINGS_CACHE_DIR)
+        get_universities_embeddings(new)
+        errors = validate_catalog(new)
+        if errors:
+            raise ValueError("Catalogo non valido: " + "; ".join(errors))
+
+        # Già caricato dallo snapshot corrente: non c'è nulla da pubblicare
+        if new.source != snapshot_dir:
+            try:
+                build_snapshot(new, snapshot_dir, csv_sha256=new.content_hash, embedding_model=EMBEDDER.model_id)
+                report["published"] = True
+            except OSError:
+                logger.warning(f"Snapshot {snapshot_dir} non scritto: gli altri worker restano sul catalogo precedente", exc_info=True)
+        _snapshot_signature = snapshot_signature(snapshot_dir)
+        UNIVERSITY_DATASET = new
+    print(f"Catalogo ricaricato: {report}")
+    return report
 
-UNIVERSITY_DATASET = load_universities_from_csv()
-if not UNIVERSITY_DATASET:
-    raise RuntimeError("Nessuna università caricata. Assicurarsi che 'data/universities.csv' esista.")
 # ============= TOOLS PER L'AGENTE =============
 
 @tool
@@ -50,31 +200,16 @@ def create_student_embedding(student_profile: Dict[str, Any]) -> Dict[str, Any]:
     """
     Crea 3 EMBEDDINGS SEPARATI del profilo studente (coordinate-wise).
     Ogni campo semantico ha il suo embedding per maggiore granularità.
-    Usa Ollama granite-embedding:30m per embeddings locali.
+    Usa il backend di embedding configurato (una sola richiesta per i 3 testi).
     """
     academic_text = student_profile.get('academic_profile', '') or ''
     aspiration_text = student_profile.get('aspiration_values', '') or ''
     lifestyle_text = student_profile.get('lifestyle_preferences', '') or ''
 
-    client = OpenAI(
-        base_url="http://localhost:11434/v1",
-        api_key="ollama",  # qualsiasi stringa
-    )
-    
-    academic_embedding = client.embeddings.create(
-        input=academic_text,
-        model="granite-embedding:30m"
-    ).data[0].embedding
-
-    aspiration_embedding = client.embeddings.create(
-        input=aspiration_text,
-        model="granite-embedding:30m"
-    ).data[0].embedding
-
-    lifestyle_embedding = client.embeddings.create(
-        input=lifestyle_text,
-        model="granite-embedding:30m"
-    ).data[0].embedding
+    with span("student_embedding", texts=3):
+        academic_embedding, aspiration_embedding, lifestyle_embedding = embed_texts(
+            [academic_text, aspiration_text, lifestyle_text]
+        ).tolist()
     
     return {
         "student_profile": student_profile,
@@ -94,54 +229,56 @@ def create_student_embedding(student_profile: Dict[str, Any]) -> Dict[str, Any]:
 def create_universities_embeddings(universities: List[Dict]) -> List[Dict]:
     """
     Crea 3 EMBEDDINGS SEPARATI per ogni università (coordinate-wise).
-    Usa Ollama granite-embedding:30m per embeddings locali.
+    Usa il backend di embedding configurato, lo stesso degli studenti.
+    I testi ripetuti tra università (stesso testo normalizzato) sono embeddati una volta sola
+    e le università che li condividono puntano allo stesso vettore.
     """
     enriched_universities = []
     
-    client = OpenAI(
-        base_url="http://localhost:11434/v1",
-        api_key="ollama",  # qualsiasi stringa
-    )
+    # Interning: testi distinti per campo
+    field_texts = {
+        field: [uni.get(column, '') or '' for uni in universities]
+        for field, column in EMBEDDING_FIELDS.items()
+    }
+    field_vectors = {}
+    for field, texts in field_texts.items():
+        text_ids, text_rows = intern_texts(texts)
+        unique_vectors = embed_texts([texts[i] for i in text_rows])
+        field_vectors[field] = [unique_vectors[text_id] for text_id in text_ids]
+        print(f"Embeddings '{field}': {len(text_rows)} testi distinti su {len(texts)} "
+              f"(dedup {1 - len(text_rows) / max(len(texts), 1):.0%})")
     
-    for uni in universities:
-        academic_text = uni.get('academic_profile', '') or ''
-        aspiration_text = uni.get('aspiration_values', '') or ''
-        lifestyle_text = uni.get('lifestyle_preferences', '') or ''
-        
-        academic_embedding = client.embeddings.create(
-            input=academic_text,
-            model="granite-embedding:30m"
-        ).data[0].embedding
-
-        aspiration_embedding = client.embeddings.create(
-            input=aspiration_text,
-            model="granite-embedding:30m"
-        ).data[0].embedding
-
-        lifestyle_embedding = client.embeddings.create(
-            input=lifestyle_text,
-            model="granite-embedding:30m"
-        ).data[0].embedding
-                
+    for i, uni in enumerate(universities):
         enriched_universities.append({
             **uni,
-            "embeddings": {
-                "academic": academic_embedding,
-                "aspiration": aspiration_embedding,
-                "lifestyle": lifestyle_embedding
-            },
-            "texts": {
-                "academic": academic_text,
-                "aspiration": aspiration_text,
-                "lifestyle": lifestyle_text
-            }
+            "embeddings": {field: field_vectors[field][i] for field in EMBEDDING_FIELDS},
+            "texts": {field: field_texts[field][i] for field in EMBEDDING_FIELDS}
         })
     
     return enriched_universities
 
 
+def cosine_similarities(student_vector, matrix: np.ndarray, matrix_norms: np.ndarray = None) -> np.ndarray:
+    """
+    Cosine similarity tra un vettore e tutte le righe di una matrice U x d.
+    La matrice (anche memory-mapped) non viene copiata; se quantizzata (float16/int8)
+    è letta a blocchi. Per int8 le scale per vettore si semplificano nel coseno.
+    Vettori nulli (es. testo vuoto con il backend hashing) hanno similarità 0.
+    """
+    student = np.asarray(student_vector, dtype=np.float32)
+    if matrix_norms is None:
+        matrix_norms = row_norms(matrix)
+    denominators = matrix_norms * np.linalg.norm(student)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarities = matrix_dot(matrix, student) / denominators
+    return np.where(denominators > 0, similarities, 0.0)
+
 @tool
-def calculate_cosine_similarity(student_embeddings: Dict[str, List[float]], university_embeddings: List[Dict]) -> List[Dict]:
+def calculate_cosine_similarity(
+    student_embeddings: Dict[str, List[float]],
+    university_embeddings: List[Dict],
+    rows: Optional[List[int]] = None
+) -> List[Dict]:
     """
     Calcola 3 COSINE SIMILARITIES separate (coordinate-wise):
     1. Academic similarity
@@ -149,59 +286,119 @@ def calculate_cosine_similarity(student_embeddings: Dict[str, List[float]], univ
     3. Lifestyle similarity
     
     Restituisce università rankate con i 3 score separati.
+    university_embeddings può essere anche un Catalog con le matrici degli embeddings:
+    in quel caso il calcolo avviene direttamente sulle matrici (memory-mapped), senza copie,
+    una volta per testo distinto; gli score sono poi distribuiti alle università con text_ids.
+    Con rows si valutano solo quelle università (es. i candidati dell'indice spaziale).
     """
-    student_academic = np.array(student_embeddings["academic"])
-    student_aspiration = np.array(student_embeddings["aspiration"])
-    student_lifestyle = np.array(student_embeddings["lifestyle"])
+    text_ids = None
+    if isinstance(university_embeddings, Catalog):
+        catalog = university_embeddings
+        matrices = catalog.embeddings
+        norms = catalog.embedding_norms()
+        text_ids = catalog.text_ids
+        universities = catalog
+        if rows is not None:
+            # Solo i testi distinti delle righe candidate, con id locali
+            rows = np.asarray(rows, dtype=np.int64)
+            subset = {field: np.unique(ids[rows], return_inverse=True) for field, ids in text_ids.items()}
+            matrices = {field: np.asarray(matrices[field][unique]) for field, (unique, _) in subset.items()}
+            norms = {field: norms[field][unique] for field, (unique, _) in subset.items()}
+            text_ids = {field: local.reshape(-1) for field, (_, local) in subset.items()}
+            universities = [catalog[int(i)] for i in rows]
+    else:
+        if rows is not None:
+            university_embeddings = [university_embeddings[int(i)] for i in rows]
+        # Lista di dict (create_universities_embeddings): impila gli embeddings in matrici
+        matrices = {
+            field: np.array([uni["embeddings"][field] for uni in university_embeddings])
+            for field in EMBEDDING_FIELDS
+        }
+        norms = {field: row_norms(matrix) for field, matrix in matrices.items()}
+        universities = university_embeddings
+    
+    # 3 COSINE SIMILARITIES SEPARATE (un prodotto matrice-vettore per campo)
+    academic_sim = cosine_similarities(student_embeddings["academic"], matrices["academic"], norms["academic"])
+    aspiration_sim = cosine_similarities(student_embeddings["aspiration"], matrices["aspiration"], norms["aspiration"])
+    lifestyle_sim = cosine_similarities(student_embeddings["lifestyle"], matrices["lifestyle"], norms["lifestyle"])
+    if text_ids is not None:
+        academic_sim = academic_sim[text_ids["academic"]]
+        aspiration_sim = aspiration_sim[text_ids["aspiration"]]
+        lifestyle_sim = lifestyle_sim[text_ids["lifestyle"]]
+    
+    # Score aggregato (media pesata - configurabile)
+    # Puoi cambiare i pesi: academic più importante?
+    semantic_score_aggregated = (
+        0.5 * academic_sim +      # Academic: peso maggiore
+        0.3 * aspiration_sim +    # Aspiration: medio
+        0.2 * lifestyle_sim       # Lifestyle: minore
+    )
     
     results = []
-    for uni in university_embeddings:
-        uni_emb = uni["embeddings"]
-        
-        # 3 COSINE SIMILARITIES SEPARATE
-        # 1. Academic
-        uni_academic = np.array(uni_emb["academic"])
-        academic_sim = np.dot(student_academic, uni_academic) / (
-            np.linalg.norm(student_academic) * np.linalg.norm(uni_academic)
-        )
-        
-        # 2. Aspiration
-        uni_aspiration = np.array(uni_emb["aspiration"])
-        aspiration_sim = np.dot(student_aspiration, uni_aspiration) / (
-            np.linalg.norm(student_aspiration) * np.linalg.norm(uni_aspiration)
-        )
-        
-        # 3. Lifestyle
-        uni_lifestyle = np.array(uni_emb["lifestyle"])
-        lifestyle_sim = np.dot(student_lifestyle, uni_lifestyle) / (
-            np.linalg.norm(student_lifestyle) * np.linalg.norm(uni_lifestyle)
-        )
-        
-        # Score aggregato (media pesata - configurabile)
-        # Puoi cambiare i pesi: academic più importante?
-        semantic_score_aggregated = (
-            0.5 * academic_sim +      # Academic: peso maggiore
-            0.3 * aspiration_sim +    # Aspiration: medio
-            0.2 * lifestyle_sim       # Lifestyle: minore
-        )
-        
+    # Ordina per score aggregato
+    for i in np.argsort(-semantic_score_aggregated, kind="stable"):
+        uni = universities[int(i)]
         results.append({
             "university": uni["nome"],
             "corso": uni["corso"],
             "semantic_scores": {
-                "academic": float(academic_sim),
-                "aspiration": float(aspiration_sim),
-                "lifestyle": float(lifestyle_sim),
-                "aggregated": float(semantic_score_aggregated)
+                "academic": float(academic_sim[i]),
+                "aspiration": float(aspiration_sim[i]),
+                "lifestyle": float(lifestyle_sim[i]),
+                "aggregated": float(semantic_score_aggregated[i])
             },
-            "semantic_score": float(semantic_score_aggregated),  # Per compatibilità
+            "semantic_score": float(semantic_score_aggregated[i]),  # Per compatibilità
             "details": uni
         })
-    
-    # Ordina per score aggregato
-    results.sort(key=lambda x: x["semantic_score"], reverse=True)
     return results
 
+class ScoredUniversity:
+    """
+    Risultato dello scoring che referenzia la riga del catalogo invece di copiarla.
+    Si legge come il vecchio dict (uni["final_score"], uni["details"]["city"], uni.get("nome"));
+    diventa JSON solo con format_recommendations, al confine dell'API.
+    """
+    __slots__ = ("row", "final_score", "score_breakdown", "distance_km")
+
+    def __init__(self, row: CatalogRow, final_score: float, score_breakdown: Dict[str, float], distance_km: float):
+        self.row = row
+        self.final_score = final_score
+        self.score_breakdown = score_breakdown
+        self.distance_km = distance_km
+
+    def __getitem__(self, key: str) -> Any:
+        if key in ("final_score", "score_breakdown", "distance_km"):
+            return getattr(self, key)
+        if key == "details":
+            return self.row
+        if key == "university":
+            return self.row["nome"]
+        return self.row[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self) -> str:
+        return f"ScoredUniversity(row={self.row.index}, final_score={self.final_score:.3f})"
+
+# PESI OTTIMIZZATI (default se il profilo non ha pesi stimati)
+DEFAULT_WEIGHTS = {
+    # SEMANTIC (50%)
+    "academic_similarity": 0.25,
+    "aspiration_similarity": 0.15,
+    "lifestyle_similarity": 0.10,
+    
+    # QUANTITATIVE (30%)
+    "budget_score": 0.15,
+    "geography_fit": 0.15,
+    
+    # BOOLEANS (20%)
+    "bool": 0.20
+}
+
 @tool
 def multimodal_scoring(
     filtered_universities: List[Dict], 
@@ -215,21 +412,9 @@ def multimodal_scoring(
     
     # PESI OTTIMIZZATI
     if weights is None:
-        weights = {
-            # SEMANTIC (50%)
-            "academic_similarity": 0.25,
-            "aspiration_similarity": 0.15,
-            "lifestyle_similarity": 0.10,
-            
-            # QUANTITATIVE (30%)
-            "budget_score": 0.15,
-            "geography_fit": 0.15,
-            
-            # BOOLEANS (20%)
-            "bool": 0.20
-        }
+        weights = DEFAULT_WEIGHTS
     
-    print(weights)
+    logger.debug(weights)
 
     scored = []
     
@@ -304,20 +489,25 @@ def multimodal_scoring(
             coords
         )
         
+        score_breakdown = {
+            "academic": academic_score,
+            "aspiration": aspiration_score,
+            "lifestyle": lifestyle_score,
+            "budget": budget_score,
+            "geography": geography_score,
+            "english": english_score,
+            "dorms": dorms_score,
+            "test": test_score
+        }
+        if isinstance(details, CatalogRow):
+            # Riga del catalogo: il risultato la referenzia, senza copiarne i campi
+            scored.append(ScoredUniversity(details, final_score, score_breakdown, distance_km))
+            continue
         scored.append({
             **uni,
             **details, # Flatten details so all CSV columns are top-level
             "final_score": final_score,
-            "score_breakdown": {
-                "academic": academic_score,
-                "aspiration": aspiration_score,
-                "lifestyle": lifestyle_score,
-                "budget": budget_score,
-                "geography": geography_score,
-                "english": english_score,
-                "dorms": dorms_score,
-                "test": test_score
-            },
+            "score_breakdown": score_breakdown,
             "distance_km": distance_km
         })
     
@@ -327,71 +517,46 @@ def multimodal_scoring(
 
 # ============= HELPER FUNCTIONS =============
 
+# Comuni italiani (data/gazetteer_it.csv) per le coordinate di origine e località dello studente
+GAZETTEER = load_gazetteer()
+
+def city_coords(name: str) -> Optional[Dict[str, float]]:
+    """Coordinate del comune (ricerca esatta o fuzzy), None se sconosciuto"""
+    return GAZETTEER.coords(name)
+
+def same_city(origin: str, city: str) -> bool:
+    """Origine e città indicano lo stesso comune (senza badare ad accenti, maiuscole, refusi)"""
+    if not origin or not city:
+        return False
+    if normalize_place(origin) == normalize_place(city):
+        return True
+    place = GAZETTEER.resolve(origin)
+    return place is not None and place == GAZETTEER.resolve(city)
+
+def location_matches(target_location: str, city: str) -> bool:
+    """La località richiesta (un comune o una regione) comprende la città dell'università"""
+    if not target_location or normalize_place(target_location) in ANY_LOCATION:
+        return False
+    region = GAZETTEER.region(target_location)
+    if region is not None:
+        place = GAZETTEER.resolve(city)
+        return place is not None and GAZETTEER.region_names[place] == region
+    place = GAZETTEER.resolve(target_location)
+    if place is not None:
+        return place == GAZETTEER.resolve(city)
+    # Area che non è né un comune né una regione: confronto sul testo normalizzato
+    return normalize_place(target_location) in normalize_place(city)
+
+
 def calculate_distance(origin: str, city: str, coords: Dict[str, float]) -> float:
     """Calcola distanza in km tra origine studente e università"""
     # Se città coincidono, distanza 0
-    if origin and city and origin.lower() == city.lower():
+    if same_city(origin, city):
         return 0.0
         
-    # Se abbiamo coordinate università e mock coordinate studente
+    # Se abbiamo coordinate università e dello studente (gazetteer)
     if coords:
-        # Mock coordinates per città principali (in prod usare geocoding)
-        city_coords_map = {
-            "Milano": {"lat": 45.4773, "lon": 9.2282},
-            "Bologna": {"lat": 44.4938, "lon": 11.3387},
-            "Roma": {"lat": 41.8547, "lon": 12.6043},
-            "Trento": {"lat": 46.0664, "lon": 11.1257},
-            "Torino": {"lat": 45.0703, "lon": 7.6869},
-            "Firenze": {"lat": 43.7696, "lon": 11.2558},
-            "Pisa": {"lat": 43.716, "lon": 10.3966},
-            "Siena": {"lat": 43.3188, "lon": 11.3308},
-            "Padova": {"lat": 45.4064, "lon": 11.8768},
-            "Venezia": {"lat": 45.4408, "lon": 12.3155},
-            "Verona": {"lat": 45.4384, "lon": 10.9916},
-            "Genova": {"lat": 44.4056, "lon": 8.9463},
-            "Pavia": {"lat": 45.1847, "lon": 9.1582},
-            "Bari": {"lat": 41.1171, "lon": 16.8719},
-            "Lecce": {"lat": 40.352, "lon": 18.169},
-            "Napoli": {"lat": 40.8518, "lon": 14.2681},
-            "Salerno": {"lat": 40.6824, "lon": 14.7681},
-            "Catania": {"lat": 37.5079, "lon": 15.083},
-            "Palermo": {"lat": 38.1157, "lon": 13.3615},
-            "Cagliari": {"lat": 39.2238, "lon": 9.1217},
-            "Trieste": {"lat": 45.6495, "lon": 13.7768},
-            "Perugia": {"lat": 43.1107, "lon": 12.3908},
-            "L'Aquila": {"lat": 42.351, "lon": 13.3984},
-            "Teramo": {"lat": 42.6612, "lon": 13.699},
-            "Potenza": {"lat": 40.6395, "lon": 15.8051},
-            "Rende": {"lat": 39.3579, "lon": 16.227},
-            "Catanzaro": {"lat": 38.905, "lon": 16.589},
-            "Reggio Calabria": {"lat": 38.1113, "lon": 15.6473},
-            "Bergamo": {"lat": 45.6983, "lon": 9.6773},
-            "Brescia": {"lat": 45.5416, "lon": 10.2118},
-            "Bolzano": {"lat": 46.4983, "lon": 11.3548},
-            "Udine": {"lat": 46.0626, "lon": 13.2349},
-            "Ferrara": {"lat": 44.8381, "lon": 11.6198},
-            "Modena": {"lat": 44.646, "lon": 10.9252},
-            "Parma": {"lat": 44.8015, "lon": 10.3279},
-            "Ancona": {"lat": 43.6158, "lon": 13.5189},
-            "Urbino": {"lat": 43.7262, "lon": 12.6366},
-            "Macerata": {"lat": 43.2991, "lon": 13.453},
-            "Camerino": {"lat": 43.1372, "lon": 13.068},
-            "Cassino": {"lat": 41.4925, "lon": 13.8281},
-            "Viterbo": {"lat": 42.4207, "lon": 12.1077},
-            "Campobasso": {"lat": 41.56, "lon": 14.659},
-            "Benevento": {"lat": 41.129, "lon": 14.782},
-            "Foggia": {"lat": 41.4622, "lon": 15.5446},
-            "Messina": {"lat": 38.1938, "lon": 15.554},
-            "Sassari": {"lat": 40.7275, "lon": 8.559},
-            "Enna": {"lat": 37.5667, "lon": 14.2833},
-            "Aversa": {"lat": 40.9722, "lon": 14.2077},
-            "Novedrate": {"lat": 45.72, "lon": 9.116},
-            "Rozzano": {"lat": 45.382, "lon": 9.16},
-            "Castellanza": {"lat": 45.613, "lon": 8.897},
-            "Bra (Pollenzo)": {"lat": 44.694, "lon": 7.935}
-        }
-        
-        student_coords = city_coords_map.get(origin)
+        student_coords = city_coords(origin)
         
         if student_coords:
             # Formula Haversine
@@ -409,7 +574,7 @@ def calculate_distance(origin: str, city: str, coords: Dict[str, float]) -> floa
             return R * c
             
     # Fallback se non calcolabile
-    return 200.0
+    return FALLBACK_DISTANCE_KM
 
 def calculate_geography_fit(
     origin: str, 
@@ -421,15 +586,14 @@ def calculate_geography_fit(
 ) -> float:
     """Calcola score geografico (0-1)"""
 
-    dmax = 1045.75
-
-    dist = calculate_distance(origin, uni_city, uni_coords) / dmax
+    dist_km = calculate_distance(origin, uni_city, uni_coords)
+    dist = dist_km / GEOGRAPHY_DMAX
     
-    if target_location:
-        if target_location.lower() in uni_city.lower():
-            return 1.2
+    if location_matches(target_location, uni_city):
+        return 1.2
     
-    if max_dist and dist > max_dist:
+    # max_dist è in km, come la distanza (non normalizzata)
+    if max_dist and dist_km > max_dist:
         return 0.0
     
     if far_from_home:
@@ -438,6 +602,51 @@ def calculate_geography_fit(
     # Più vicino è meglio, ma decrescita lenta
     return max(0, 1 - (dist**(1/4)))
 
+def distance_candidates(catalog: Catalog, student_profile: Dict[str, Any], min_candidates: int) -> Optional[np.ndarray]:
+    """
+    Università ammesse dal vincolo max_distance (km): entro il raggio dall'origine secondo
+    l'indice spaziale, più quelle nella città di origine o nella località richiesta.
+    Se nel raggio ce ne sono meno di min_candidates il raggio si allarga fino alla
+    min_candidates-esima più vicina (SpatialIndex.nearest), così il top-k resta pieno.
+    None (nessun filtro, si valuta tutto il catalogo) se il profilo non ha vincolo o se
+    l'origine non ha coordinate.
+    """
+    max_dist = student_profile.get("max_distance")
+    origin = student_profile.get("origin", "") or ""
+    target_location = student_profile.get("location", "") or ""
+    student_coords = city_coords(origin)
+    if max_dist and origin and not student_coords:
+        # senza coordinate il vincolo non si può applicare: tutto il catalogo, distanza di fallback
+        logger.warning(f"Origine '{origin}' non trovata nel gazetteer: vincolo max_distance ignorato")
+    if not max_dist or not student_coords:
+        return None
+
+    index = catalog.spatial_index()
+    radius = max_dist
+    _, nearest_km = index.nearest(student_coords["lat"], student_coords["lon"], min_candidates)
+    if len(nearest_km):
+        radius = max(radius, float(nearest_km[-1]))
+    rows, _ = index.within(student_coords["lat"], student_coords["lon"], radius)
+    cities, city_codes = catalog.column_codes("city")
+    matching = [
+        code for code, city in enumerate(cities)
+        if same_city(origin, city) or location_matches(target_location, city)
+    ]
+    if matching:
+        rows = np.union1d(rows, np.flatnonzero(np.isin(city_codes, matching)))
+    return rows
+
+def candidate_radius(catalog: Catalog, rows: np.ndarray, lat: float, lon: float, matched: np.ndarray) -> float:
+    """
+    Raggio effettivo (km) di distance_candidates: la distanza della candidata più lontana,
+    escluse quelle ammesse per città (matched, per codice città) che possono stare ovunque.
+    """
+    _, city_codes = catalog.column_codes("city")
+    far = rows[~matched[city_codes[rows]]]
+    if not len(far):
+        return 0.0
+    return float(haversine_km(lat, lon, catalog.columns["lat"][far], catalog.columns["lon"][far]).max())
+
 def calculate_budget_score(student_budget: int, uni_cost: int) -> float:
     """Calcola score budget (0-1)"""
     if not student_budget:
@@ -449,7 +658,66 @@ def calculate_budget_score(student_budget: int, uni_cost: int) -> float:
     else: 
         return -math.exp((uni_cost - student_budget) / student_budget)
 
-def recommend_universities(student_profile : Dict[str, Any]) -> List[Dict[str, Any]]:
+def format_recommendations(recommendations: List[ScoredUniversity]) -> List[Dict[str, Any]]:
+    """
+    Formato di risposta dell'API: per ogni università un dict con i dati puliti
+    seguito da un dict con il breakdown degli score (più final score e distanza).
+    """
+    result_list = []
+    for uni in recommendations:
+        # 1. Clean University details
+        clean_uni = {
+            "id": uni.get("id"),
+            "nome": uni.get("nome"),
+            "corso": uni.get("corso"),
+            "city": uni.get("city"),
+            "annual_cost": uni.get("annual_cost"),
+            "academic_profile": uni.get("academic_profile"),
+            "aspiration_values": uni.get("aspiration_values"),
+            "lifestyle_preferences": uni.get("lifestyle_preferences"),
+            "min_gpa": uni.get("min_gpa"),
+            "prestige_rank": uni.get("prestige_rank"),
+            "duration_years": uni.get("duration_years"),
+            "employment_rate": uni.get("employment_rate"),
+            "english_courses": uni.get("english_courses"),
+            "dorms_available": uni.get("dorms_available"),
+            "admission_test_required": uni.get("admission_test_required"),
+            "coordinates": uni.get("coordinates")
+        }
+        result_list.append(clean_uni)
+        
+        # 2. Scores breakdown (plus final score and distance)
+        scores = uni['score_breakdown'].copy()
+        scores['final_score'] = uni['final_score']
+        scores['distance_km'] = uni['distance_km']
+        
+        result_list.append(scores)
+        
+    return result_list
+
+def log_ranking(title: str, recommendations: List[ScoredUniversity], costs: bool):
+    """Tabella di un ranking sul log (livello DEBUG)"""
+    logger.debug("\n" + "="*60)
+    logger.debug(title)
+    logger.debug("="*60)
+    for i, uni in enumerate(recommendations, 1):
+        logger.debug(f"\n{i}. {uni['university']} - {uni['corso']}")
+        logger.debug(f"   📍 Città: {uni['details']['city']}")
+        if costs:
+            logger.debug(f"   💰 Costo: €{uni['details']['annual_cost']}/anno")
+            logger.debug(f"   📏 Distanza: {uni['distance_km']:.0f} km")
+        logger.debug(f"   ⭐ Score finale: {uni['final_score']:.3f}")
+        breakdown = uni['score_breakdown']
+        logger.debug(f"   📊 Academic: {breakdown['academic']:.3f} | "
+                     f"Aspiration: {breakdown['aspiration']:.3f} | "
+                     f"Lifestyle: {breakdown['lifestyle']:.3f}")
+        logger.debug(f"   💰 Budget: {breakdown['budget']:.3f} | "
+                     f"🌍 Geo: {breakdown['geography']:.3f}")
+        logger.debug(f"   ✅ English: {breakdown['english']:.1f} | "
+                     f"Dorms: {breakdown['dorms']:.1f} | "
+                     f"Test: {breakdown['test']:.1f} | ")
+
+def recommend_universities(student_profile : Dict[str, Any]) -> List[ScoredUniversity]:
     """
     Pipeline completa con branching agentic.
     """
@@ -478,97 +746,407 @@ def recommend_universities(student_profile : Dict[str, Any]) -> List[Dict[str, A
     #     "extracurricular_activities": True
     # }
     
-    # STEP 1: Crea embedding studente
-    print("\n🔧 STEP 1: Creazione embedding studente...")
-    student_data = create_student_embedding(student_profile)
+    # Stesso catalogo per tutta la richiesta, anche se nel frattempo viene ricaricato
+    catalog = get_catalog()
+
+    # STEP 1: Embeddings università (memory-mapped, calcolati una volta sola);
+    # servono prima del pool, che li copia in shared memory
+    logger.debug("\n🔧 STEP 1: Creazione embeddings università...")
+    get_universities_embeddings(catalog)
+
+    # Catalogo grande con scoring parallelo attivo: top-3 calcolato a shard nei worker
+    with scoring_pool(catalog, create=catalog is get_catalog()) as pool:
+        if pool is not None:
+            return recommend_universities_batch([student_profile], top_k=3, catalog=catalog)[0]
     
-    # STEP 2: Crea embeddings università
-    print("\n🔧 STEP 2: Creazione embeddings università...")
-    universities_data = create_universities_embeddings(UNIVERSITY_DATASET)
+    # STEP 2: Crea embedding studente
+    logger.debug("\n🔧 STEP 2: Creazione embedding studente...")
+    student_data = create_student_embedding(student_profile)
     
-    # STEP 3: Calcola similarità semantica
-    print("\n🔧 STEP 3: Calcolo similarità semantica...")
-    semantic_ranking = calculate_cosine_similarity(
-        student_data["embeddings"],
-        universities_data
-    )
+    # STEP 3: Calcola similarità semantica direttamente sulle matrici del catalogo
+    # (solo sulle università entro max_distance, se il profilo lo chiede)
+    logger.debug("\n🔧 STEP 3: Calcolo similarità semantica...")
+    with span("similarity") as s:
+        candidates = distance_candidates(catalog, student_profile, 3)
+        if candidates is not None:
+            logger.debug(f"   {len(candidates)}/{len(catalog)} università entro {student_profile['max_distance']:.0f} km")
+        semantic_ranking = calculate_cosine_similarity(
+            student_data["embeddings"],
+            catalog,
+            candidates
+        )
+        s["rows"] = len(semantic_ranking)
     
     # STEP 4: Scoring multimodale finale (include penalizzazioni)
-    final_recommendations = multimodal_scoring(
-        filtered_universities=semantic_ranking,
-        student_profile=student_profile,
-        weights=student_profile.get("weights", None)
-    )
-    
-    print("\n" + "="*60)
-    print("🏆 TOP 3 RACCOMANDAZIONI")
-    print("="*60)
-    for i, uni in enumerate(final_recommendations[:3], 1):
-        print(f"\n{i}. {uni['university']} - {uni['corso']}")
-        print(f"   📍 Città: {uni['details']['city']}")
-        print(f"   💰 Costo: €{uni['details']['annual_cost']}/anno")
-        print(f"   📏 Distanza: {uni['distance_km']:.0f} km")
-        print(f"   ⭐ Score finale: {uni['final_score']:.3f}")
-        breakdown = uni['score_breakdown']
-        print(f"   📊 Academic: {breakdown['academic']:.3f} | "
-              f"Aspiration: {breakdown['aspiration']:.3f} | "
-              f"Lifestyle: {breakdown['lifestyle']:.3f}")
-        print(f"   💰 Budget: {breakdown['budget']:.3f} | "
-              f"🌍 Geo: {breakdown['geography']:.3f}")
-        print(f"   ✅ English: {breakdown['english']:.1f} | "
-              f"Dorms: {breakdown['dorms']:.1f} | "
-              f"Test: {breakdown['test']:.1f} | "
-)
+    with span("scoring", rows=len(semantic_ranking)):
+        final_recommendations = multimodal_scoring(
+            filtered_universities=semantic_ranking,
+            student_profile=student_profile,
+            weights=student_profile.get("weights", None)
+        )
     
-    print("\n" + "="*60)
-    print("⚠️  FLOP 3 (Meno Consigliate)")
-    print("="*60)
-    for i, uni in enumerate(final_recommendations[-3:][::-1], 1):
-        print(f"\n{i}. {uni['university']} - {uni['corso']}")
-        print(f"   📍 Città: {uni['details']['city']}")
-        print(f"   ⭐ Score finale: {uni['final_score']:.3f}")
-        breakdown = uni['score_breakdown']
-        print(f"   📊 Academic: {breakdown['academic']:.3f} | "
-              f"Aspiration: {breakdown['aspiration']:.3f} | "
-              f"Lifestyle: {breakdown['lifestyle']:.3f}")
-        print(f"   💰 Budget: {breakdown['budget']:.3f} | "
-              f"🌍 Geo: {breakdown['geography']:.3f}")
-        print(f"   ✅ English: {breakdown['english']:.1f} | "
-              f"Dorms: {breakdown['dorms']:.1f} | "
-              f"Test: {breakdown['test']:.1f} | "
-)
+    if logger.isEnabledFor(logging.DEBUG):
+        log_ranking("🏆 TOP 3 RACCOMANDAZIONI", final_recommendations[:3], costs=True)
+        log_ranking("⚠️  FLOP 3 (Meno Consigliate)", final_recommendations[-3:][::-1], costs=False)
     
-    result_list = []
-    for uni in final_recommendations[:3]:
-        # 1. Clean University details
-        clean_uni = {
-            "id": uni.get("id"),
-            "nome": uni.get("nome"),
-            "corso": uni.get("corso"),
-            "city": uni.get("city"),
-            "annual_cost": uni.get("annual_cost"),
-            "academic_profile": uni.get("academic_profile"),
-            "aspiration_values": uni.get("aspiration_values"),
-            "lifestyle_preferences": uni.get("lifestyle_preferences"),
-            "min_gpa": uni.get("min_gpa"),
-            "prestige_rank": uni.get("prestige_rank"),
-            "duration_years": uni.get("duration_years"),
-            "employment_rate": uni.get("employment_rate"),
-            "english_courses": uni.get("english_courses"),
-            "dorms_available": uni.get("dorms_available"),
-            "admission_test_required": uni.get("admission_test_required"),
-            "coordinates": uni.get("coordinates")
+    return final_recommendations[:3]
+
+
+# ============= BATCH (più studenti insieme) =============
+# Studenti elaborati insieme nello scoring vettoriale (matrici N x BATCH_CHUNK_STUDENTS)
+BATCH_CHUNK_STUDENTS = 32
+
+def embed_student_profiles(profiles: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Embeddings di tutti i profili: una richiesta batch per campo, ogni testo distinto una volta (B x d)"""
+    embeddings = {}
+    with span("student_embedding") as s:
+        for field, column in EMBEDDING_FIELDS.items():
+            texts = [profile.get(column, '') or '' for profile in profiles]
+            text_ids, text_rows = intern_texts(texts)
+            embeddings[field] = embed_texts([texts[i] for i in text_rows])[text_ids]
+            s["texts"] = s.get("texts", 0) + len(text_rows)
+    return embeddings
+
+def batch_profile_params(
+    catalog: Catalog,
+    student_profiles: List[Dict[str, Any]],
+    candidates: List[Optional[np.ndarray]]
+) -> Dict[str, Any]:
+    """
+    Campi dei profili come array (uno per studente) per scoring.score_columns, con la
+    stessa semantica di multimodal_scoring. Le condizioni sulle città sono risolte qui
+    sulle città distinte del catalogo (B x città), non riga per riga.
+    candidates viene da distance_candidates: dove non è None il vincolo di distanza esclude
+    (oltre il raggio effettivo, max_distance o più se distance_candidates l'ha allargato).
+    """
+    cities, _ = catalog.column_codes("city")
+    origin_lat, origin_lon, same_city_mask, in_location, radius = [], [], [], [], []
+    for p, rows in zip(student_profiles, candidates):
+        origin = p.get("origin", "") or ""
+        target_location = p.get("location", "") or ""
+        student_coords = city_coords(origin)
+        origin_lat.append(student_coords["lat"] if student_coords else np.nan)
+        origin_lon.append(student_coords["lon"] if student_coords else np.nan)
+        same_city_mask.append([same_city(origin, city) for city in cities])
+        in_location.append([location_matches(target_location, city) for city in cities])
+        # Raggio del vincolo, allargato da distance_candidates se nel raggio c'erano poche università
+        radius.append(0.0 if rows is None else max(
+            p.get("max_distance") or 0,
+            candidate_radius(catalog, rows, origin_lat[-1], origin_lon[-1],
+                             np.array(same_city_mask[-1], dtype=bool) | np.array(in_location[-1], dtype=bool))
+        ))
+
+    weights = [p.get("weights") or DEFAULT_WEIGHTS for p in student_profiles]
+    return {
+        "budget": np.array([p.get("budget", 0) or 0 for p in student_profiles], dtype=np.float64),
+        "origin_lat": np.array(origin_lat, dtype=np.float64),
+        "origin_lon": np.array(origin_lon, dtype=np.float64),
+        "same_city": np.array(same_city_mask, dtype=bool).reshape(len(student_profiles), len(cities)),
+        "in_location": np.array(in_location, dtype=bool).reshape(len(student_profiles), len(cities)),
+        "max_distance": np.array([p.get("max_distance") or 0 for p in student_profiles], dtype=np.float64),
+        "restrict": np.array([rows is not None for rows in candidates]),
+        "radius": np.array(radius, dtype=np.float64),
+        "far_from_home": np.array([bool(p.get("far_from_home", True)) for p in student_profiles]),
+        "english_language": np.array([bool(p.get("english_language", False)) for p in student_profiles]),
+        "dorms_nearby": np.array([bool(p.get("dorms_nearby", False)) for p in student_profiles]),
+        "admission_test": np.array([bool(p.get("admission_test", True)) for p in student_profiles]),
+        "weights": {key: np.array([w[key] for w in weights], dtype=np.float64) for key in DEFAULT_WEIGHTS},
+    }
+
+def score_batch(
+    catalog: Catalog,
+    student_embeddings: Dict[str, np.ndarray],
+    params: Dict[str, Any],
+    top_k: int,
+    candidates: List[Optional[np.ndarray]],
+    pool: Optional[ScoringPool] = None
+) -> Dict[str, Any]:
+    """
+    Top-k per studente (k x B). Con PYDEIA_SCORING_WORKERS e un catalogo grande lo
+    scoring gira a shard nel pool di processi, altrimenti nel processo corrente.
+    Se tutti gli studenti hanno un vincolo di distanza si valutano solo i loro candidati.
+    """
+    if all(rows is not None for rows in candidates):
+        rows = candidates[0] if len(candidates) == 1 else np.unique(np.concatenate(candidates))
+        columns = {name: column[rows] for name, column in scoring_columns(catalog).items()}
+        # Solo i testi distinti delle righe candidate, con id locali
+        subset = {field: np.unique(ids[rows], return_inverse=True) for field, ids in catalog.text_ids.items()}
+        norms = catalog.embedding_norms()
+        semantic = semantic_scores(
+            {field: np.asarray(catalog.embeddings[field][unique]) for field, (unique, _) in subset.items()},
+            {field: norms[field][unique] for field, (unique, _) in subset.items()},
+            {field: local.reshape(-1) for field, (_, local) in subset.items()},
+            student_embeddings
+        )
+        top = select_top_k(*score_columns(columns, semantic, params), top_k)
+        top["rows"] = rows[top["rows"]]
+        return top
+
+    if pool is not None:
+        return pool.top_k(student_embeddings, params, top_k)
+    semantic = semantic_scores(catalog.embeddings, catalog.embedding_norms(), catalog.text_ids, student_embeddings)
+    return select_top_k(*score_columns(scoring_columns(catalog), semantic, params), top_k)
+
+def recommend_universities_batch(
+    student_profiles: List[Dict[str, Any]],
+    top_k: int = 3,
+    catalog: Optional[Catalog] = None
+) -> List[List[ScoredUniversity]]:
+    """
+    Raccomandazioni per molti studenti insieme (es. una classe intera).
+    Per ogni studente restituisce la stessa lista di recommend_universities (top_k università).
+    """
+    catalog = catalog or get_catalog()
+    start = time.perf_counter()
+
+    # STEP 1: embeddings di tutti gli studenti in blocco
+    student_embeddings = embed_student_profiles(student_profiles)
+    # STEP 2: embeddings università (memory-mapped, calcolati una volta sola)
+    get_universities_embeddings(catalog)
+    top_k = min(top_k, len(catalog))
+    with scoring_pool(catalog, create=catalog is get_catalog()) as pool:
+        results = score_profiles(catalog, student_profiles, student_embeddings, top_k, pool)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Batch: {len(student_profiles)} profili in {elapsed:.2f}s "
+                f"({len(student_profiles) / elapsed if elapsed else 0:.1f} profili/s)")
+    return results
+
+def score_profiles(
+    catalog: Catalog,
+    student_profiles: List[Dict[str, Any]],
+    student_embeddings: Dict[str, np.ndarray],
+    top_k: int,
+    pool: Optional[ScoringPool]
+) -> List[List[ScoredUniversity]]:
+    """Top-k di ogni studente, a blocchi di BATCH_CHUNK_STUDENTS"""
+    results = []
+    for chunk_start in range(0, len(student_profiles), BATCH_CHUNK_STUDENTS):
+        chunk = slice(chunk_start, chunk_start + BATCH_CHUNK_STUDENTS)
+        profiles = student_profiles[chunk]
+
+        # STEP 3: candidati dal vincolo di distanza (indice spaziale)
+        # STEP 4-5: similarità (matrice-matrice), scoring multimodale vettoriale e top-k
+        with span("scoring", students=len(profiles)):
+            candidates = [distance_candidates(catalog, p, top_k) for p in profiles]
+            top = score_batch(
+                catalog,
+                {field: embeddings[chunk] for field, embeddings in student_embeddings.items()},
+                batch_profile_params(catalog, profiles, candidates),
+                top_k,
+                candidates,
+                pool
+            )
+        results.extend(scored_universities(catalog, top, j) for j in range(len(profiles)))
+    return results
+
+def scored_universities(catalog: Catalog, top: Dict[str, Any], j: int) -> List[ScoredUniversity]:
+    """Top-k dello studente j (colonna j delle matrici k x B di score_batch)"""
+    return [
+        ScoredUniversity(
+            catalog[i],
+            float(top["final_score"][r, j]),
+            {key: float(values[r, j]) for key, values in top["breakdown"].items()},
+            float(top["distance_km"][r, j])
+        )
+        for r, i in enumerate(top["rows"][:, j])
+    ]
+
+
+# ============= SESSIONE DI SCORING (ricalcolo incrementale) =============
+# Campi del profilo (Info) da cui dipende ogni colonna di score
+COMPONENT_FIELDS = {
+    "academic": ("academic_profile",),
+    "aspiration": ("aspiration_values",),
+    "lifestyle": ("lifestyle_preferences",),
+    "budget": ("budget",),
+    "geography": ("origin", "location", "max_distance", "far_from_home"),
+    "english": ("english_language",),
+    "dorms": ("dorms_nearby",),
+    "test": ("admission_test",),
+}
+
+# Colonne non semantiche: funzione vettoriale di scoring.py che le calcola (N x 1)
+COMPONENT_SCORERS = {
+    "budget": budget_scores,
+    "english": english_scores,
+    "dorms": dorms_scores,
+    "test": test_scores,
+}
+
+class ScoringSession:
+    """
+    Colonne di score per componente (una riga per università) dell'ultimo profilo di
+    una conversazione. Quando lo studente cambia una risposta si ricalcolano solo le
+    colonne che dipendono dai campi cambiati (una sola chiamata di embedding per i
+    campi semantici modificati); le altre restano in cache e si ricombinano con i pesi.
+    Con un vincolo di distanza (solo le università candidate dell'indice spaziale) o
+    con il pool di processi (catalogo grande) lo scoring passa invece da score_batch,
+    come recommend_universities; gli embeddings dello studente restano in cache.
+    """
+
+    def __init__(self, top_k: int = 3):
+        self.top_k = top_k
+        self.reset()
+
+    def reset(self):
+        self.catalog = None
+        self.profile: Dict[str, Any] = {}
+        self.columns: Dict[str, np.ndarray] = {}
+        self.distance_km = None
+        self.excluded = None
+        self.vectors: Dict[str, np.ndarray] = {}   # componente semantico -> embedding dello studente
+        self.vector_texts: Dict[str, str] = {}     # testo da cui è stato calcolato
+
+    def stale_components(self, student_profile: Dict[str, Any]) -> List[str]:
+        """Componenti con almeno un campo cambiato (tutti al primo profilo o con un nuovo catalogo)"""
+        if self.catalog is not get_catalog() or not self.profile:
+            return list(COMPONENT_FIELDS)
+        return [
+            component for component, fields in COMPONENT_FIELDS.items()
+            if any(student_profile.get(field) != self.profile.get(field) for field in fields)
+        ]
+
+    def semantic_texts(self, student_profile: Dict[str, Any]) -> Dict[str, str]:
+        """Testi da embeddare per aggiornare il profilo (componente semantico -> testo)"""
+        texts = {component: student_profile.get(column, '') or '' for component, column in EMBEDDING_FIELDS.items()}
+        return {
+            component: text for component, text in texts.items()
+            if component not in self.vectors or self.vector_texts.get(component) != text
         }
-        result_list.append(clean_uni)
-        
-        # 2. Scores breakdown (plus final score and distance)
-        scores = uni['score_breakdown'].copy()
-        scores['final_score'] = uni['final_score']
-        scores['distance_km'] = uni['distance_km']
-        
-        result_list.append(scores)
-        
-    return result_list
 
+    def refresh_vectors(self, student_profile: Dict[str, Any], vectors: Optional[Dict[str, np.ndarray]] = None):
+        """Embeddings dei testi semantici cambiati, in un'unica richiesta (o già calcolati in vectors)"""
+        texts = self.semantic_texts(student_profile)
+        vectors = {component: vectors[component] for component in texts if component in (vectors or {})}
+        missing = [component for component in texts if component not in vectors]
+        if missing:
+            with span("student_embedding", texts=len(missing)):
+                vectors.update(zip(missing, embed_texts([texts[c] for c in missing])))
+        for component, vector in vectors.items():
+            self.vectors[component] = np.asarray(vector, dtype=np.float32)
+            self.vector_texts[component] = texts[component]
+
+    def update(self, student_profile: Dict[str, Any], vectors: Optional[Dict[str, np.ndarray]] = None) -> List[str]:
+        """
+        Aggiorna le colonne per il profilo e restituisce i componenti ricalcolati.
+        vectors: embeddings già calcolati dei semantic_texts (es. in modo asincrono).
+        """
+        catalog = get_catalog()
+        stale = self.stale_components(student_profile)
+        if catalog is not self.catalog:
+            # Catalogo ricaricato: le colonne vecchie non valgono più
+            self.reset()
+            self.catalog = catalog
+        get_universities_embeddings(catalog)
+        # Anche le colonne scartate da recommend_rows
+        stale = [component for component in COMPONENT_FIELDS if component in stale or component not in self.columns]
+
+        # Componenti semantici: un embedding per ogni testo cambiato, in un'unica richiesta
+        self.refresh_vectors(student_profile, vectors)
+        semantic = [component for component in stale if component in EMBEDDING_FIELDS]
+        if semantic:
+            with span("similarity", rows=len(catalog) * len(semantic)):
+                norms = catalog.embedding_norms()
+                for component in semantic:
+                    vector = self.vectors[component]
+                    similarities = cosine_similarities(vector, catalog.embeddings[component], norms[component])
+                    self.columns[component] = similarities[catalog.text_ids[component]]
+
+        # Componenti quantitativi e booleani: kernel vettoriali con un solo studente
+        others = [component for component in stale if component not in EMBEDDING_FIELDS]
+        if others:
+            with span("scoring", rows=len(catalog) * len(others)):
+                columns = scoring_columns(catalog)
+                # Senza vincolo di distanza (altrimenti lo scoring passa da recommend_rows)
+                params = batch_profile_params(catalog, [student_profile], [None])
+                for component in others:
+                    if component == "geography":
+                        geography, distance_km, excluded = geography_scores(columns, params)
+                        self.columns["geography"] = geography[:, 0]
+                        self.distance_km = distance_km[:, 0]
+                        self.excluded = excluded[:, 0]
+                    else:
+                        self.columns[component] = COMPONENT_SCORERS[component](columns, params)[:, 0]
+
+        self.profile = {field: student_profile.get(field) for fields in COMPONENT_FIELDS.values() for field in fields}
+        return stale
+
+    def recommend(
+        self, student_profile: Dict[str, Any], vectors: Optional[Dict[str, np.ndarray]] = None
+    ) -> Tuple[List[ScoredUniversity], List[str]]:
+        """
+        Stesso risultato di recommend_universities, ricalcolando solo le colonne
+        interessate dai campi cambiati. Restituisce raccomandazioni e componenti ricalcolati.
+        """
+        start = time.perf_counter()
+        catalog = get_catalog()
+        get_universities_embeddings(catalog)
+        candidates = distance_candidates(catalog, student_profile, self.top_k)
+        with scoring_pool(catalog, create=catalog is get_catalog()) as pool:
+            if pool is not None or candidates is not None:
+                return self.recommend_rows(catalog, student_profile, vectors, candidates, pool, start)
+
+        recomputed = self.update(student_profile, vectors)
+        catalog = self.catalog
+
+        weights = student_profile.get("weights") or DEFAULT_WEIGHTS
+        breakdown = {component: column[:, None] for component, column in self.columns.items()}
+        final_score = combine_scores(
+            breakdown,
+            {key: np.array([weights[key]], dtype=np.float64) for key in DEFAULT_WEIGHTS},
+            self.excluded[:, None]
+        )[:, 0]
+
+        top = np.argpartition(-final_score, min(self.top_k, len(catalog)) - 1)[:self.top_k]
+        top = top[np.argsort(-final_score[top], kind="stable")]
+        recommendations = [
+            ScoredUniversity(
+                catalog[i],
+                float(final_score[i]),
+                {component: float(self.columns[component][i]) for component in COMPONENT_FIELDS},
+                float(self.distance_km[i])
+            )
+            for i in top
+        ]
+
+        logger.info(f"Scoring incrementale: ricalcolati {recomputed or 'nessun componente'} "
+                    f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return recommendations, recomputed
+
+    def recommend_rows(
+        self,
+        catalog: Catalog,
+        student_profile: Dict[str, Any],
+        vectors: Optional[Dict[str, np.ndarray]],
+        candidates: Optional[np.ndarray],
+        pool: Optional[ScoringPool],
+        start: float
+    ) -> Tuple[List[ScoredUniversity], List[str]]:
+        """
+        Scoring di tutti i componenti con score_batch: solo sulle università candidate
+        (vincolo di distanza) o a shard nel pool di processi. Si riusano gli embeddings
+        dello studente; le colonne in cache non corrispondono più al profilo e si scartano.
+        """
+        recomputed = self.stale_components(student_profile)
+        if catalog is not self.catalog:
+            self.reset()
+            self.catalog = catalog
+        self.refresh_vectors(student_profile, vectors)
+        top_k = min(self.top_k, len(catalog))
+        with span("scoring", rows=len(candidates) if candidates is not None else len(catalog)):
+            top = score_batch(
+                catalog,
+                {component: self.vectors[component][None, :] for component in EMBEDDING_FIELDS},
+                batch_profile_params(catalog, [student_profile], [candidates]),
+                top_k,
+                [candidates],
+                pool
+            )
+        self.columns, self.distance_km, self.excluded = {}, None, None
+        self.profile = {field: student_profile.get(field) for fields in COMPONENT_FIELDS.values() for field in fields}
 
+        logger.info(f"Scoring su {'candidati' if candidates is not None else 'pool'}: componenti cambiati "
+                    f"{recomputed or 'nessuno'} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return scored_universities(catalog, top, 0), recomputed
 
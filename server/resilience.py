@@ -0,0 +1,352 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import logger
+
+
+# Resilienza delle chiamate ai servizi esterni (OpenAI, Ollama, ElevenLabs):
+# - timeout per tentativo (impostato anche sui client degli SDK) e scadenza complessiva;
+# - retry con backoff esponenziale e jitter, solo sugli errori transitori (rete, 429, 5xx);
+# - hedging: per le chiamate idempotenti (embeddings, TTS) più lente del p95 recente
+#   parte una richiesta duplicata e vince la prima risposta;
+# - un circuit breaker per servizio: dopo troppi errori consecutivi le chiamate
+#   falliscono subito finché una chiamata di prova non va a buon fine.
+# Stato e contatori in /api/upstreams e /api/metrics.
+
+
+class Policy(NamedTuple):
+    timeout: float      # secondi per tentativo
+    deadline: float     # secondi in tutto, retry compresi
+    retries: int        # tentativi aggiuntivi sugli errori transitori
+    hedge: bool         # richieste duplicate per le chiamate idempotenti lente
+
+# Sovrascrivibili con PYDEIA_<SERVIZIO>_TIMEOUT / _DEADLINE / _RETRIES / _HEDGE (es. PYDEIA_OLLAMA_TIMEOUT=5)
+DEFAULT_POLICIES = {
+    "openai": Policy(timeout=30.0, deadline=60.0, retries=1, hedge=False),
+    "ollama": Policy(timeout=10.0, deadline=20.0, retries=2, hedge=True),
+    "elevenlabs": Policy(timeout=20.0, deadline=40.0, retries=1, hedge=True),
+}
+
+# Circuit breaker: errori transitori consecutivi per aprire il circuito, secondi prima della prova
+BREAKER_FAILURES = int(os.environ.get("PYDEIA_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("PYDEIA_BREAKER_RESET", "30"))
+
+# Backoff dei retry: attesa casuale tra 0 e min(BACKOFF_MAX, BACKOFF_BASE * 2^tentativo)
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 2.0
+
+# Hedging dopo il p95 delle ultime LATENCY_WINDOW chiamate riuscite (almeno HEDGE_MIN_SAMPLES)
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+COUNTERS = ("calls", "attempts", "retries", "failures", "timeouts", "hedges", "hedge_wins", "short_circuits")
+
+# Errori di rete e timeout degli SDK, riconosciuti per nome (senza importare openai/httpx)
+TRANSIENT_ERRORS = {"APIConnectionError", "TransportError", "TimeoutException"}
+TIMEOUT_ERRORS = {"APITimeoutError", "TimeoutException"}
+
+# Thread delle chiamate con hedging (sincrone): la richiesta perdente finisce qui senza bloccare nessuno
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+class CircuitOpenError(Exception):
+    """Servizio considerato giù: la chiamata fallisce subito senza contattarlo"""
+
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__(f"Servizio {upstream} non disponibile (circuito aperto), nuovo tentativo tra {retry_in:.0f} s")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+def is_transient(error: BaseException) -> bool:
+    """Errori per cui ha senso riprovare (e che contano per il circuit breaker)"""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+def is_timeout(error: BaseException) -> bool:
+    return isinstance(error, TimeoutError) or any(cls.__name__ in TIMEOUT_ERRORS for cls in type(error).__mro__)
+
+def error_status(error: BaseException) -> int:
+    """Codice HTTP per un errore di un endpoint: 503 se il servizio è escluso dal circuit breaker"""
+    return 503 if isinstance(error, CircuitOpenError) else 500
+
+
+class CircuitBreaker:
+    """closed -> (BREAKER_FAILURES errori di fila) -> open -> (reset_seconds) -> half_open: una chiamata di prova"""
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0            # volte in cui il circuito si è aperto
+        self.probing = False
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    return False
+                self.state, self.probing = "half_open", False
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.state, self.failures, self.probing = "closed", 0, False
+
+    def release(self):
+        """Tentativo finito senza esito (es. richiesta annullata): la prova passa alla chiamata successiva"""
+        with self.lock:
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.opened += 1
+                    logger.warning(f"{self.name}: circuito aperto dopo {self.failures} errori, prova tra {self.reset_seconds:.0f} s")
+                self.state, self.opened_at = "open", time.monotonic()
+
+    def retry_in(self) -> float:
+        return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0.0)
+
+
+class Upstream:
+    """Un servizio esterno: politica, circuit breaker, latenze recenti e contatori"""
+
+    def __init__(self, name: str, policy: Policy):
+        self.name = name
+        self.policy = policy
+        self.breaker = CircuitBreaker(name)
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def count(self, counter: str):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def latency_quantile(self, q: float = HEDGE_QUANTILE) -> Optional[float]:
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def hedge_delay(self, idempotent: bool) -> Optional[float]:
+        """Secondi dopo cui duplicare la richiesta, None se non si fa hedging"""
+        if not (idempotent and self.policy.hedge):
+            return None
+        return self.latency_quantile()
+
+    # ----- ciclo di un tentativo (comune a call e a_call) -----
+    def _start_attempt(self, deadline_at: float) -> float:
+        """Controlla il circuito e restituisce il timeout del tentativo"""
+        if not self.breaker.allow():
+            self.count("short_circuits")
+            raise CircuitOpenError(self.name, self.breaker.retry_in())
+        self.count("attempts")
+        return max(min(self.policy.timeout, deadline_at - time.monotonic()), 0.0)
+
+    def _succeeded(self, start: float):
+        self.breaker.success()
+        with self.lock:
+            self.latencies.append(time.monotonic() - start)
+
+    def _failed(self, error: BaseException, attempt: int, deadline_at: float) -> Optional[float]:
+        """Registra un tentativo fallito; restituisce l'attesa prima del retry, None se non si riprova"""
+        transient = is_transient(error)
+        if transient:
+            self.breaker.failure()
+        else:
+            self.breaker.success()      # il servizio ha risposto: l'errore è della richiesta
+        if is_timeout(error):
+            self.count("timeouts")
+        backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        if not transient or attempt >= self.policy.retries or time.monotonic() + backoff >= deadline_at:
+            self.count("failures")
+            return None
+        self.count("retries")
+        logger.warning(f"{self.name}: {error!r}, nuovo tentativo tra {backoff:.2f} s")
+        return backoff
+
+    # ----- chiamate sincrone -----
+    def call(self, fn: Callable[[], Any], idempotent: bool = False) -> Any:
+        """
+        Esegue fn() con retry, circuit breaker e (se idempotente) hedging. Il timeout di
+        ogni tentativo è quello dei client degli SDK, le richieste duplicate lo rispettano qui.
+        """
+        self.count("calls")
+        deadline_at = time.monotonic() + self.policy.deadline
+        attempt = 0
+        while True:
+            timeout = self._start_attempt(deadline_at)
+            start = time.monotonic()
+            try:
+                delay = self.hedge_delay(idempotent)
+                result = fn() if delay is None else self._hedged(fn, timeout, delay)
+            except Exception as e:
+                backoff = self._failed(e, attempt, deadline_at)
+                if backoff is None:
+                    raise
+                attempt += 1
+                time.sleep(backoff)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._succeeded(start)
+            return result
+
+    def _hedged(self, fn: Callable[[], Any], timeout: float, delay: float) -> Any:
+        """Prima risposta tra la richiesta e un duplicato lanciato dopo delay secondi"""
+        start = time.monotonic()
+        futures = [_hedge_pool.submit(fn)]
+        if not wait(futures, timeout=min(delay, timeout))[0]:
+            self.count("hedges")
+            futures.append(_hedge_pool.submit(fn))
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, timeout=max(timeout - (time.monotonic() - start), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self.count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"{self.name}: nessuna risposta in {timeout:.1f} s")
+
+    # ----- chiamate asincrone (modalità ASGI) -----
+    async def a_call(self, fn: Callable[[], Awaitable[Any]], idempotent: bool = False) -> Any:
+        """Come call per le coroutine: qui il timeout di ogni tentativo annulla la richiesta"""
+        self.count("calls")
+        deadline_at = time.monotonic() + self.policy.deadline
+        attempt = 0
+        while True:
+            timeout = self._start_attempt(deadline_at)
+            start = time.monotonic()
+            try:
+                delay = self.hedge_delay(idempotent)
+                if delay is None:
+                    result = await asyncio.wait_for(fn(), timeout)
+                else:
+                    result = await self._a_hedged(fn, timeout, delay)
+            except Exception as e:
+                backoff = self._failed(e, attempt, deadline_at)
+                if backoff is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(backoff)
+                continue
+            except BaseException:
+                # CancelledError quando il client si disconnette: non dice nulla sul servizio
+                self.breaker.release()
+                raise
+            self._succeeded(start)
+            return result
+
+    async def _a_hedged(self, fn: Callable[[], Awaitable[Any]], timeout: float, delay: float) -> Any:
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(fn())]
+        try:
+            if not (await asyncio.wait(tasks, timeout=min(delay, timeout)))[0]:
+                self.count("hedges")
+                tasks.append(asyncio.ensure_future(fn()))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(timeout - (time.monotonic() - start), 0), return_when=FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()       # la richiesta perdente non serve più
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"{self.name}: nessuna risposta in {timeout:.1f} s")
+
+    def status(self) -> Dict[str, Any]:
+        p95 = self.latency_quantile()
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            "policy": self.policy._asdict(),
+            "circuit": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "opened": self.breaker.opened,
+                "retry_in_seconds": round(self.breaker.retry_in(), 3) if self.breaker.state == "open" else None,
+            },
+            "latency_p95_seconds": round(p95, 4) if p95 is not None else None,
+            "counters": counters,
+        }
+
+
+def load_policy(name: str, default: Policy) -> Policy:
+    prefix = f"PYDEIA_{name.upper()}_"
+    return Policy(
+        timeout=float(os.environ.get(prefix + "TIMEOUT", default.timeout)),
+        deadline=float(os.environ.get(prefix + "DEADLINE", default.deadline)),
+        retries=int(os.environ.get(prefix + "RETRIES", default.retries)),
+        hedge=os.environ.get(prefix + "HEDGE", "1" if default.hedge else "0") != "0",
+    )
+
+UPSTREAMS: Dict[str, Upstream] = {
+    name: Upstream(name, load_policy(name, default)) for name, default in DEFAULT_POLICIES.items()
+}
+
+def upstream(name: str) -> Upstream:
+    return UPSTREAMS[name]
+
+def upstream_status() -> Dict[str, Dict[str, Any]]:
+    return {name: u.status() for name, u in UPSTREAMS.items()}
+
+def upstream_metrics() -> Tuple[List[Tuple[str, str, Dict[str, str], float]], List[Tuple[str, str, Dict[str, str], float]]]:
+    """Gauge e contatori per render_prometheus"""
+    gauges, counters = [], []
+    for name, u in UPSTREAMS.items():
+        for state in ("closed", "open", "half_open"):
+            gauges.append(('pydeia_upstream_circuit_state', 'Circuit breaker state of each upstream (1 = current)',
+                           {'upstream': name, 'state': state}, int(u.breaker.state == state)))
+        p95 = u.latency_quantile()
+        if p95 is not None:
+            gauges.append(('pydeia_upstream_latency_p95_seconds', 'p95 of recent successful upstream calls',
+                           {'upstream': name}, p95))
+        with u.lock:
+            events = dict(u.counters)
+        for event, value in events.items():
+            counters.append(('pydeia_upstream_events_total', 'Upstream calls, attempts, retries, failures, timeouts, hedges and short circuits',
+                             {'upstream': name, 'event': event}, value))
+    return gauges, counters
@@ -0,0 +1,376 @@
+import os
+import atexit
+import threading
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import List, Dict, Any, Optional, Tuple
+
+from catalog import Catalog, EMBEDDING_FIELDS, matrix_dot
+from spatial import haversine_km
+
+
+# Kernel vettoriali dello scoring multimodale (università x studenti) e pool di
+# processi per il calcolo a shard. Dipende solo da numpy e catalog, così i worker
+# lo importano senza caricare Flask, datapizza o il dataset.
+
+
+# ============= PARAMETRI =============
+# Distanza di normalizzazione dello score geografico (km)
+GEOGRAPHY_DMAX = 1045.75
+# Distanza usata quando non è calcolabile (origine sconosciuta)
+FALLBACK_DISTANCE_KM = 200.0
+
+# Processi per lo scoring parallelo (0 = tutto nel processo corrente)
+SCORING_WORKERS = int(os.environ.get("PYDEIA_SCORING_WORKERS", "0"))
+# Sotto questa dimensione del catalogo il costo di IPC supera il guadagno
+PARALLEL_MIN_ROWS = int(os.environ.get("PYDEIA_PARALLEL_MIN_ROWS", "20000"))
+
+SCORE_KEYS = ("academic", "aspiration", "lifestyle", "budget", "geography", "english", "dorms", "test")
+
+
+# ============= KERNEL =============
+def scoring_columns(catalog: Catalog) -> Dict[str, np.ndarray]:
+    """Colonne del catalogo usate dallo scoring (array numpy, una riga per università)"""
+    c = catalog.columns
+    _, city_codes = catalog.column_codes("city")
+    return {
+        "annual_cost": np.asarray(c["annual_cost"], dtype=np.float64),
+        "english_courses": np.asarray(c["english_courses"], dtype=bool),
+        "dorms_available": np.asarray(c["dorms_available"], dtype=bool),
+        "admission_test_required": np.asarray(c["admission_test_required"], dtype=bool),
+        "lat": np.asarray(c["lat"], dtype=np.float64),
+        "lon": np.asarray(c["lon"], dtype=np.float64),
+        "city_codes": city_codes,
+    }
+
+def semantic_scores(
+    matrices: Dict[str, np.ndarray],
+    norms: Dict[str, np.ndarray],
+    text_ids: Dict[str, np.ndarray],
+    students: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    """
+    Cosine similarity righe x studenti: un prodotto matrice-matrice per campo (N x B).
+    Vettori nulli (es. testo vuoto con il backend hashing) hanno similarità 0.
+    """
+    scores = {}
+    for field, student_matrix in students.items():
+        student_matrix = np.asarray(student_matrix, dtype=np.float32)
+        dots = matrix_dot(matrices[field], student_matrix.T)
+        denominators = norms[field][:, None] * np.linalg.norm(student_matrix, axis=1)[None, :]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sims = np.where(denominators > 0, dots / denominators, 0.0)
+        scores[field] = sims[text_ids[field]]
+    return scores
+
+def budget_scores(columns: Dict[str, np.ndarray], params: Dict[str, Any]) -> np.ndarray:
+    """Score budget (N x B), come calculate_budget_score"""
+    cost = columns["annual_cost"][:, None]
+    budget = params["budget"][None, :]
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        under = np.log(np.abs(budget - cost) + 1) / np.log(budget + 1)
+        over = -np.exp((cost - budget) / budget)
+    return np.where(budget == 0, 1.0, np.where(cost <= budget, under, over))
+
+def geography_scores(
+    columns: Dict[str, np.ndarray],
+    params: Dict[str, Any]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Score geografico, distanze in km ed esclusioni per vincolo max_distance (tutti N x B),
+    come calculate_geography_fit e calculate_distance.
+    """
+    n, b = len(columns["annual_cost"]), len(params["budget"])
+    city_codes = columns["city_codes"]
+    distance_km = np.empty((n, b))
+    geography_score = np.empty((n, b))
+    excluded = np.zeros((n, b), dtype=bool)
+    for j in range(b):
+        if np.isnan(params["origin_lat"][j]):
+            dist = np.full(n, FALLBACK_DISTANCE_KM)
+        else:
+            dist = haversine_km(params["origin_lat"][j], params["origin_lon"][j], columns["lat"], columns["lon"])
+        dist = np.where(params["same_city"][j][city_codes], 0.0, dist)
+        distance_km[:, j] = dist
+        in_location = params["in_location"][j][city_codes]
+        max_dist = params["max_distance"][j]
+
+        norm_dist = dist / GEOGRAPHY_DMAX
+        if params["far_from_home"][j]:
+            geo = norm_dist
+        else:
+            geo = np.maximum(0, 1 - norm_dist**(1/4))
+        if max_dist:
+            geo = np.where(dist > max_dist, 0.0, geo)
+        geo = np.where(in_location, 1.2, geo)
+        geography_score[:, j] = geo
+
+        # Vincolo max_distance (deciso dal chiamante con l'indice spaziale): fuori dal raggio
+        # effettivo e fuori dalla località richiesta l'università è esclusa
+        if params["restrict"][j]:
+            excluded[:, j] = (dist > params["radius"][j]) & ~in_location
+    return geography_score, distance_km, excluded
+
+def english_scores(columns: Dict[str, np.ndarray], params: Dict[str, Any]) -> np.ndarray:
+    return (~params["english_language"][None, :] | columns["english_courses"][:, None]).astype(np.float64)
+
+def dorms_scores(columns: Dict[str, np.ndarray], params: Dict[str, Any]) -> np.ndarray:
+    return (~params["dorms_nearby"][None, :] | columns["dorms_available"][:, None]).astype(np.float64)
+
+def test_scores(columns: Dict[str, np.ndarray], params: Dict[str, Any]) -> np.ndarray:
+    # Se lo studente NON vuole test e l'università lo richiede -> 0
+    return (params["admission_test"][None, :] | ~columns["admission_test_required"][:, None]).astype(np.float64)
+
+def combine_scores(
+    breakdown: Dict[str, np.ndarray],
+    weights: Dict[str, np.ndarray],
+    excluded: np.ndarray
+) -> np.ndarray:
+    """Equazione lineare di multimodal_scoring sulle colonne di score (N x B, pesi per studente)"""
+    w = {key: values[None, :] for key, values in weights.items()}
+    final_score = (
+        w["academic_similarity"] * breakdown["academic"] +
+        w["aspiration_similarity"] * breakdown["aspiration"] +
+        w["lifestyle_similarity"] * breakdown["lifestyle"] +
+        w["budget_score"] * breakdown["budget"] +
+        w["geography_fit"] * breakdown["geography"] +
+        w["bool"]/3 * breakdown["english"] +
+        w["bool"]/3 * breakdown["dorms"] +
+        w["bool"]/3 * breakdown["test"]
+    )
+    return np.where(excluded, -np.inf, final_score)
+
+def score_columns(
+    columns: Dict[str, np.ndarray],
+    semantic: Dict[str, np.ndarray],
+    params: Dict[str, Any]
+) -> Tuple[np.ndarray, Dict[str, np.ndarray], np.ndarray]:
+    """
+    Equazione lineare di multimodal_scoring su università x studenti.
+    params arriva da recommendation_system.batch_profile_params.
+    Restituisce final score, breakdown e distanze in km (tutti N x B).
+    """
+    n, b = len(columns["annual_cost"]), len(params["budget"])
+    geography_score, distance_km, excluded = geography_scores(columns, params)
+    breakdown = {
+        "academic": semantic["academic"],
+        "aspiration": semantic["aspiration"],
+        "lifestyle": semantic["lifestyle"],
+        "budget": budget_scores(columns, params),
+        "geography": geography_score,
+        "english": np.broadcast_to(english_scores(columns, params), (n, b)),
+        "dorms": np.broadcast_to(dorms_scores(columns, params), (n, b)),
+        "test": np.broadcast_to(test_scores(columns, params), (n, b)),
+    }
+    return combine_scores(breakdown, params["weights"], excluded), breakdown, distance_km
+
+def top_k_per_column(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indici delle k righe migliori per ogni colonna, in ordine decrescente (k x B)"""
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1, axis=0)[:k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=0), axis=0, kind="stable")
+    return np.take_along_axis(top, order, axis=0)
+
+def select_top_k(
+    final_score: np.ndarray,
+    breakdown: Dict[str, np.ndarray],
+    distance_km: np.ndarray,
+    k: int
+) -> Dict[str, Any]:
+    """Top-k per studente con i relativi score (tutti k x B)"""
+    top = top_k_per_column(final_score, k)
+    return {
+        "rows": top,
+        "final_score": np.take_along_axis(final_score, top, axis=0),
+        "breakdown": {key: np.take_along_axis(values, top, axis=0) for key, values in breakdown.items()},
+        "distance_km": np.take_along_axis(distance_km, top, axis=0),
+    }
+
+def merge_top_k(parts: List[Dict[str, Any]], k: int) -> Dict[str, Any]:
+    """Unisce i top-k dei singoli shard (righe già globali) nel top-k complessivo"""
+    final_score = np.concatenate([p["final_score"] for p in parts])
+    top = top_k_per_column(final_score, k)
+    take = lambda key: np.take_along_axis(np.concatenate([p[key] for p in parts]), top, axis=0)
+    return {
+        "rows": take("rows"),
+        "final_score": np.take_along_axis(final_score, top, axis=0),
+        "breakdown": {
+            key: np.take_along_axis(np.concatenate([p["breakdown"][key] for p in parts]), top, axis=0)
+            for key in SCORE_KEYS
+        },
+        "distance_km": take("distance_km"),
+    }
+
+
+# ============= SCORING A SHARD =============
+# Array condivisi del worker corrente (nome -> ndarray), impostati da _attach
+_SHARED: Dict[str, np.ndarray] = {}
+_SHARED_BLOCKS: List[shared_memory.SharedMemory] = []
+_SHARDS: List[Dict[str, Any]] = []
+
+def _attach(specs: Dict[str, Tuple[str, Tuple[int, ...], str]], shards: List[Dict[str, Any]]):
+    """Initializer dei worker: apre i blocchi di shared memory senza copiarli"""
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _SHARED_BLOCKS.append(block)
+        _SHARED[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    _SHARDS[:] = shards
+
+def _score_shard(shard: int, students: Dict[str, np.ndarray], params: Dict[str, Any], k: int) -> Dict[str, Any]:
+    """Scoring di uno shard nel worker; restituisce il suo top-k con indici globali"""
+    bounds = _SHARDS[shard]
+    start, end = bounds["rows"]
+    columns = {name: _SHARED[name][start:end] for name in ("annual_cost", "english_courses", "dorms_available",
+                                                          "admission_test_required", "lat", "lon", "city_codes")}
+    matrices, norms, text_ids = {}, {}, {}
+    for field in students:
+        first, last = bounds["texts"][field]
+        matrices[field] = _SHARED[f"emb_{field}"][first:last]
+        norms[field] = _SHARED[f"norms_{field}"][first:last]
+        text_ids[field] = _SHARED[f"text_ids_{field}"][start:end]
+
+    semantic = semantic_scores(matrices, norms, text_ids, students)
+    result = select_top_k(*score_columns(columns, semantic, params), k)
+    result["rows"] = result["rows"] + start
+    return result
+
+class ScoringPool:
+    """
+    Catalogo diviso in shard contigui copiati una volta in shared memory: ogni shard ha
+    le sue colonne e le sue matrici di embeddings (solo i testi distinti che contiene),
+    così i worker fanno lo scoring senza copie né serializzazione del catalogo.
+    """
+
+    def __init__(self, catalog: Catalog, workers: int):
+        self.catalog = catalog
+        self.workers = workers
+        self.users = 0          # richieste che lo stanno usando (vedi acquire_scoring_pool)
+        self.retired = False    # catalogo sostituito: chiuso quando users torna a 0
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self.executor = None
+        try:
+            self._start(catalog, workers)
+        except BaseException:
+            # niente blocchi di shared memory orfani se la costruzione fallisce a metà
+            self.close()
+            raise
+
+    def _start(self, catalog: Catalog, workers: int):
+        if catalog.embeddings is None:
+            raise ValueError("Scoring parallelo: embeddings del catalogo non ancora caricati")
+        specs = {}
+        n = len(catalog)
+        edges = np.linspace(0, n, workers + 1).astype(int)
+        shards = [{"rows": (int(a), int(b)), "texts": {}} for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+        for name, column in scoring_columns(catalog).items():
+            specs[name] = self._share(name, column)
+
+        norms = catalog.embedding_norms()
+        for field in EMBEDDING_FIELDS:
+            # Testi distinti per shard, rinumerati localmente (id locali contigui)
+            matrices, shard_norms, local_ids = [], [], []
+            offset = 0
+            for shard in shards:
+                start, end = shard["rows"]
+                unique, local = np.unique(catalog.text_ids[field][start:end], return_inverse=True)
+                matrices.append(np.asarray(catalog.embeddings[field][unique]))
+                shard_norms.append(norms[field][unique])
+                local_ids.append(local.astype(np.int32))
+                shard["texts"][field] = (offset, offset + len(unique))
+                offset += len(unique)
+            specs[f"emb_{field}"] = self._share(f"emb_{field}", np.concatenate(matrices))
+            specs[f"norms_{field}"] = self._share(f"norms_{field}", np.concatenate(shard_norms))
+            specs[f"text_ids_{field}"] = self._share(f"text_ids_{field}", np.concatenate(local_ids))
+
+        self.shards = shards
+        # fork: con spawn/forkserver ogni worker reimporterebbe il modulo __main__ (server.py,
+        # con client, dataset e thread). I processi partono tutti al primo task: lo inviamo
+        # subito, così il fork avviene qui e non a metà di una richiesta.
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=get_context("fork"), initializer=_attach, initargs=(specs, shards)
+        )
+        self.executor.submit(int).result()
+        print(f"Scoring parallelo: {len(shards)} shard su {workers} processi ({n} università)")
+
+    def _share(self, name: str, array: np.ndarray) -> Tuple[str, Tuple[int, ...], str]:
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        self._blocks.append(block)
+        return block.name, array.shape, array.dtype.str
+
+    def top_k(self, students: Dict[str, np.ndarray], params: Dict[str, Any], k: int) -> Dict[str, Any]:
+        """Top-k per studente sull'intero catalogo (k x B), calcolato shard per shard nei worker"""
+        futures = [
+            self.executor.submit(_score_shard, i, students, params, k) for i in range(len(self.shards))
+        ]
+        return merge_top_k([f.result() for f in futures], k)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+# Un pool per catalogo (id(catalog) -> pool). Dopo un reload il pool del catalogo
+# precedente resta attivo finché le richieste in corso su quel catalogo non finiscono.
+_pools: Dict[int, ScoringPool] = {}
+_pool_lock = threading.Lock()
+
+def acquire_scoring_pool(catalog: Catalog, create: bool = True) -> Optional[ScoringPool]:
+    """
+    Pool per il catalogo (da restituire con release_scoring_pool), o None se lo scoring
+    parallelo è disattivato o il catalogo è troppo piccolo. Con create=False non ne crea
+    uno nuovo (catalogo già sostituito: si valuta nel processo corrente).
+    Creare il pool di un nuovo catalogo ritira quelli dei cataloghi precedenti.
+    """
+    if SCORING_WORKERS < 1 or len(catalog) < PARALLEL_MIN_ROWS:
+        return None
+    with _pool_lock:
+        pool = _pools.get(id(catalog))
+        if pool is None or pool.catalog is not catalog:
+            if not create:
+                return None
+            pool = ScoringPool(catalog, SCORING_WORKERS)
+            for old in list(_pools.values()):
+                old.retired = True
+                _close_if_unused(old)
+            _pools[id(catalog)] = pool
+        pool.users += 1
+        return pool
+
+def release_scoring_pool(pool: ScoringPool):
+    with _pool_lock:
+        pool.users -= 1
+        _close_if_unused(pool)
+
+def _close_if_unused(pool: ScoringPool):
+    if pool.retired and pool.users == 0:
+        if _pools.get(id(pool.catalog)) is pool:
+            del _pools[id(pool.catalog)]
+        pool.close()
+
+@contextmanager
+def scoring_pool(catalog: Catalog, create: bool = True):
+    """with scoring_pool(catalog) as pool: ... (pool None = scoring nel processo corrente)"""
+    pool = acquire_scoring_pool(catalog, create)
+    try:
+        yield pool
+    finally:
+        if pool is not None:
+            release_scoring_pool(pool)
+
+def close_scoring_pool():
+    with _pool_lock:
+        for pool in list(_pools.values()):
+            pool.close()
+        _pools.clear()
+
+atexit.register(close_scoring_pool)
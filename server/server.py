@@ -1,40 +1,109 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
 import io
+import hmac
+import json
+import base64
+import uuid
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Optional, List, Union
-from pydantic import BaseModel
-from datapizza.clients.openai import OpenAIClient
+from pydantic import BaseModel, ValidationError
 from datapizza.agents import Agent
 from datapizza.memory import Memory
 from datapizza.type import ROLE, TextBlock
 from datapizza.tools import tool
-from elevenlabs import ElevenLabs
 import ast
-from recommendation_system import recommend_universities
+from recommendation_system import (
+    recommend_universities_batch, get_catalog, reload_catalog, format_recommendations,
+    ScoringSession, DEFAULT_WEIGHTS
+)
+from catalog import DEFAULT_CSV, resident_memory, catalog_memory
+from metrics import logger, span, render_prometheus
+from components import register_component, readiness, warm_up
+from encoding import OrjsonProvider, compressible, choose_encoding, compress
+from resilience import upstream, upstream_status, upstream_metrics, error_status
+from profiling import (
+    PROFILE_HEADER, profile_reason, start_profile, finish_profile, list_profiles, profile_path, profile_summary
+)
 
 app = Flask(__name__)
+# orjson: faster than the stdlib encoder and serializes NumPy scores natively
+app.json = OrjsonProvider(app)
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'GET,PUT,POST,DELETE,OPTIONS',
+}
+
 @app.after_request
 def after_request(response):
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    for name, value in CORS_HEADERS.items():
+        response.headers.add(name, value)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli for large JSON and text responses, negotiated with Accept-Encoding"""
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if not compressible(response.mimetype, response.calculate_content_length() or 0):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
     return response
 
 # ============== SHARED MEMORY ==============
 memory = Memory()
 
+# ============== BACKGROUND JOBS ==============
+# Slow follow-up work (pros/cons) runs here so results can be returned first
+executor = ThreadPoolExecutor(max_workers=4)
+MAX_PROS_CONS_JOBS = 64
+pros_cons_jobs: "OrderedDict[str, object]" = OrderedDict()   # result_id -> Future
+MAX_AUDIO_JOBS = 32
+audio_jobs: "OrderedDict[str, object]" = OrderedDict()       # audio_id -> Future (mp3 bytes)
+
+# Batch recommendations (whole classes, counselor tools)
+MAX_BATCH_PROFILES = 1000
+
 # ============== CLIENT ==============
-client = OpenAIClient(
-    api_key="",                                             # INSERT YOUR OPENAI API KEY HERE
-    model="gpt-5.1",
-)
+# Clients and agents are built on first use or by the startup warm-up (the SDKs take ~1 s to import)
+# PYDEIA_OPENAI_BASE_URL / PYDEIA_ELEVENLABS_BASE_URL point the clients elsewhere (e.g. the loadtest.py stand-ins)
+# Timeouts come from the upstream policies in resilience.py, which also owns the retries
+def create_client():
+    from datapizza.clients.openai import OpenAIClient
+    return OpenAIClient(
+        api_key=os.environ.get("OPENAI_API_KEY", ""),           # INSERT YOUR OPENAI API KEY HERE
+        model="gpt-5.1",
+        base_url=os.environ.get("PYDEIA_OPENAI_BASE_URL"),
+        timeout=upstream("openai").policy.timeout,
+        max_retries=0,
+    )
+
+OPENAI_CLIENT = register_component("openai_client", create_client)
 
 # ============== ELEVENLABS CLIENT ==============
-elevenlabs_client = ElevenLabs(
-    api_key=""                                              # INSERT YOUR ELEVENLABS API KEY HERE
-)
+def create_elevenlabs_client():
+    from elevenlabs import ElevenLabs
+    return ElevenLabs(
+        api_key=os.environ.get("ELEVENLABS_API_KEY", ""),       # INSERT YOUR ELEVENLABS API KEY HERE
+        base_url=os.environ.get("PYDEIA_ELEVENLABS_BASE_URL"),
+        timeout=upstream("elevenlabs").policy.timeout,
+    )
+
+ELEVENLABS_CLIENT = register_component("elevenlabs_client", create_elevenlabs_client)
+TTS_VOICE_ID = "cgSgspJ2msm6clMCkdW9"       # Jessica voice
+TTS_MODEL_ID = "eleven_turbo_v2_5"          # Free tier model (turbo v2.5)
+TTS_REQUEST_OPTIONS = {"max_retries": 0}    # retried by resilience.py
 
 # ============== STUDENT DATA MODEL ==============
 class Info(BaseModel):
@@ -61,6 +130,8 @@ class Message(BaseModel):
 current_info = Info()
 message_history: List[Message] = []
 message_counter = 0
+current_weights: Optional[dict] = None           # weights of the last generated results
+scoring_session = ScoringSession()               # cached score columns of this conversation
 
 # example text -- THIS IS JUST FOR PITCHING. SET IT TO AN EMPTY STRING TO START FRESH IN PRODUCTION
 text_ =  ("I'm from Perugia, and after high school I'd like to move to another city, at maximum 400-500 km from home. The idea of staying in a dorm or a university residence appeals to me a lot. I don't mind taking an admission test if required, and I'm also fine with attending courses in English. My current GPA is around 8.0 out of 10. I would love to study in a lively city with a lot of energy and things to do.")
@@ -288,34 +359,39 @@ Each pro/con must be truly comparative and consistent with the data and metadata
 """
 
 # ============== AGENT FOR FOLLOW-UP QUESTIONS ==============
-question_agent = Agent(
+QUESTION_AGENT = register_component("question_agent", lambda: Agent(
     name="questions",
-    client=client,
+    client=OPENAI_CLIENT.get(),
     system_prompt=QUESTION_PROMPT,
     memory=memory,  # use shared memory
-)
+))
 
 @tool
 def get_list(l):
     return l
 
-pro_con = Agent(
+PRO_CON_AGENT = register_component("pro_con_agent", lambda: Agent(
     name='eval',
-    client=client,
+    client=OPENAI_CLIENT.get(),
     tools=[get_list],
     system_prompt=PRO_CON_PROMPT
-)
+))
 
 # ============== UTILS ==============
 
 def extract_info(text: str, memory_obj: Union[Memory, None] = None) -> Info:
-    response = client.structured_response(
-        input=f"Student text: {text}",
-        output_cls=Info,
-        memory=memory_obj,
-        system_prompt=EXTRACTION_SYSTEM_PROMPT,
-    )
+    client = OPENAI_CLIENT.get()
+    with span("extraction", chars=len(text)):
+        response = upstream("openai").call(lambda: client.structured_response(
+            input=f"Student text: {text}",
+            output_cls=Info,
+            memory=memory_obj,
+            system_prompt=EXTRACTION_SYSTEM_PROMPT,
+        ))
+    return extracted_info(text, response, memory_obj)
 
+def extracted_info(text: str, response, memory_obj: Union[Memory, None] = None) -> Info:
+    """Stores the extraction turn in memory and returns the extracted Info"""
     if memory_obj is not None:
         memory_obj.add_turn(
             TextBlock(content=text, type="input_text"),
@@ -329,6 +405,76 @@ def has_none(model: BaseModel) -> bool:
     """Returns True if at least one field is None."""
     return any(value is None for value in model.model_dump().values())
 
+def parse_pros_cons(text: str):
+    """Parses the pros/cons agent output, falling back to the raw text"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def generate_pros_cons(list_dict: list):
+    """Runs the pros/cons agent on the recommended degrees"""
+    logger.debug("\nGENERATING PROS/CONS...")
+    agent = PRO_CON_AGENT.get()
+    with span("pros_cons", options=len(list_dict)):
+        pro_con_response = upstream("openai").call(lambda: agent.run(f"Degree options: {list_dict}"))
+
+    logger.debug("\nPROS/CONS ANALYSIS:")
+    logger.debug(pro_con_response.text)
+
+    return parse_pros_cons(pro_con_response.text)
+
+def add_job(jobs: OrderedDict, future, limit: int) -> str:
+    """Stores a background job (a concurrent Future) under a new id, keeping only the most recent ones"""
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = future
+    while len(jobs) > limit:
+        jobs.popitem(last=False)
+    return job_id
+
+def submit_pros_cons(list_dict: list) -> str:
+    """Starts the pros/cons generation in background and returns its result id"""
+    return add_job(pros_cons_jobs, executor.submit(generate_pros_cons, list_dict), MAX_PROS_CONS_JOBS)
+
+def synthesize_speech(text: str) -> bytes:
+    """Converts text to mp3 audio using ElevenLabs"""
+    client = ELEVENLABS_CLIENT.get()
+    
+    def download() -> bytes:
+        # Use the correct ElevenLabs SDK method: text_to_speech.convert()
+        audio_generator = client.text_to_speech.convert(
+            text=text,
+            voice_id=TTS_VOICE_ID,
+            model_id=TTS_MODEL_ID,
+            request_options=TTS_REQUEST_OPTIONS
+        )
+        # Convert generator to bytes (the audio is streamed while iterating)
+        return b"".join(audio_generator)
+    
+    with span("tts", chars=len(text)) as s:
+        # same text, same audio: a slow synthesis can be hedged
+        audio_bytes = upstream("elevenlabs").call(download, idempotent=True)
+        s["bytes"] = len(audio_bytes)
+    return audio_bytes
+
+def submit_speech(text: str) -> str:
+    """Starts the speech synthesis in background and returns its audio id"""
+    return add_job(audio_jobs, executor.submit(synthesize_speech, text), MAX_AUDIO_JOBS)
+
+def speech_fields(audio_id: Optional[str], inline: bool) -> dict:
+    """Response fields pointing to (or embedding) the audio of a question"""
+    if audio_id is None:
+        return {}
+    if inline:
+        try:
+            audio_bytes = audio_jobs[audio_id].result()
+        except Exception as e:
+            # The question and the extracted info are already stored: send the text without audio
+            logger.warning("TTS Error", exc_info=True)
+            return {'audio_error': str(e)}
+        return {'audio': base64.b64encode(audio_bytes).decode('ascii'), 'audio_mimetype': 'audio/mpeg'}
+    return {'audio_id': audio_id, 'audio_url': f"/api/audio/{audio_id}"}
+
 def merge_info(base: Info, new: Info) -> Info:
     """Merges two Info objects"""
     base_d = base.model_dump()
@@ -339,207 +485,331 @@ def merge_info(base: Info, new: Info) -> Info:
     }
     return Info(**merged)
 
+# ============== CONVERSATION STEPS ==============
+# Shared by the Flask views and the async ones in asgi.py
+
+TRANSITION_MESSAGE = "Perfect! Let me analyze your profile and find the best universities for you..."
+FINAL_MESSAGE = 'Thank you! I have all the information I need. Here are your personalized university recommendations!'
+FINAL_ERROR_MESSAGE = 'Thank you! I have all the information I need. Your profile is complete!'
+
+# Compact response profile ({"compact": true}): drops the message history and the catalog
+# texts repeated in every recommendation, and rounds the scores
+COMPACT_OMITTED_FIELDS = ("academic_profile", "aspiration_values", "lifestyle_preferences")
+COMPACT_SCORE_DIGITS = 4
+
+def add_message(text: str, sender: str):
+    """Appends a message to the sidebar history"""
+    global message_counter
+    message_counter += 1
+    message_history.append(Message(
+        id=message_counter,
+        text=text,
+        sender=sender
+    ))
+
+def answer_prompt(user_response: str) -> str:
+    return f"Student's answer: {user_response}\nCurrent state: {current_info.model_dump()}"
+
+def question_prompt() -> str:
+    return f"Current state of Info object: {current_info.model_dump()}"
+
+def weights_prompt() -> str:
+    return f"Final student profile (Info): {current_info.model_dump()}"
+
+def apply_info(new_info: Info, title: str = "CURRENT INFO AFTER UPDATE:"):
+    """Merges newly extracted fields into the current profile"""
+    global current_info
+    current_info = merge_info(current_info, new_info)
+    
+    logger.debug("\n" + "="*50)
+    logger.debug(title)
+    logger.debug("="*50)
+    for field, value in current_info.model_dump().items():
+        logger.debug(f"{field}: {value}")
+    logger.debug("="*50 + "\n")
+
+def transition_payload(speech: dict) -> dict:
+    """Response telling the frontend to show the loading screen (profile complete)"""
+    logger.info("PROFILE COMPLETE - GENERATING RECOMMENDATIONS")
+    add_message(TRANSITION_MESSAGE, "ai")
+    return {
+        'question': TRANSITION_MESSAGE,
+        'messages': [msg.model_dump() for msg in message_history],
+        'complete': False,
+        'generating_results': True,
+        **speech
+    }
+
+def question_payload(question: str, speech: dict) -> dict:
+    """Response carrying the next question"""
+    add_message(question, "ai")
+    return {
+        'question': question,
+        'complete': False,
+        'profile': current_info.model_dump(),
+        'messages': [msg.model_dump() for msg in message_history],
+        **speech
+    }
+
+def create_weights_agent() -> Agent:
+    return Agent(
+        name="weighter",
+        client=OPENAI_CLIENT.get(),
+        system_prompt=WEIGHT_PROMPT,
+        memory=memory,
+    )
+
+def parse_weights(text: str) -> dict:
+    """Parses the weights agent output (a list of 6 numbers) into the scoring weights"""
+    logger.debug("\nWEIGHTS ESTIMATED BY THE MODEL:")
+    logger.debug(text)
+    
+    weights_list = ast.literal_eval(text.strip())
+    
+    if not isinstance(weights_list, list) or len(weights_list) != 6:
+        raise ValueError(f"Unexpected weights format: {weights_list}")
+    
+    return {
+        "academic_similarity":  weights_list[0],
+        "aspiration_similarity": weights_list[1],
+        "lifestyle_similarity":  weights_list[2],
+        "budget_score":          weights_list[3],
+        "geography_fit":         weights_list[4],
+        "bool":                  weights_list[5],
+    }
+
+def weighted_profile(weights_dict: dict) -> dict:
+    """Student profile passed to the recommender"""
+    student_profile = current_info.model_dump()
+    student_profile["weights"] = weights_dict
+    
+    logger.debug("\nSTUDENT PROFILE:")
+    logger.debug(student_profile)
+    return student_profile
+
+def compact_recommendations(list_dict: list) -> list:
+    """Recommendations without the catalog texts and with scores rounded (compact profile)"""
+    compact = []
+    for i, item in enumerate(list_dict):
+        if i % 2 == 0:
+            compact.append({k: v for k, v in item.items() if k not in COMPACT_OMITTED_FIELDS})
+        else:
+            compact.append({k: round(float(v), COMPACT_SCORE_DIGITS) if v is not None else None for k, v in item.items()})
+    return compact
+
+def results_payload(list_dict: list, weights_dict: dict, result_id: str, pros_cons, compact: bool = False) -> dict:
+    """Final response with the recommendations (pros_cons None while still pending)"""
+    global current_weights
+    current_weights = weights_dict
+    add_message(FINAL_MESSAGE, "ai")
+    payload = {
+        'question': FINAL_MESSAGE,
+        'complete': True,
+        'profile': current_info.model_dump(),
+        'recommendations': compact_recommendations(list_dict) if compact else list_dict,
+        'result_id': result_id,
+        'pros_cons': pros_cons,
+        'pros_cons_pending': pros_cons is None,
+        'weights': weights_dict,
+    }
+    if not compact:
+        payload['messages'] = [msg.model_dump() for msg in message_history]
+    return payload
+
+def results_error_payload(error: Exception) -> dict:
+    """Final response when the recommendation failed"""
+    logger.error("ERROR DURING RECOMMENDATION", exc_info=error)
+    
+    add_message(FINAL_ERROR_MESSAGE, "ai")
+    return {
+        'question': FINAL_ERROR_MESSAGE,
+        'complete': True,
+        'profile': current_info.model_dump(),
+        'error': str(error),
+        'messages': [msg.model_dump() for msg in message_history]
+    }
+
 @app.route('/api/get_question', methods=['POST'])
 def get_question():
     """Get the next question from the AI agent"""
-    global current_info, message_history, message_counter
-    
     try:
         data = request.json
         user_response = data.get('response', '')
+        # tts=True starts the speech synthesis together with the response,
+        # tts="inline" also embeds the audio (base64) in the response
+        tts = data.get('tts', False)
     
         # If there's a user response, process it
         if user_response:
             # Add user message to history
-            message_counter += 1
-            message_history.append(Message(
-                id=message_counter,
-                text=user_response,
-                sender="user"
-            ))
-            
-            new_info = extract_info(
-                f"Student's answer: {user_response}\nCurrent state: {current_info.model_dump()}",
-                memory_obj=memory
-            )
-            current_info = merge_info(current_info, new_info)
-            
-            print("\n" + "="*50)
-            print("CURRENT INFO AFTER UPDATE:")
-            print("="*50)
-            for field, value in current_info.model_dump().items():
-                print(f"{field}: {value}")
-            print("="*50 + "\n")
+            add_message(user_response, "user")
+            new_info = extract_info(answer_prompt(user_response), memory_obj=memory)
+            apply_info(new_info)
         
-        # Check if we're done
+        # Check if we're done: send early response to trigger loading screen
         if not has_none(current_info):
-            print("\n" + "="*50)
-            print("PROFILE COMPLETE - GENERATING RECOMMENDATIONS")
-            print("="*50)
-            
-            # Send early response to trigger loading screen
-            message_counter += 1
-            message_history.append(Message(
-                id=message_counter,
-                text="Perfect! Let me analyze your profile and find the best universities for you...",
-                sender="ai"
-            ))
-            
-            return jsonify({
-                'question': "Perfect! Let me analyze your profile and find the best universities for you...",
-                'messages': [msg.model_dump() for msg in message_history],
-                'complete': False,
-                'generating_results': True
-            })
+            audio_id = submit_speech(TRANSITION_MESSAGE) if tts else None
+            return jsonify(transition_payload(speech_fields(audio_id, tts == 'inline')))
         
         # Get next question (this code runs if profile is NOT complete)
-        q_resp = question_agent.run(
-            f"Current state of Info object: {current_info.model_dump()}"
-        )
+        agent, prompt = QUESTION_AGENT.get(), question_prompt()
+        with span("question_agent"):
+            q_resp = upstream("openai").call(lambda: agent.run(prompt))
         question = q_resp.text
+        # synthesis runs while the rest of the response is built
+        audio_id = submit_speech(question) if tts else None
         
-        # Add AI question to history
-        message_counter += 1
-        message_history.append(Message(
-            id=message_counter,
-            text=question,
-            sender="ai"
-        ))
-        
-        return jsonify({
-            'question': question,
-            'complete': False,
-            'profile': current_info.model_dump(),
-            'messages': [msg.model_dump() for msg in message_history]
-        })
+        return jsonify(question_payload(question, speech_fields(audio_id, tts == 'inline')))
         
     except Exception as e:
-        print(f"\nERROR IN GET_QUESTION: {repr(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        logger.error("ERROR IN GET_QUESTION", exc_info=True)
+        return jsonify({'error': str(e)}), error_status(e)
 
 # Separate endpoint to generate results (called automatically by frontend after loading screen)
 @app.route('/api/generate_results', methods=['POST'])
 def generate_results():
-    global current_info, message_history, message_counter
-    
     if has_none(current_info):
         return jsonify({'error': 'Profile not complete'}), 400
     
+    # progressive=True returns the ranking immediately, without waiting for pros/cons
+    data = request.get_json(silent=True) or {}
+    progressive = bool(data.get('progressive', False))
+    compact = bool(data.get('compact', False))
+    
     try:
         # Generate weights
-        weights_agent = Agent(
-            name="weighter",
-            client=client,
-            system_prompt=WEIGHT_PROMPT,
-            memory=memory,
-        )
-        
-        weights_response = weights_agent.run(
-            f"Final student profile (Info): {current_info.model_dump()}"
-        )
-        
-        print("\nWEIGHTS ESTIMATED BY THE MODEL:")
-        print(weights_response.text)
-        
-        # Parse weights
-        raw_weights = weights_response.text.strip()
-        weights_list = ast.literal_eval(raw_weights)
-        
-        if not isinstance(weights_list, list) or len(weights_list) != 6:
-            raise ValueError(f"Unexpected weights format: {weights_list}")
-        
-        weights_dict = {
-            "academic_similarity":  weights_list[0],
-            "aspiration_similarity": weights_list[1],
-            "lifestyle_similarity":  weights_list[2],
-            "budget_score":          weights_list[3],
-            "geography_fit":         weights_list[4],
-            "bool":                  weights_list[5],
-        }
-        
-        # Build student profile
-        student_profile = current_info.model_dump()
-        student_profile["weights"] = weights_dict
+        agent, prompt = create_weights_agent(), weights_prompt()
+        with span("weights_agent"):
+            weights_response = upstream("openai").call(lambda: agent.run(prompt))
+        weights_dict = parse_weights(weights_response.text)
+        student_profile = weighted_profile(weights_dict)
         
-        print("\nSTUDENT PROFILE:")
-        print(student_profile)
+        # Get university recommendations (score columns stay cached for /api/update_profile)
+        logger.debug("\nCALLING RECOMMENDER...")
+        recommendations, _ = scoring_session.recommend(student_profile)
+        list_dict = format_recommendations(recommendations)
         
-        # Get university recommendations
-        print("\nCALLING RECOMMENDER...")
-        list_dict = recommend_universities(student_profile)
+        logger.debug("\nRECOMMENDATIONS:")
+        logger.debug(list_dict)
         
-        print("\nRECOMMENDATIONS:")
-        print(list_dict)
+        # Pros/cons are slow: start them in background, keyed by result id
+        result_id = submit_pros_cons(list_dict)
         
-        # Generate pros/cons
-        print("\nGENERATING PROS/CONS...")
-        pro_con_response = pro_con.run(f"Degree options: {list_dict}")
+        if progressive:
+            # the client fetches them later from /api/pros_cons/<result_id>
+            pros_cons = None
+        else:
+            pros_cons = pros_cons_jobs[result_id].result()
         
-        print("\nPROS/CONS ANALYSIS:")
-        print(pro_con_response.text)
-        
-        # Parse pro_con response
-        import json
-        try:
-            pros_cons = json.loads(pro_con_response.text)
-        except:
-            pros_cons = pro_con_response.text
-        
-        final_message = 'Thank you! I have all the information I need. Here are your personalized university recommendations!'
-        message_counter += 1
-        message_history.append(Message(
-            id=message_counter,
-            text=final_message,
-            sender="ai"
-        ))
-        
-        return jsonify({
-            'question': final_message,
-            'complete': True,
-            'profile': current_info.model_dump(),
-            'recommendations': list_dict,
-            'pros_cons': pros_cons,
-            'weights': weights_dict,
-            'messages': [msg.model_dump() for msg in message_history]
-        })
+        return jsonify(results_payload(list_dict, weights_dict, result_id, pros_cons, compact))
         
     except Exception as e:
-        print(f"\nERROR DURING RECOMMENDATION: {repr(e)}")
-        import traceback
-        traceback.print_exc()
-        
-        final_message = 'Thank you! I have all the information I need. Your profile is complete!'
-        message_counter += 1
-        message_history.append(Message(
-            id=message_counter,
-            text=final_message,
-            sender="ai"
-        ))
-        
-        return jsonify({
-            'question': final_message,
-            'complete': True,
-            'profile': current_info.model_dump(),
-            'error': str(e),
-            'messages': [msg.model_dump() for msg in message_history]
-        })
+        return jsonify(results_error_payload(e))
     
-    # Get next question (this code runs if profile is NOT complete)
-    q_resp = question_agent.run(
-        f"Current state of Info object: {current_info.model_dump()}"
-    )
-    question = q_resp.text
+@app.route('/api/update_profile', methods=['POST'])
+def update_profile():
+    """Revise some profile answers and re-rank, recomputing only the affected score columns"""
+    global current_info
     
-    # Add AI question to history
-    message_counter += 1
-    message_history.append(Message(
-        id=message_counter,
-        text=question,
-        sender="ai"
-    ))
+    if current_weights is None:
+        return jsonify({'error': 'Generate results first'}), 409
+    
+    data = request.get_json(silent=True) or {}
+    fields = {k: v for k, v in data.items() if k in Info.model_fields}
+    if not fields:
+        return jsonify({'error': f'Nothing to update; allowed fields: {list(Info.model_fields)}'}), 400
+    try:
+        updated_info = Info(**{**current_info.model_dump(), **fields})
+    except ValidationError as e:
+        return jsonify({'error': f'Invalid profile: {e}'}), 400
+    if has_none(updated_info):
+        return jsonify({'error': 'Profile not complete'}), 400
+    current_info = updated_info
+    
+    student_profile = current_info.model_dump()
+    student_profile["weights"] = current_weights
+    try:
+        recommendations, recomputed = scoring_session.recommend(student_profile)
+        list_dict = format_recommendations(recommendations)
+    except Exception as e:
+        logger.error("ERROR DURING RECOMMENDATION", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+    
+    # Pros/cons refer to the new ranking: generated in background as for progressive results
+    result_id = submit_pros_cons(list_dict)
+    return jsonify({
+        'profile': current_info.model_dump(),
+        'recommendations': compact_recommendations(list_dict) if data.get('compact') else list_dict,
+        'recomputed': recomputed,
+        'result_id': result_id,
+        'pros_cons_pending': True,
+        'weights': current_weights
+    })
+
+@app.route('/api/pros_cons/<result_id>', methods=['GET'])
+def get_pros_cons(result_id):
+    """Get the pros/cons of a result generated with progressive=True"""
+    job = pros_cons_jobs.get(result_id)
+    if job is None:
+        return jsonify({'error': 'Unknown result id'}), 404
+    
+    # Optional long polling: wait up to `wait` seconds for the analysis
+    wait = min(request.args.get('wait', 0, type=float), 60.0)
+    try:
+        pros_cons = job.result(timeout=wait)
+    except FutureTimeoutError:
+        return jsonify({'result_id': result_id, 'ready': False}), 202
+    except Exception as e:
+        logger.error("ERROR DURING PROS/CONS", exc_info=True)
+        return jsonify({'result_id': result_id, 'ready': True, 'error': str(e)}), 500
     
+    return jsonify({
+        'result_id': result_id,
+        'ready': True,
+        'pros_cons': pros_cons
+    })
+
+@app.route('/api/recommend_batch', methods=['POST'])
+def recommend_batch():
+    """Recommendations for many student profiles in one request (no conversation state)"""
+    data = request.get_json(silent=True) or {}
+    profiles = data.get('profiles')
+    if not isinstance(profiles, list) or not profiles:
+        return jsonify({'error': 'profiles must be a non-empty list'}), 400
+    if len(profiles) > MAX_BATCH_PROFILES:
+        return jsonify({'error': f'At most {MAX_BATCH_PROFILES} profiles per request'}), 400
+    
+    try:
+        top_k = int(data.get('top_k', 3))
+        student_profiles = []
+        for profile in profiles:
+            # same fields and types as the conversational profile, plus optional weights
+            student_profile = Info(**{k: v for k, v in profile.items() if k in Info.model_fields}).model_dump()
+            if profile.get('weights'):
+                weights = profile['weights']
+                student_profile['weights'] = {key: float(weights[key]) for key in DEFAULT_WEIGHTS}
+            student_profiles.append(student_profile)
+    except (AttributeError, KeyError, TypeError, ValueError, ValidationError) as e:
+        return jsonify({'error': f'Invalid profile: {e}'}), 400
+    if top_k < 1:
+        return jsonify({'error': 'top_k must be at least 1'}), 400
+    
+    try:
+        start = time.perf_counter()
+        results = recommend_universities_batch(student_profiles, top_k=top_k)
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        logger.error("ERROR DURING BATCH RECOMMENDATION", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+    
+    formatter = (lambda r: compact_recommendations(format_recommendations(r))) if data.get('compact') else format_recommendations
+    return jsonify({
+        'results': [{'index': i, 'recommendations': formatter(r)} for i, r in enumerate(results)],
+        'count': len(results),
+        'elapsed_seconds': elapsed,
+        'profiles_per_second': len(results) / elapsed if elapsed else None
+    })
+
 @app.route('/api/text_to_speech', methods=['POST'])
 def text_to_speech_api():
     """Convert text to speech using ElevenLabs"""
@@ -550,15 +820,7 @@ def text_to_speech_api():
         return jsonify({'error': 'No text provided'}), 400
     
     try:
-        # Use the correct ElevenLabs SDK method: text_to_speech.convert()
-        audio_generator = elevenlabs_client.text_to_speech.convert(
-            text=text,
-            voice_id="cgSgspJ2msm6clMCkdW9",  # Jessica voice
-            model_id="eleven_turbo_v2_5"  # Free tier model (turbo v2.5)
-        )
-        
-        # Convert generator to bytes
-        audio_bytes = b"".join(audio_generator)
+        audio_bytes = synthesize_speech(text)
         
         # Return audio file
         return send_file(
@@ -567,42 +829,50 @@ def text_to_speech_api():
             as_attachment=False
         )
     except Exception as e:
-        print(f"TTS Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        logger.warning("TTS Error", exc_info=True)
+        return jsonify({'error': str(e)}), error_status(e)
+
+@app.route('/api/audio/<audio_id>', methods=['GET'])
+def get_audio(audio_id):
+    """Get the audio synthesized for a question returned with tts=True"""
+    job = audio_jobs.get(audio_id)
+    if job is None:
+        return jsonify({'error': 'Unknown audio id'}), 404
+    
+    try:
+        audio_bytes = job.result(timeout=60)
+        return send_file(
+            io.BytesIO(audio_bytes),
+            mimetype='audio/mpeg',
+            as_attachment=False
+        )
+    except Exception as e:
+        logger.warning("TTS Error", exc_info=True)
+        return jsonify({'error': str(e)}), error_status(e)
 
 @app.route('/api/reset', methods=['POST'])
 def reset():
     """Reset the conversation"""
-    global current_info, memory, message_history, message_counter
+    global current_info, memory, message_history, message_counter, current_weights
     current_info = Info()
     memory = Memory()
     message_history = []
     message_counter = 0
+    current_weights = None
+    scoring_session.reset()
     return jsonify({'success': True})
 
 @app.route('/api/initialize', methods=['POST'])
 def initialize():
-    global current_info, message_history, message_counter
     try:
         # Extract initial information from test data
         new_info = extract_info(text_, memory)
-        current_info = merge_info(current_info, new_info)
-        
-        print("\n" + "="*50)
-        print("INITIALIZATION - INFO EXTRACTED:")
-        print("="*50)
-        for field, value in current_info.model_dump().items():
-            print(f"{field}: {value}")
-        print("="*50 + "\n")
+        apply_info(new_info, "INITIALIZATION - INFO EXTRACTED:")
         
         return jsonify({"status": "initialized"})
     except Exception as e:
-        print(f"Initialization error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        logger.error("Initialization error", exc_info=True)
+        return jsonify({"error": str(e)}), error_status(e)
 
 @app.route('/api/messages', methods=['GET'])
 def get_messages():
@@ -611,6 +881,166 @@ def get_messages():
         'messages': [msg.model_dump() for msg in message_history]
     })
 
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok', 'uptime_seconds': round(time.monotonic() - STARTED_AT, 3)})
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness: 200 once clients, agents, catalog and embeddings are loaded and warm, 503 before"""
+    report = readiness()
+    return jsonify(report), (200 if report['ready'] else 503)
+
+@app.route('/api/memory', methods=['GET'])
+def get_memory():
+    """Resident memory of this worker and size of the (memory-mapped) catalog embeddings"""
+    return jsonify({
+        'worker': resident_memory(),
+        'catalog': catalog_memory(get_catalog())
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Per-stage latency histograms and process gauges in Prometheus text format"""
+    catalog = get_catalog()
+    worker = resident_memory()
+    gauges = [
+        ('pydeia_process_memory_bytes', 'Memory of this worker', {'kind': kind}, value)
+        for kind, value in worker.items() if kind != 'pid'
+    ]
+    gauges.append(('pydeia_catalog_rows', 'Universities in the loaded catalog', {}, len(catalog)))
+    for field, info in (catalog_memory(catalog)['embeddings'] or {}).items():
+        gauges.append(('pydeia_catalog_embedding_bytes', 'Size of the catalog embeddings', {'field': field}, info['bytes']))
+    for kind, jobs in (('pros_cons', pros_cons_jobs), ('audio', audio_jobs)):
+        pending = sum(1 for job in list(jobs.values()) if not job.done())
+        gauges.append(('pydeia_background_jobs', 'Background jobs kept in memory', {'kind': kind, 'state': 'pending'}, pending))
+        gauges.append(('pydeia_background_jobs', 'Background jobs kept in memory', {'kind': kind, 'state': 'done'}, len(jobs) - pending))
+    upstream_gauges, upstream_counters = upstream_metrics()
+    gauges += upstream_gauges
+    return app.response_class(render_prometheus(gauges, counters=upstream_counters), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/upstreams', methods=['GET'])
+def get_upstreams():
+    """Timeout/retry/hedging policy, circuit breaker state and counters of each upstream service"""
+    return jsonify({'upstreams': upstream_status()})
+
+# ============== CATALOG RELOAD ==============
+# Token for admin endpoints (X-Admin-Token header)
+ADMIN_TOKEN = os.environ.get("PYDEIA_ADMIN_TOKEN", "")
+
+def admin_authorized() -> bool:
+    """True only when a token is configured and the request carries it"""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@app.route('/api/admin/reload_catalog', methods=['POST'])
+def reload_catalog_api():
+    """Reload data/universities.csv, re-embedding only new or changed texts"""
+    # CORS is open to every origin: without a configured token the endpoint stays disabled
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        report = reload_catalog()
+        return jsonify({'success': True, **report})
+    except Exception as e:
+        logger.error("ERROR DURING CATALOG RELOAD", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def watch_catalog(interval: float):
+    """Reloads the catalog whenever the CSV file changes"""
+    def mtime():
+        try:
+            return os.stat(DEFAULT_CSV).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    last = mtime()
+    while True:
+        time.sleep(interval)
+        current = mtime()
+        if current is not None and current != last:
+            last = current
+            try:
+                reload_catalog()
+            except Exception:
+                logger.error("ERROR DURING CATALOG RELOAD", exc_info=True)
+
+# PYDEIA_CATALOG_WATCH=<seconds> enables the file-watch mode
+if os.environ.get("PYDEIA_CATALOG_WATCH"):
+    threading.Thread(
+        target=watch_catalog,
+        args=(float(os.environ["PYDEIA_CATALOG_WATCH"]),),
+        daemon=True
+    ).start()
+
+# ============== PROFILING ==============
+# Requests with the X-Profile header (or a PYDEIA_PROFILE_SAMPLE fraction of them) run under cProfile
+
+@app.before_request
+def start_request_profile():
+    if request.path.startswith('/api/profiles'):
+        return
+    reason = profile_reason(request.headers.get(PROFILE_HEADER))
+    # Only admins can force profiling (sampling is configured by the operator)
+    if reason == 'header' and not admin_authorized():
+        reason = None
+    if reason is not None:
+        g.profile = start_profile(reason)
+
+@app.after_request
+def save_request_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        try:
+            meta = finish_profile(profile, request.method, request.path, response.status_code)
+            response.headers['X-Profile-Id'] = meta['id']
+            response.headers['Access-Control-Expose-Headers'] = 'X-Profile-Id'
+        except OSError:
+            logger.warning("ERROR SAVING PROFILE", exc_info=True)
+    return response
+
+@app.teardown_request
+def discard_request_profile(exc):
+    # after_request is skipped on unhandled errors: keep the profile anyway
+    profile = g.pop('profile', None)
+    if profile is not None:
+        finish_profile(profile, request.method, request.path, 500)
+
+@app.route('/api/profiles', methods=['GET'])
+def get_profiles():
+    """Recent request profiles (newest first) with their stage timings"""
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({'profiles': list_profiles()})
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Download a profile (.prof for pstats/snakeviz, or ?format=text for a summary)"""
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    path = profile_path(profile_id)
+    if path is None:
+        return jsonify({'error': 'Unknown profile'}), 404
+    if request.args.get('format') == 'text':
+        return app.response_class(profile_summary(path), mimetype='text/plain')
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f"{profile_id}.prof")
+
+# ============== WARM-UP ==============
+# Loads every component in background right after startup (PYDEIA_WARMUP=0 leaves them to the first request)
+STARTED_AT = time.monotonic()
+WARMUP_RETRY_SECONDS = float(os.environ.get("PYDEIA_WARMUP_RETRY", "5"))
+# Cheap SDK clients and agents first, so they don't wait behind the embedding service
+WARMUP_ORDER = [
+    "openai_client", "elevenlabs_client", "question_agent", "pro_con_agent",
+    "catalog", "embedding_model", "catalog_embeddings",
+]
+
+if os.environ.get("PYDEIA_WARMUP", "1") != "0":
+    threading.Thread(target=warm_up, args=(WARMUP_ORDER, WARMUP_RETRY_SECONDS), daemon=True).start()
+
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5002)
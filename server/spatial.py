@@ -0,0 +1,90 @@
+import math
+import numpy as np
+from typing import Tuple
+
+
+# Indice spaziale a griglia lat/lon sulle coordinate del catalogo: le ricerche per
+# raggio e per k più vicini guardano solo le celle attorno all'origine, non tutte le
+# università. Le distanze sono sempre in km (Haversine).
+
+
+EARTH_RADIUS_KM = 6371
+# Lato delle celle della griglia (gradi): ~28 km in latitudine
+GRID_CELL_DEGREES = 0.25
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distanza Haversine in km (scalari o array numpy)"""
+    R = EARTH_RADIUS_KM
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a_dist = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return R * 2 * np.arctan2(np.sqrt(a_dist), np.sqrt(1 - a_dist))
+
+class SpatialIndex:
+    """
+    Griglia regolare in gradi: le righe sono ordinate per cella e ogni cella è un
+    intervallo contiguo di quell'ordine (starts), come un CSR.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, cell_degrees: float = GRID_CELL_DEGREES):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell = cell_degrees
+
+        cell_lat = np.floor(self.lat / cell_degrees).astype(np.int64)
+        cell_lon = np.floor(self.lon / cell_degrees).astype(np.int64)
+        self.lat0 = int(cell_lat.min()) if len(cell_lat) else 0
+        self.lon0 = int(cell_lon.min()) if len(cell_lon) else 0
+        self.height = int(cell_lat.max()) - self.lat0 + 1 if len(cell_lat) else 0
+        self.width = int(cell_lon.max()) - self.lon0 + 1 if len(cell_lon) else 0
+
+        cell_ids = (cell_lat - self.lat0) * self.width + (cell_lon - self.lon0)
+        self.rows = np.argsort(cell_ids, kind="stable")
+        counts = np.bincount(cell_ids, minlength=self.height * self.width)
+        self.starts = np.concatenate(([0], np.cumsum(counts)))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _box(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> np.ndarray:
+        """Righe delle celle che intersecano il rettangolo"""
+        i0 = max(int(math.floor(lat_min / self.cell)) - self.lat0, 0)
+        i1 = min(int(math.floor(lat_max / self.cell)) - self.lat0, self.height - 1)
+        j0 = max(int(math.floor(lon_min / self.cell)) - self.lon0, 0)
+        j1 = min(int(math.floor(lon_max / self.cell)) - self.lon0, self.width - 1)
+        if i1 < i0 or j1 < j0:
+            return np.empty(0, dtype=self.rows.dtype)
+        # Ogni riga della griglia è un intervallo contiguo di celle
+        parts = [
+            self.rows[self.starts[i * self.width + j0]:self.starts[i * self.width + j1 + 1]]
+            for i in range(i0, i1 + 1)
+        ]
+        return np.concatenate(parts)
+
+    def within(self, lat: float, lon: float, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Righe entro radius_km dal punto (ordinate per riga) e relative distanze in km"""
+        if not len(self):
+            return self.rows, np.empty(0)
+        # Rettangolo che contiene il cerchio sulla sfera
+        r = radius_km / EARTH_RADIUS_KM
+        dlat = math.degrees(r)
+        if abs(lat) + dlat >= 90 or r >= math.pi / 2:
+            dlon = 180.0
+        else:
+            dlon = math.degrees(math.asin(min(math.sin(r) / math.cos(math.radians(lat)), 1.0)))
+        rows = np.sort(self._box(lat - dlat, lat + dlat, lon - dlon, lon + dlon))
+        dist = haversine_km(lat, lon, self.lat[rows], self.lon[rows])
+        inside = dist <= radius_km
+        return rows[inside], dist[inside]
+
+    def nearest(self, lat: float, lon: float, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Le k righe più vicine al punto (dalla più vicina) e relative distanze in km"""
+        k = min(k, len(self))
+        radius = self.cell * math.pi * EARTH_RADIUS_KM / 180
+        while True:
+            rows, dist = self.within(lat, lon, radius)
+            # Ogni riga fuori dal raggio è più lontana di quelle trovate: basta averne k
+            if len(rows) >= k or radius >= math.pi * EARTH_RADIUS_KM:
+                order = np.argsort(dist, kind="stable")[:k]
+                return rows[order], dist[order]
+            radius *= 2
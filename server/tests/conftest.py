@@ -0,0 +1,38 @@
+import csv
+import os
+import sys
+
+import pytest
+
+# I moduli del server si importano come top-level (come fa server.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import recommendation_system as rs
+from catalog import DEFAULT_CSV, load_catalog_csv
+from embeddings import HashingBackend
+
+
+def write_catalog(path, edit=None):
+    """Copia del CSV del catalogo, con edit(rows) applicato alle righe"""
+    with open(DEFAULT_CSV, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames, rows = reader.fieldnames, list(reader)
+    if edit is not None:
+        edit(rows)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture
+def catalog(monkeypatch, tmp_path):
+    # backend in-process, cache e snapshot usa e getta: nessun servizio esterno
+    monkeypatch.setattr(rs, "EMBEDDER", HashingBackend())
+    monkeypatch.setattr(rs, "EMBEDDINGS_CACHE_DIR", str(tmp_path / "embeddings"))
+    monkeypatch.setattr(rs, "DEFAULT_SNAPSHOT", str(tmp_path / "snapshot"))
+    monkeypatch.setattr(rs, "CATALOG_CHECK_SECONDS", 0)
+    catalog = load_catalog_csv(DEFAULT_CSV)
+    monkeypatch.setattr(rs, "UNIVERSITY_DATASET", catalog)
+    return catalog
@@ -0,0 +1,31 @@
+import pytest
+
+import profiling
+import server
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    return server.app.test_client()
+
+
+@pytest.mark.parametrize("path", ["/api/profiles", "/api/profiles/abc"])
+@pytest.mark.parametrize("token", ["", "secret"])
+def test_profile_endpoints_need_admin_token(client, monkeypatch, path, token):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", token)
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+def test_profile_header_ignored_without_admin_token(client, monkeypatch):
+    response = client.get("/api/upstreams", headers={"X-Profile": "1"})
+    assert "X-Profile-Id" not in response.headers
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    response = client.get("/api/upstreams", headers={"X-Profile": "1", "X-Admin-Token": "wrong"})
+    assert "X-Profile-Id" not in response.headers
+
+def test_reload_endpoint_needs_admin_token(client, monkeypatch):
+    assert client.post("/api/admin/reload_catalog").status_code == 403
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    assert client.post("/api/admin/reload_catalog", headers={"X-Admin-Token": "wrong"}).status_code == 403
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import recommendation_system as rs
+from conftest import write_catalog
+from catalog import build_snapshot, load_catalog_csv, load_snapshot, validate_catalog
+
+
+def punctuation_only(rows):
+    rows[0]["aspiration_values"] = "!!!"
+
+
+def test_zero_embedding_rows_are_valid(catalog, tmp_path):
+    new = load_catalog_csv(write_catalog(tmp_path / "universities.csv", punctuation_only))
+    rs.get_universities_embeddings(new)
+    text_id = new.text_ids["aspiration"][0]
+    assert not np.asarray(new.embeddings["aspiration"][text_id], dtype=np.float32).any()
+    assert validate_catalog(new) == []
+
+    snapshot = build_snapshot(new, str(tmp_path / "snapshot"), embedding_model=rs.EMBEDDER.model_id)
+    loaded = load_snapshot(snapshot, rs.EMBEDDER.model_id)
+    assert loaded.embeddings is not None
+    assert validate_catalog(loaded) == []
+
+def test_invalid_values_are_reported(tmp_path):
+    def broken(rows):
+        rows[0]["annual_cost"] = "-1"
+        rows[1]["min_gpa"] = "12"
+        rows[2]["nome"] = ""
+    errors = validate_catalog(load_catalog_csv(write_catalog(tmp_path / "universities.csv", broken)))
+    assert "annual_cost negativo" in errors
+    assert "min_gpa fuori dall'intervallo 0-10" in errors
+    assert any("nome o corso mancante" in error for error in errors)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import recommendation_system as rs
+from embeddings import HashingBackend
+
+
+PROFILE = {
+    "academic_profile": "",
+    "aspiration_values": "!!!",
+    "lifestyle_preferences": "vita universitaria in una grande città",
+    "budget": 8000, "origin": "Roma", "location": None, "gpa": 8.0, "max_distance": None,
+    "far_from_home": True, "english_language": False, "dorms_nearby": False,
+    "admission_test": True, "extracurricular_activities": True, "weights": None,
+}
+
+
+def test_hashing_backend_gives_zero_vector_without_tokens():
+    vectors = HashingBackend().embed(["", "!!!", "matematica"])
+    assert vectors.shape == (3, HashingBackend().embedder.dim)
+    assert not vectors[:2].any()
+    assert np.linalg.norm(vectors[2]) == pytest.approx(1.0)
+
+def test_zero_norm_similarity_is_zero(catalog):
+    rs.get_universities_embeddings(catalog)
+    zero = np.zeros(catalog.embeddings["academic"].shape[1], dtype=np.float32)
+    similarities = rs.cosine_similarities(zero, catalog.embeddings["academic"])
+    assert np.all(similarities == 0)
+
+def test_single_recommendation_with_empty_texts_is_finite(catalog):
+    recommendations = rs.recommend_universities(dict(PROFILE))
+    assert recommendations
+    assert all(np.isfinite(u["final_score"]) for u in recommendations)
+
+def test_batch_recommendation_with_empty_texts_is_finite(catalog):
+    results = rs.recommend_universities_batch([dict(PROFILE)], top_k=5, catalog=catalog)
+    assert all(np.isfinite(u["final_score"]) for u in results[0])
+    assert all(np.isfinite(v) for u in results[0] for v in u["score_breakdown"].values())
+
+def test_session_recommendation_with_empty_texts_is_finite(catalog):
+    recommendations, _ = rs.ScoringSession().recommend(dict(PROFILE))
+    assert all(np.isfinite(u["final_score"]) for u in recommendations)
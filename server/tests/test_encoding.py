@@ -0,0 +1,127 @@
+import gzip
+import json
+
+import pytest
+from starlette.requests import Request
+
+import encoding
+import server
+from encoding import accepted_encodings, choose_encoding, compressible, compress, COMPRESS_MIN_BYTES
+
+
+def test_accepted_encodings_parses_q_values():
+    assert accepted_encodings("gzip;q=0.8, BR , identity;q=0, deflate;q=x") == {
+        "gzip": 0.8, "br": 1.0, "identity": 0.0, "deflate": 0.0
+    }
+    assert accepted_encodings("") == {}
+    assert accepted_encodings(None) == {}
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip, deflate", "gzip"),
+    ("*", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br, gzip;q=0.9", "br"),
+    ("br;q=0, *", "gzip"),
+    ("gzip;q=0", None),
+    ("identity", None),
+    ("", None),
+])
+def test_choose_encoding(monkeypatch, header, expected):
+    # con brotli installato: br preferito a parità di q
+    monkeypatch.setattr(encoding, "ENCODINGS", ["br", "gzip"])
+    assert choose_encoding(header) == expected
+
+def test_choose_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr(encoding, "ENCODINGS", ["gzip"])
+    assert choose_encoding("br") is None
+    assert choose_encoding("br, gzip;q=0.1") == "gzip"
+
+def test_compressible():
+    assert compressible("application/json", COMPRESS_MIN_BYTES)
+    assert compressible("text/html", COMPRESS_MIN_BYTES * 10)
+    assert not compressible("application/json", COMPRESS_MIN_BYTES - 1)
+    assert not compressible("audio/mpeg", COMPRESS_MIN_BYTES * 10)
+    assert not compressible(None, COMPRESS_MIN_BYTES * 10)
+
+def test_compress_round_trip():
+    body = json.dumps({"rows": list(range(1000))}).encode()
+    packed = compress(body, "gzip")
+    assert gzip.decompress(packed) == body
+    assert packed == compress(body, "gzip")   # mtime=0: stessa risposta, stessi byte (ETag, cache)
+    assert len(packed) < len(body)
+
+def test_compress_brotli_round_trip():
+    brotli = pytest.importorskip("brotli")
+    body = json.dumps({"rows": list(range(1000))}).encode()
+    assert brotli.decompress(compress(body, "br")) == body
+
+
+# ============= NEGOZIAZIONE NELLE RISPOSTE =============
+PROFILES = [
+    {"origin": "Milano", "interests": "informatica", "budget": 15000, "max_distance": 300},
+    {"origin": "Roma", "interests": "medicina", "budget": 8000},
+]
+
+@pytest.fixture
+def client(catalog):
+    return server.app.test_client()
+
+def recommend_batch(client, accept_encoding, compact=False):
+    return client.post(
+        "/api/recommend_batch",
+        json={"profiles": PROFILES, "top_k": 3, "compact": compact},
+        headers={"Accept-Encoding": accept_encoding},
+    )
+
+def test_flask_response_compressed_when_accepted(client):
+    plain = recommend_batch(client, "identity")
+    assert plain.status_code == 200
+    assert "Content-Encoding" not in plain.headers
+    assert "Accept-Encoding" in plain.headers["Vary"]
+
+    packed = recommend_batch(client, "gzip")
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in packed.headers["Vary"]
+    assert len(packed.data) < len(plain.data)
+    unpacked, expected = json.loads(gzip.decompress(packed.data)), plain.get_json()
+    unpacked.pop("elapsed_seconds"), unpacked.pop("profiles_per_second")
+    expected.pop("elapsed_seconds"), expected.pop("profiles_per_second")
+    assert unpacked == expected
+
+def test_flask_compact_profile_is_smaller(client):
+    full = recommend_batch(client, "gzip")
+    compact = recommend_batch(client, "gzip", compact=True)
+    assert len(compact.data) < len(full.data)
+    recommendations = json.loads(gzip.decompress(compact.data))["results"][0]["recommendations"]
+    assert recommendations
+
+def test_flask_small_response_not_compressed(client):
+    response = client.get("/api/upstreams", headers={"Accept-Encoding": "gzip"})
+    assert len(response.data) < COMPRESS_MIN_BYTES
+    assert "Content-Encoding" not in response.headers
+
+def asgi_request(accept_encoding):
+    return Request({
+        "type": "http", "method": "POST", "path": "/", "query_string": b"",
+        "headers": [(b"accept-encoding", accept_encoding.encode())],
+    })
+
+def test_asgi_json_response_negotiates_like_flask():
+    from asgi import json_response
+    payload = {"rows": [{"name": f"Università {i}", "score": i / 1000} for i in range(200)]}
+    with server.app.app_context():
+        expected = server.app.json.encode(payload) + b"\n"
+
+    packed = json_response(asgi_request("br;q=0, gzip"), payload)
+    assert packed.headers["content-encoding"] == "gzip"
+    assert packed.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(packed.body) == expected
+
+    plain = json_response(asgi_request("identity"), payload)
+    assert "content-encoding" not in plain.headers
+    assert plain.body == expected
+
+    small = json_response(asgi_request("gzip"), {"ok": True})
+    assert "content-encoding" not in small.headers
+    assert "vary" not in small.headers
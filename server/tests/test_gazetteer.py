@@ -0,0 +1,103 @@
+import pytest
+
+from catalog import DEFAULT_CSV, load_catalog_csv
+from gazetteer import load_gazetteer
+from scoring import FALLBACK_DISTANCE_KM
+from spatial import haversine_km
+
+
+@pytest.fixture(scope="module")
+def gazetteer():
+    return load_gazetteer()
+
+@pytest.fixture(scope="module")
+def catalog():
+    return load_catalog_csv(DEFAULT_CSV)
+
+
+def test_every_catalog_city_is_in_the_gazetteer(gazetteer, catalog):
+    missing = []
+    for i in range(len(catalog)):
+        row = catalog[i]
+        found = gazetteer.lookup(row["city"])
+        if found is None:
+            missing.append(row["city"])
+            continue
+        # il comune giusto: la sede dell'università è vicina al suo centro
+        place = gazetteer.place(found)
+        distance = haversine_km(place.lat, place.lon, row["coordinates"]["lat"], row["coordinates"]["lon"])
+        assert distance < 25, (row["city"], place.name, float(distance))
+    assert not missing, sorted(set(missing))
+
+def test_distance_between_catalog_cities():
+    from recommendation_system import calculate_distance, city_coords
+    distance = calculate_distance("Siena", "Firenze", city_coords("Firenze"))
+    assert distance != FALLBACK_DISTANCE_KM
+    assert 45 < distance < 65
+
+@pytest.mark.parametrize("text, expected", [
+    ("Bolonia", "Bologna"),
+    ("Milno", "Milano"),
+    ("Rom", "Roma"),
+    ("Firenze (FI)", "Firenze"),
+])
+def test_fuzzy_match_accepts_typos(gazetteer, text, expected):
+    assert gazetteer.place(gazetteer.resolve(text)).name == expected
+
+@pytest.mark.parametrize("text", ["Ostia", "Xyz", "Parigi"])
+def test_fuzzy_match_does_not_guess(gazetteer, text):
+    assert gazetteer.resolve(text) is None
+
+
+# Estratti nel formato delle sorgenti del build: elenco ISTAT (';', cp1252) e GeoNames IT.txt
+ISTAT_SAMPLE = (
+    "Codice Regione;Codice Comune formato alfanumerico;Denominazione (Italiana e straniera);"
+    "Denominazione in italiano;Denominazione altra lingua;Denominazione Regione;"
+    "Sigla automobilistica\n"
+    "12;058091;Roma;Roma;;Lazio;RM\n"
+    "12;056003;Bagnoregio;Bagnoregio;;Lazio;VT\n"
+    "13;066084;Roccaraso;Roccaraso;;Abruzzo;AQ\n"
+    "04;021008;Bolzano/Bozen;Bolzano;Bozen;Trentino-Alto Adige/Südtirol;BZ\n"
+    "01;001999;Comune Senza Sede;Comune Senza Sede;;Piemonte;TO\n"
+)
+
+def geonames_line(geonameid, name, lat, lon, feature_class, feature, admin3, population):
+    fields = [geonameid, name, name, "", lat, lon, feature_class, feature, "IT", "", "", "", admin3, "", population,
+              "", "", "Europe/Rome", "2024-01-01"]
+    return "\t".join(str(f) for f in fields)
+
+GEONAMES_SAMPLE = "\n".join([
+    geonames_line(3169070, "Roma", 41.89193, 12.51133, "P", "PPLC", "058091", 2318895),
+    geonames_line(6541869, "Roma", 41.8547, 12.6043, "A", "ADM3", "058091", 2748109),
+    geonames_line(6540633, "Bagnoregio", 42.6272, 12.0912, "A", "ADM3", "056003", 3500),
+    geonames_line(3182558, "Bagnoregio", 42.62741, 12.09108, "P", "PPLA3", "056003", 1000),
+    geonames_line(3169296, "Roccaraso", 41.84621, 14.07824, "P", "PPLA3", "066084", 1600),
+    geonames_line(3181913, "Bolzano", 46.49067, 11.33982, "P", "PPLA2", "021008", 102575),
+    geonames_line(1234567, "Lago Qualunque", 45.0, 7.0, "H", "LK", "001999", 0),
+]) + "\n"
+
+@pytest.fixture
+def built_gazetteer(tmp_path):
+    (tmp_path / "comuni.csv").write_bytes(ISTAT_SAMPLE.encode("cp1252"))
+    (tmp_path / "IT.txt").write_text(GEONAMES_SAMPLE, encoding="utf-8")
+    previous = tmp_path / "gazetteer_it.csv"
+    previous.write_text("name,province,region,lat,lon,population,aliases\nRoma,RM,Lazio,41.85,12.60,,Rome\n")
+
+    from gazetteer import build_gazetteer
+    count = build_gazetteer(str(tmp_path / "comuni.csv"), str(tmp_path / "IT.txt"), str(previous), previous=str(previous))
+    assert count == 4   # il comune senza sede in GeoNames è segnalato e saltato
+    return load_gazetteer(str(previous))
+
+def test_build_resolves_small_comune(built_gazetteer):
+    for text in ("Roccaraso", "roccaraso (AQ)", "Rocaraso"):
+        place = built_gazetteer.place(built_gazetteer.resolve(text))
+        assert (place.name, place.province, place.region) == ("Roccaraso", "AQ", "Abruzzo")
+    # sede del comune (PPLA3) preferita all'unità amministrativa
+    assert built_gazetteer.coords("Bagnoregio") == {"lat": 42.6274, "lon": 12.0911}
+
+def test_build_keeps_aliases_and_regions(built_gazetteer):
+    assert built_gazetteer.place(built_gazetteer.resolve("Rome")).name == "Roma"
+    assert built_gazetteer.place(built_gazetteer.resolve("Bozen")).name == "Bolzano"
+    assert built_gazetteer.region("Südtirol") == "Trentino-Alto Adige"
+    # popolazione dell'ADM3, il comune più popoloso per primo
+    assert built_gazetteer.names[0] == "Roma"
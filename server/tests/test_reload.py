@@ -0,0 +1,101 @@
+import os
+import time
+
+import pytest
+
+import recommendation_system as rs
+from catalog import embeddings_cache_path, load_catalog_csv, snapshot_signature
+from conftest import write_catalog
+
+
+NEW_TEXT = "biotecnologie marine e lavoro sul campo"
+
+
+def change_first_aspiration(rows):
+    rows[0]["aspiration_values"] = NEW_TEXT
+
+def negative_cost(rows):
+    rows[0]["annual_cost"] = "-1"
+
+
+@pytest.fixture
+def csv_path(catalog, monkeypatch, tmp_path):
+    """Catalogo servito da un CSV temporaneo, con gli embeddings già calcolati"""
+    path = write_catalog(tmp_path / "universities.csv")
+    monkeypatch.setattr(rs, "DEFAULT_CSV", path)
+    current = load_catalog_csv(path)
+    rs.get_universities_embeddings(current)
+    monkeypatch.setattr(rs, "UNIVERSITY_DATASET", current)
+    monkeypatch.setattr(rs, "_snapshot_signature", None)
+    return path
+
+
+def test_reload_reembeds_only_changed_texts(csv_path):
+    current = rs.get_catalog()
+    write_catalog(csv_path, change_first_aspiration)
+    report = rs.reload_catalog()
+
+    new = rs.get_catalog()
+    assert new is not current
+    assert report["changed"] == [int(current.columns["id"][0])]
+    assert report["added"] == report["removed"] == []
+    assert report["reembedded"] == 1
+    assert report["published"]
+    assert new[0]["aspiration_values"] == NEW_TEXT
+    assert new.embeddings is not None
+
+def test_reload_keeps_one_embeddings_cache_per_version(csv_path):
+    current = rs.get_catalog()
+    old_dir = embeddings_cache_path(rs.embeddings_cache_key(current), rs.EMBEDDINGS_CACHE_DIR)
+    write_catalog(csv_path, change_first_aspiration)
+    rs.reload_catalog()
+    new_dir = embeddings_cache_path(rs.embeddings_cache_key(rs.get_catalog()), rs.EMBEDDINGS_CACHE_DIR)
+    assert new_dir != old_dir
+    # I file che il catalogo precedente ha in mmap non sono stati riscritti
+    assert os.path.exists(os.path.join(old_dir, "manifest.json"))
+    assert rs.recommend_universities_batch([{"origin": "Roma"}], catalog=current)
+
+def test_invalid_csv_keeps_the_current_catalog(csv_path):
+    current = rs.get_catalog()
+    write_catalog(csv_path, negative_cost)
+    with pytest.raises(ValueError, match="annual_cost negativo"):
+        rs.reload_catalog()
+    assert rs.get_catalog() is current
+    assert snapshot_signature(rs.DEFAULT_SNAPSHOT) is None
+
+def test_other_workers_follow_the_published_snapshot(csv_path, monkeypatch):
+    current = rs.get_catalog()
+    write_catalog(csv_path, change_first_aspiration)
+    rs.reload_catalog()
+    published = rs.get_catalog()
+
+    # Un altro worker: ancora sul catalogo precedente, senza aver visto lo snapshot
+    monkeypatch.setattr(rs, "UNIVERSITY_DATASET", current)
+    monkeypatch.setattr(rs, "_snapshot_signature", None)
+    monkeypatch.setattr(rs, "_next_snapshot_check", 0.0)
+    monkeypatch.setattr(rs, "CATALOG_CHECK_SECONDS", 0.01)
+    assert rs.get_catalog() is current          # il caricamento avviene in background
+
+    deadline = time.monotonic() + 10
+    while rs.UNIVERSITY_DATASET is current and time.monotonic() < deadline:
+        time.sleep(0.01)
+    followed = rs.UNIVERSITY_DATASET
+    assert followed is not current
+    assert followed.source == rs.DEFAULT_SNAPSHOT
+    assert followed.content_hash == published.content_hash
+    assert followed[0]["aspiration_values"] == NEW_TEXT
+    assert followed.embeddings is not None
+    assert rs._snapshot_signature == snapshot_signature(rs.DEFAULT_SNAPSHOT)
+
+def test_published_snapshot_is_not_followed_by_its_publisher(csv_path, monkeypatch):
+    write_catalog(csv_path, change_first_aspiration)
+    rs.reload_catalog()
+    assert rs._snapshot_signature == snapshot_signature(rs.DEFAULT_SNAPSHOT)
+
+def test_reload_endpoint_with_admin_token(csv_path, monkeypatch):
+    import server
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    write_catalog(csv_path, change_first_aspiration)
+    response = server.app.test_client().post("/api/admin/reload_catalog", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.get_json()["reembedded"] == 1
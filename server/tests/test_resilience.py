@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, Policy, Upstream
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, "BACKOFF_BASE", 0.0)
+
+def make_upstream(retries=2, hedge=False, failures=2, reset_seconds=60.0):
+    service = Upstream("test", Policy(timeout=1.0, deadline=5.0, retries=retries, hedge=hedge))
+    service.breaker = CircuitBreaker("test", failures=failures, reset_seconds=reset_seconds)
+    return service
+
+def fail(error):
+    def fn():
+        raise error
+    return fn
+
+def open_breaker(service):
+    for _ in range(service.breaker.threshold):
+        with pytest.raises(ConnectionError):
+            service.call(fail(ConnectionError()))
+    assert service.breaker.state == "open"
+
+
+def test_breaker_opens_after_consecutive_transient_failures():
+    service = make_upstream(retries=0)
+    open_breaker(service)
+    with pytest.raises(CircuitOpenError):
+        service.call(lambda: "ok")
+    assert service.counters["short_circuits"] == 1
+
+def test_half_open_probe_success_closes_the_circuit():
+    service = make_upstream(retries=0)
+    open_breaker(service)
+    service.breaker.opened_at -= service.breaker.reset_seconds
+    assert service.call(lambda: "ok") == "ok"
+    assert service.breaker.state == "closed"
+
+def test_half_open_probe_failure_reopens_the_circuit():
+    service = make_upstream(retries=0)
+    open_breaker(service)
+    service.breaker.opened_at -= service.breaker.reset_seconds
+    with pytest.raises(ConnectionError):
+        service.call(fail(ConnectionError()))
+    assert service.breaker.state == "open"
+    assert service.breaker.opened == 2
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker("test", failures=1, reset_seconds=0.0)
+    breaker.failure()
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+def test_cancelled_half_open_probe_lets_the_next_call_probe():
+    service = make_upstream(retries=0)
+    open_breaker(service)
+    service.breaker.opened_at -= service.breaker.reset_seconds
+
+    async def cancelled_probe():
+        task = asyncio.ensure_future(service.a_call(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async def ok():
+        return "ok"
+
+    asyncio.run(cancelled_probe())
+    assert service.breaker.state == "half_open"
+    assert not service.breaker.probing
+    assert asyncio.run(service.a_call(ok)) == "ok"
+    assert service.breaker.state == "closed"
+
+def test_transient_errors_are_retried():
+    service = make_upstream(retries=2, failures=5)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise HTTPError(503)
+        return "ok"
+
+    assert service.call(flaky) == "ok"
+    assert len(calls) == 3
+    assert service.counters["retries"] == 2
+    assert service.breaker.state == "closed"
+
+def test_client_errors_are_not_retried_and_do_not_trip_the_breaker():
+    service = make_upstream(retries=2, failures=1)
+    with pytest.raises(HTTPError):
+        service.call(fail(HTTPError(400)))
+    assert service.counters["attempts"] == 1
+    assert service.breaker.state == "closed"
+
+def test_slow_idempotent_call_is_hedged():
+    service = make_upstream(hedge=True)
+    service.latencies.extend([0.01] * resilience.HEDGE_MIN_SAMPLES)
+    lock, calls = threading.Lock(), []
+
+    def slow_first():
+        with lock:
+            calls.append(1)
+            first = len(calls) == 1
+        if first:
+            time.sleep(0.5)
+            return "slow"
+        return "fast"
+
+    assert service.call(slow_first, idempotent=True) == "fast"
+    assert service.counters["hedges"] == 1
+    assert service.counters["hedge_wins"] == 1
+
+def test_non_idempotent_call_is_not_hedged():
+    service = make_upstream(hedge=True)
+    service.latencies.extend([0.01] * resilience.HEDGE_MIN_SAMPLES)
+    assert service.call(lambda: time.sleep(0.05) or "ok") == "ok"
+    assert service.counters["hedges"] == 0
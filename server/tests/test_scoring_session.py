@@ -0,0 +1,45 @@
+import pytest
+
+import recommendation_system as rs
+
+
+PROFILE = {
+    "academic_profile": "mi piacciono la matematica e l'informatica",
+    "aspiration_values": "lavorare nella ricerca",
+    "lifestyle_preferences": "vita universitaria in una grande città",
+    "budget": 8000, "origin": "Roma", "location": None, "gpa": 8.0, "max_distance": None,
+    "far_from_home": False, "english_language": False, "dorms_nearby": False,
+    "admission_test": True, "extracurricular_activities": True, "weights": None,
+}
+
+
+def ranking(recommendations):
+    return [(u["university"], round(u["final_score"], 6)) for u in recommendations]
+
+@pytest.mark.parametrize("max_distance", [None, 300])
+def test_session_matches_single_recommendation(catalog, max_distance):
+    profile = dict(PROFILE, max_distance=max_distance)
+    recommendations, recomputed = rs.ScoringSession().recommend(profile)
+    assert recomputed == list(rs.COMPONENT_FIELDS)
+    assert ranking(recommendations) == ranking(rs.recommend_universities(dict(profile)))
+
+def test_session_distance_limit_uses_candidates_only(catalog):
+    session = rs.ScoringSession()
+    recommendations, _ = session.recommend(dict(PROFILE, max_distance=300))
+    assert all(u["distance_km"] <= 300 for u in recommendations)
+    # colonne incrementali scartate: il profilo successivo senza vincolo le ricalcola tutte
+    assert not session.columns
+    _, recomputed = session.recommend(dict(PROFILE))
+    assert recomputed == list(rs.COMPONENT_FIELDS)
+
+def test_session_reembeds_only_changed_texts(catalog, monkeypatch):
+    session = rs.ScoringSession()
+    session.recommend(dict(PROFILE, max_distance=300))
+    embedded = []
+    embed_texts = rs.embed_texts
+    monkeypatch.setattr(rs, "embed_texts", lambda texts: embedded.extend(texts) or embed_texts(texts))
+    profile = dict(PROFILE, max_distance=300, aspiration_values="fare l'insegnante")
+    recommendations, recomputed = session.recommend(profile)
+    assert embedded == ["fare l'insegnante"]
+    assert recomputed == ["aspiration"]
+    assert ranking(recommendations) == ranking(rs.recommend_universities(dict(profile)))
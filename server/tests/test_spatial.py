@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import recommendation_system as rs
+from spatial import SpatialIndex, haversine_km
+
+
+PROFILE = {
+    "academic_profile": "mi piacciono la matematica e l'informatica",
+    "aspiration_values": "lavorare nella ricerca",
+    "lifestyle_preferences": "vita universitaria tranquilla",
+    "budget": 8000, "origin": "Aosta", "location": None, "gpa": 8.0, "max_distance": 30,
+    "far_from_home": False, "english_language": False, "dorms_nearby": False,
+    "admission_test": True, "extracurricular_activities": True, "weights": None,
+}
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    return rng.uniform(36, 47, 500), rng.uniform(7, 18, 500)
+
+@pytest.mark.parametrize("k", [1, 5, 50, 500, 600])
+def test_nearest_matches_brute_force(points, k):
+    lat, lon = points
+    index = SpatialIndex(lat, lon)
+    rows, dist = index.nearest(41.9, 12.5, k)
+    expected = np.sort(haversine_km(41.9, 12.5, lat, lon))[:k]
+    assert len(rows) == min(k, len(lat))
+    np.testing.assert_allclose(dist, expected)
+    np.testing.assert_allclose(haversine_km(41.9, 12.5, lat[rows], lon[rows]), dist)
+
+def test_within_matches_brute_force(points):
+    lat, lon = points
+    rows, dist = SpatialIndex(lat, lon).within(41.9, 12.5, 200)
+    expected = np.flatnonzero(haversine_km(41.9, 12.5, lat, lon) <= 200)
+    np.testing.assert_array_equal(rows, expected)
+    assert np.all(dist <= 200)
+
+def test_nearest_on_empty_index():
+    rows, dist = SpatialIndex(np.empty(0), np.empty(0)).nearest(41.9, 12.5, 3)
+    assert len(rows) == len(dist) == 0
+
+def test_sparse_radius_widens_to_the_nearest_universities(catalog):
+    coords = rs.city_coords("Aosta")
+    index = catalog.spatial_index()
+    assert len(index.within(coords["lat"], coords["lon"], 30)[0]) == 0
+    _, nearest_km = index.nearest(coords["lat"], coords["lon"], 3)
+
+    candidates = rs.distance_candidates(catalog, PROFILE, 3)
+    assert len(candidates) >= 3
+    distances = haversine_km(coords["lat"], coords["lon"], catalog.columns["lat"][candidates], catalog.columns["lon"][candidates])
+    assert distances.max() == pytest.approx(nearest_km[-1])
+
+def test_sparse_radius_ranking_is_the_same_on_every_path(catalog):
+    single = rs.recommend_universities(dict(PROFILE))
+    batch = rs.recommend_universities_batch([dict(PROFILE)], top_k=3, catalog=catalog)[0]
+    session, _ = rs.ScoringSession().recommend(dict(PROFILE))
+    ranking = lambda recommendations: [(u["university"], round(u["final_score"], 6)) for u in recommendations]
+    assert len(single) == 3
+    assert ranking(single) == ranking(batch) == ranking(session)
+    assert all(np.isfinite(u["final_score"]) for u in single)
+
+def test_batch_with_mixed_radii_matches_single_recommendations(catalog):
+    profiles = [
+        dict(PROFILE),
+        dict(PROFILE, origin="Milano", max_distance=0.3, location="Roma"),
+        dict(PROFILE, origin="Napoli", max_distance=50),
+        dict(PROFILE, origin="Bologna", max_distance=None),
+    ]
+    batch = rs.recommend_universities_batch([dict(p) for p in profiles], top_k=3, catalog=catalog)
+    for profile, recommendations in zip(profiles, batch):
+        single = rs.recommend_universities(dict(profile))
+        assert [u["university"] for u in recommendations] == [u["university"] for u in single]
+        assert [u["final_score"] for u in recommendations] == pytest.approx([u["final_score"] for u in single], abs=1e-5)
@@ -0,0 +1,11 @@
+// Handle both plain JSON and markdown-wrapped JSON
+export const parseProsCons = (raw: any) => {
+  if (typeof raw !== 'string') return raw;
+  const cleanJson = raw.replace(/```json\n?/g, '').replace(/```\n?/g, '').trim();
+  try {
+    return JSON.parse(cleanJson);
+  } catch (e) {
+    console.error('Failed to parse pros_cons:', e);
+    return raw;
+  }
+};
@@ -3,6 +3,7 @@ import { EmptyState } from "@/components/EmptyState";
 import { ConversationView } from "@/components/ConversationView";
 import { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
+import { parseProsCons } from "@/lib/prosCons";
 
 interface Message {
   id: number;
@@ -106,7 +107,8 @@ const Index = () => {
       const res = await fetch(`${API_BASE_URL}/get_question`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ response })
+        // tts: the server synthesizes the question audio while answering
+        body: JSON.stringify({ response, tts: true })
       });
       
       const data = await res.json();
@@ -122,13 +124,15 @@ const Index = () => {
         stopListening();
         
         // Speak the transition message
-        await speakText(data.question);
+        await speakText(data.question, data.audio_id);
         
         // Call generate_results endpoint to get the actual results
         try {
           const resultsRes = await fetch(`${API_BASE_URL}/generate_results`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' }
+            headers: { 'Content-Type': 'application/json' },
+            // Get the ranking right away, pros/cons are fetched by the Results page
+            body: JSON.stringify({ progressive: true })
           });
           
           const resultsData = await resultsRes.json();
@@ -144,18 +148,7 @@ const Index = () => {
               console.log('University Recommendations:', resultsData.recommendations);
             }
             if (resultsData.pros_cons) {
-              // Handle both plain JSON and markdown-wrapped JSON
-              parsedProsCons = resultsData.pros_cons;
-              if (typeof resultsData.pros_cons === 'string') {
-                // Remove markdown code blocks if present
-                const cleanJson = resultsData.pros_cons.replace(/```json\n?/g, '').replace(/```\n?/g, '').trim();
-                try {
-                  parsedProsCons = JSON.parse(cleanJson);
-                } catch (e) {
-                  console.error('Failed to parse pros_cons:', e);
-                  parsedProsCons = resultsData.pros_cons;
-                }
-              }
+              parsedProsCons = parseProsCons(resultsData.pros_cons);
               setProsCons(parsedProsCons);
               console.log('Pros & Cons Analysis:', parsedProsCons);
             }
@@ -165,6 +158,7 @@ const Index = () => {
               state: {
                 recommendations: resultsData.recommendations,
                 prosCons: parsedProsCons,
+                resultId: resultsData.pros_cons_pending ? resultsData.result_id : null,
                 weights: resultsData.weights
               }
             });
@@ -190,18 +184,7 @@ const Index = () => {
           console.log('University Recommendations:', data.recommendations);
         }
         if (data.pros_cons) {
-          // Handle both plain JSON and markdown-wrapped JSON
-          parsedProsCons = data.pros_cons;
-          if (typeof data.pros_cons === 'string') {
-            // Remove markdown code blocks if present
-            const cleanJson = data.pros_cons.replace(/```json\n?/g, '').replace(/```\n?/g, '').trim();
-            try {
-              parsedProsCons = JSON.parse(cleanJson);
-            } catch (e) {
-              console.error('Failed to parse pros_cons:', e);
-              parsedProsCons = data.pros_cons;
-            }
-          }
+          parsedProsCons = parseProsCons(data.pros_cons);
           setProsCons(parsedProsCons);
           console.log('Pros & Cons Analysis:', parsedProsCons);
         }
@@ -219,7 +202,7 @@ const Index = () => {
       }
       
       // Speak the question
-      await speakText(data.question);
+      await speakText(data.question, data.audio_id);
       
     } catch (error) {
       console.error('Error:', error);
@@ -228,15 +211,18 @@ const Index = () => {
     }
   };
 
-  const speakText = async (text: string) => {
+  const speakText = async (text: string, audioId?: string) => {
     setIsSpeaking(true);
     
     try {
-      const res = await fetch(`${API_BASE_URL}/text_to_speech`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text })
-      });
+      // Audio already being synthesized by get_question: no need to send the text again
+      const res = audioId
+        ? await fetch(`${API_BASE_URL}/audio/${audioId}`)
+        : await fetch(`${API_BASE_URL}/text_to_speech`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ text })
+          });
       
       if (!res.ok) throw new Error('TTS failed');
       
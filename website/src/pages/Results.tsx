@@ -1,5 +1,9 @@
+import { useEffect, useState } from "react";
 import { useNavigate, useLocation } from "react-router-dom";
 import { mockRecommendations, mockProsCons, mockWeights } from "@/data/mockResults";
+import { parseProsCons } from "@/lib/prosCons";
+
+const API_BASE_URL = "http://localhost:5002/api";
 
 export const Results = () => {
   const navigate = useNavigate();
@@ -7,9 +11,39 @@ export const Results = () => {
   
   // Use location state if available, otherwise fall back to mock data
   const recommendations = location.state?.recommendations || mockRecommendations;
-  const prosCons = location.state?.prosCons || mockProsCons;
+  const resultId = location.state?.resultId;
+  const [prosCons, setProsCons] = useState<any>(
+    location.state?.prosCons || (resultId ? null : mockProsCons)
+  );
   const weights = location.state?.weights || mockWeights;
 
+  // Pros/cons of progressive results arrive after the ranking: long-poll until ready
+  useEffect(() => {
+    if (!resultId || prosCons) return;
+    let cancelled = false;
+
+    const fetchProsCons = async () => {
+      while (!cancelled) {
+        try {
+          const res = await fetch(`${API_BASE_URL}/pros_cons/${resultId}?wait=20`);
+          if (res.status === 202) continue;
+          const data = await res.json();
+          if (!cancelled && data.pros_cons) {
+            setProsCons(parseProsCons(data.pros_cons));
+          }
+        } catch (error) {
+          console.error('Error fetching pros/cons:', error);
+        }
+        return;
+      }
+    };
+
+    fetchProsCons();
+    return () => {
+      cancelled = true;
+    };
+  }, [resultId]);
+
   if (!recommendations || recommendations.length === 0) {
     return (
       <div className="flex h-screen items-center justify-center">